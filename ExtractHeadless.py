@@ -0,0 +1,171 @@
+"""
+    ExtractHeadless.py
+    Command line feature extraction, the headless counterpart of ExtractWithProgress.py
+    Does not import tkinter, so it runs on extraction nodes without a display or under a scheduler
+
+    Progress is written to stdout as plain text lines or JSON lines (one object per report) with throughput and ETA
+
+    Usage:
+        python ExtractHeadless.py ..\\Datasets\\Benign_Backup ..\\extracted_features --label benign --workers 16
+        python ExtractHeadless.py ..\\Datasets\\Malicious_Backup ..\\extracted_features --label malicious --progress json
+        python ExtractHeadless.py ..\\Datasets\\Malicious_Backup ..\\triage_features --label malicious --features permissions used_hsware intents
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import FeatureExtractor
+import ParallelExtractor
+import ExtractionCache
+import ResumeIndex
+import FeatureWriter
+
+LABELS = ["benign", "malicious"] # Output folders are <label>_features, same layout ExtractWithProgress uses
+DIRECTORY_UNIQUE = "unique_features"
+PROGRESS_FORMATS = ["text", "json", "none"]
+DEFAULT_PROGRESS_INTERVAL = 5.0 # Seconds between progress reports
+
+class ProgressReporter:
+    """
+    Rate limited progress output for the headless runner
+    Reports at most once every `interval` seconds, plus a final report when closed
+    The total comes from the scanner, it keeps growing (shown as "N+") until the directory walk finishes
+    """
+
+    def __init__(self, scanner: ResumeIndex.UnprocessedApkScanner, progress_format: str = "text", interval: float = DEFAULT_PROGRESS_INTERVAL, stream=sys.stdout):
+        self.scanner = scanner
+        self.progress_format = progress_format
+        self.interval = interval
+        self.stream = stream
+        self.start_time = time.monotonic()
+        self.last_report = 0.0
+        self.files_processed = 0
+        self.status_counts = {}
+        self.cached_count = 0
+
+    def update(self, result: ParallelExtractor.ExtractionResult):
+        self.files_processed += 1
+        self.status_counts[result.status] = self.status_counts.get(result.status, 0) + 1
+        self.cached_count += result.cached
+        if time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def snapshot(self) -> dict:
+        elapsed_time = time.monotonic() - self.start_time
+        total_files = self.scanner.discovered
+        return {
+            "processed": self.files_processed,
+            "total": total_files,
+            "scanning": not self.scanner.done,
+            "statuses": dict(self.status_counts),
+            "cached": self.cached_count,
+            "elapsed_seconds": round(elapsed_time, 1),
+            "apks_per_second": round(self.files_processed / elapsed_time, 3) if elapsed_time else 0.0,
+            "eta_seconds": round(ParallelExtractor.estimate_time_remaining(elapsed_time, self.files_processed, total_files), 1),
+        }
+
+    def report(self):
+        self.last_report = time.monotonic()
+        if self.progress_format == "none":
+            return
+        progress = self.snapshot()
+        if self.progress_format == "json":
+            line = json.dumps(progress)
+        else:
+            statuses = " ".join(f"{status}={count}" for status, count in progress["statuses"].items())
+            total = f"{progress['total']}+" if progress["scanning"] else progress["total"]
+            line = (f"{progress['processed']}/{total} APKs | {progress['apks_per_second']:.2f} APKs/s | "
+                    f"Elapsed: {ParallelExtractor.format_duration(progress['elapsed_seconds'])} | "
+                    f"ETA: {ParallelExtractor.format_duration(progress['eta_seconds'])} | {statuses} cached={progress['cached']}")
+        self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def close(self):
+        self.report()
+
+def read_failed_apks(out_dir: str) -> dict[str, bool]:
+    """
+    Reads apk_failed_log.txt so APKs that timed out or crashed in a previous run can be skipped
+    """
+    failed_apks = {}
+    file_path = os.path.join(out_dir, ParallelExtractor.FAILED_LOG_NAME)
+    if os.path.exists(file_path):
+        try:
+            with open(file_path, "r") as f:
+                for line in f:
+                    name = line.partition("\t")[0].strip()
+                    if name:
+                        failed_apks[name] = True
+        except Exception as e:
+            print(f"Error reading failed log: {e}")
+    return failed_apks
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract features from a directory of APKs without a GUI")
+    parser.add_argument("input_dir", help="directory of APKs, walked recursively")
+    parser.add_argument("output_dir", help="root output directory, gets <label>_features/, unique_features/ and apk_log.txt")
+    parser.add_argument("--label", required=True, choices=LABELS, help="which feature folder the APKs are written to")
+    parser.add_argument("--workers", type=int, default=ParallelExtractor.DEFAULT_WORKERS, help="number of extraction processes")
+    parser.add_argument("--timeout", type=float, default=ParallelExtractor.DEFAULT_TIMEOUT, help="seconds per APK before its worker is killed")
+    parser.add_argument("--features", nargs="+", choices=FeatureExtractor.FEATURE_TYPES, default=FeatureExtractor.FEATURE_TYPES,
+                        help="feature types to extract, manifest only types (permissions, used_hsware, intents) skip dex analysis")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="re-extract APKs already listed in apk_log.txt")
+    parser.add_argument("--skip-failed", action="store_true", help="skip APKs listed in apk_failed_log.txt from a previous run")
+    parser.add_argument("--cache", default=None, help=f"extraction cache file, defaults to <output_dir>/{ExtractionCache.DEFAULT_CACHE_NAME}")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="always analyze APKs, even if an identical APK was analyzed before")
+    parser.add_argument("--cache-max-gb", type=float, default=ExtractionCache.DEFAULT_MAX_BYTES / 1024 ** 3, help="extraction cache size limit")
+    parser.add_argument("--flush-count", type=int, default=FeatureWriter.DEFAULT_FLUSH_COUNT, help="APKs per batched write of apk_log.txt and unique files")
+    parser.add_argument("--flush-interval", type=float, default=FeatureWriter.DEFAULT_FLUSH_INTERVAL, help="seconds before a partial write batch is flushed")
+    parser.add_argument("--progress", choices=PROGRESS_FORMATS, default="text", help="progress output format")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_PROGRESS_INTERVAL, help="seconds between progress reports")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Extraction Canceled: Directory not found: {args.input_dir}")
+        return 1
+
+    out_dir_features = os.path.join(args.output_dir, f"{args.label}_features")
+    out_dir_unique = os.path.join(args.output_dir, DIRECTORY_UNIQUE)
+
+    FeatureWriter.recover_journal(args.output_dir) # Before the log is read, an interrupted batch is rolled back
+    skip = []
+    resume_index = None
+    if args.resume:
+        resume_index = ResumeIndex.ResumeIndex(args.output_dir)
+        skip.append(resume_index)
+    if args.skip_failed:
+        skip.append(read_failed_apks(args.output_dir))
+    # NOTE: the scanner is consumed lazily by the workers, extraction starts while the tree is still being walked
+    scanner = ResumeIndex.UnprocessedApkScanner(args.input_dir, skip)
+
+    cache_path = None
+    if args.use_cache:
+        cache_path = args.cache or os.path.join(args.output_dir, ExtractionCache.DEFAULT_CACHE_NAME)
+
+    print(f"Extracting APKs from {args.input_dir} with {args.workers} workers")
+    reporter = ProgressReporter(scanner, args.progress, args.progress_interval)
+    try:
+        ParallelExtractor.extract_parallel(scanner, out_dir_features, out_dir_unique,
+                                           workers=args.workers, timeout=args.timeout,
+                                           feature_types=args.features, cache_path=cache_path,
+                                           cache_max_bytes=int(args.cache_max_gb * 1024 ** 3),
+                                           flush_count=args.flush_count, flush_interval=args.flush_interval, on_result=reporter.update)
+    except KeyboardInterrupt:
+        print("Extraction stopped by user, rerun to resume")
+        return 130
+    finally:
+        reporter.close()
+        if resume_index is not None:
+            resume_index.close()
+    if scanner.done and not scanner.discovered:
+        print(f"Extraction Canceled: Directory contains no unprocessed files ({scanner.skipped} already processed)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,10 @@ import time
 import os
 import gc
 import FeatureExtractor 
+import ResumeIndex
+import FeatureWriter
+import ParallelExtractor # estimate_time_remaining and format_duration are shared with the headless runner
+# NOTE: Needs a display for tkinter, use ExtractHeadless.py for command line/headless extraction
 
 # TODO: add a way to pick up from were we previously left of with each features file, currently unique_features does this, but not each individual file
 # NOTE: Set the desired directory to extract from. 
@@ -39,6 +43,9 @@ current_dir_path = ''
 current_file_path = ''
 current_file_name = ''
 
+# Buffered writes of feature files, apk_log.txt and unique features, created in extraction_setup
+WRITER = None
+
 # Times to track total time spent processing files
 START_TIME = 0
 elapsed_time = 0
@@ -69,20 +76,21 @@ def preprocess_dir():
     total_dirs = 0
     total_files = 0
     dir_file_list = []
-    #previously_processed_apks = FeatureExtractor.reload_processed_apks(OUT_DIRECTORY)
-
-    # Scan directories
-    for dirpath, _, filenames in os.walk(ROOT_DIRECTORY):
-        # NOTE: DREBINS FILES DO NOT END WITH APK
-        #valid_filenames = [f for f in filenames if f.lower().endswith('.apk')]
-        previously_processed_apks = FeatureExtractor.reload_processed_apks(OUT_DIRECTORY)
-        unprocessed_apks = []
-        for filename in filenames:
-            if filename.strip() not in previously_processed_apks:
-                unprocessed_apks.append(filename.strip())
-        total_files += len(unprocessed_apks)
-        if unprocessed_apks: # Add the entry if it contains apk files
-            dir_file_list.append((dirpath, unprocessed_apks))   
+    # NOTE: loaded once, was reloaded for every directory. The index only reads apk_log.txt lines added since the last run
+    FeatureWriter.recover_journal(OUT_DIRECTORY) # Roll back a write batch that was interrupted last run before reading the log
+    with ResumeIndex.ResumeIndex(OUT_DIRECTORY) as previously_processed_apks:
+
+        # Scan directories
+        for dirpath, _, filenames in os.walk(ROOT_DIRECTORY):
+            # NOTE: DREBINS FILES DO NOT END WITH APK
+            #valid_filenames = [f for f in filenames if f.lower().endswith('.apk')]
+            unprocessed_apks = []
+            for filename in filenames:
+                if filename.strip() not in previously_processed_apks:
+                    unprocessed_apks.append(filename.strip())
+            total_files += len(unprocessed_apks)
+            if unprocessed_apks: # Add the entry if it contains apk files
+                dir_file_list.append((dirpath, unprocessed_apks))   
     total_dirs = len(dir_file_list)  # The total number of steps in the first bar is the number of directories WITH files to process
         
     TOTAL_DIR_COUNT = total_dirs
@@ -96,15 +104,9 @@ def calculate_etr():
 
     global etr_label, elapsed_time
         
-    average_time_per_file = elapsed_time / (total_files_processed if total_files_processed else 1)
-    files_remaining = TOTAL_FILE_COUNT - total_files_processed
-    time_remaining_seconds = files_remaining * average_time_per_file
-    
-    etr_hours = int(time_remaining_seconds // 3600)
-    etr_minutes = int((time_remaining_seconds // 60) % 60)
-    etr_seconds = int(time_remaining_seconds % 60)
+    time_remaining_seconds = ParallelExtractor.estimate_time_remaining(elapsed_time, total_files_processed, TOTAL_FILE_COUNT)
     
-    etr_label.config(text=f"Approximate Time Remaining: {etr_hours:02d}h {etr_minutes:02d}m {etr_seconds:02d}s")
+    etr_label.config(text=f"Approximate Time Remaining: {ParallelExtractor.format_duration(time_remaining_seconds)}")
 
 def update_gui(): 
     global main_progress_bar, sub_progress_bar
@@ -197,6 +199,7 @@ def extract_with_progress():
 
         # if done with every dir don't do anything else
         if total_dirs_processed >= TOTAL_DIR_COUNT:
+            WRITER.close() # Writes the last batch
             return
         
         # reset current_dir_file_count
@@ -223,8 +226,7 @@ def extract_with_progress():
     
     # Update unique features tracking 
     if extracted_features:
-        FeatureExtractor.write_features(extracted_features, current_file_path, OUT_DIRECTORY_FEATURES)
-        FeatureExtractor.update_unique_features(extracted_features, OUT_DIRECTORY_UNIQUE)
+        WRITER.write(extracted_features, current_file_path)
 
     # File extracted, update elapsed time
     elapsed_time = time.time() - START_TIME
@@ -244,7 +246,7 @@ def extract_with_progress():
 def extraction_setup():
     # Set up initial values for recursive loop extract_with_progress
 
-    global START_TIME
+    global START_TIME, WRITER
     global total_dirs_processed, current_dir_file_count, current_dir_total_file_count
     global current_dir_file_list, current_dir_path, current_file_name
 
@@ -253,6 +255,7 @@ def extraction_setup():
     current_dir_total_file_count = len(current_dir_file_list)
 
     # Reload unique_features.txt 
+    WRITER = FeatureWriter.FeatureWriter(OUT_DIRECTORY_FEATURES, OUT_DIRECTORY_UNIQUE)
     FeatureExtractor.reload_unique_features(OUT_DIRECTORY_UNIQUE)
 
 
@@ -0,0 +1,152 @@
+"""
+    ExtractionCache.py
+    Persistent cache of extract_features results keyed by the SHA-256 of the APK bytes
+
+    apk_log.txt only knows file names, so the same sample under a different name (or re-downloaded from AndroZoo)
+    was analyzed again. The cache is a single SQLite file, each entry is the extracted feature dictionary as zlib compressed JSON.
+
+    Entries are stamped with FeatureExtractor.EXTRACTOR_VERSION, opening the cache with a different version empties it.
+    The cache is bounded by max_bytes, least recently used entries are evicted first.
+
+    NOTE: One writer at a time. Extraction workers only call get(), the main process calls put() and touch()
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+
+import FeatureExtractor
+
+DEFAULT_CACHE_NAME = "extraction_cache.sqlite"
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3 # 20GB
+EVICT_TO_FRACTION = 0.9 # Evict down to 90% of max_bytes so every put near the limit doesn't evict again
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_apk(apk_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of the APK file
+    """
+    sha256 = hashlib.sha256()
+    with open(apk_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def encode_features(features: dict[str, dict[str, int]]) -> bytes:
+    return zlib.compress(json.dumps(features, separators=(",", ":")).encode("utf-8"))
+
+def decode_features(data: bytes, feature_types: list[str]) -> dict[str, dict[str, int]]:
+    """
+    Rebuilds a feature_dictionary() holding only the requested feature types
+    """
+    stored = json.loads(zlib.decompress(data).decode("utf-8"))
+    features = FeatureExtractor.feature_dictionary(feature_types)
+    for feature_type in feature_types:
+        features[feature_type].update(stored.get(feature_type, {}))
+    return features
+
+class ExtractionCache:
+    """
+    SHA-256 keyed store of extracted features
+
+    Args:
+        cache_path (str): SQLite file, created if missing
+        max_bytes (int): limit on the total compressed size of the entries
+        read_only (bool): open for lookups only (extraction workers), skips version checks and eviction
+    """
+
+    def __init__(self, cache_path: str, max_bytes: int = DEFAULT_MAX_BYTES, read_only: bool = False):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+
+        if read_only:
+            self._db = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True)
+        else:
+            cache_dir = os.path.dirname(cache_path)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self._db = sqlite3.connect(cache_path)
+            self._db.execute("PRAGMA journal_mode=WAL") # Lets workers read while the main process writes
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                             "sha256 TEXT PRIMARY KEY, feature_types TEXT, data BLOB, size INTEGER, last_used REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._check_version()
+            self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check_version(self):
+        """
+        Empties the cache if it was written by a different extractor version
+        """
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'extractor_version'").fetchone()
+        version = str(FeatureExtractor.EXTRACTOR_VERSION)
+        if row is None or row[0] != version:
+            if row is not None:
+                print(f"INFO: Extraction cache was made by extractor version {row[0]}, clearing for version {version}")
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('extractor_version', ?)", (version,))
+
+    def get(self, sha256: str, feature_types: list[str] = FeatureExtractor.FEATURE_TYPES) -> dict[str, dict[str, int]] | None:
+        """
+        Looks up an APK's features
+
+        Returns:
+            dict[str, dict[str, int]] | None: the cached features, None if the APK is not cached
+            or the cached entry did not extract every requested feature type
+        """
+        row = self._db.execute("SELECT feature_types, data FROM entries WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None or not set(feature_types) <= set(row[0].split(",")):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_features(row[1], feature_types)
+
+    def touch(self, sha256: str):
+        """
+        Marks an entry as recently used so eviction keeps it
+        """
+        self._db.execute("UPDATE entries SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+        self._db.commit()
+
+    def put(self, sha256: str, features: dict[str, dict[str, int]]):
+        """
+        Stores an APK's features, replacing any previous entry, then evicts if the cache is over max_bytes
+        """
+        data = encode_features(features)
+        old = self._db.execute("SELECT size FROM entries WHERE sha256 = ?", (sha256,)).fetchone()
+        self._db.execute("INSERT OR REPLACE INTO entries (sha256, feature_types, data, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                         (sha256, ",".join(features), data, len(data), time.time()))
+        self.total_bytes += len(data) - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        self._db.commit()
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache is under EVICT_TO_FRACTION of max_bytes
+        """
+        target = self.max_bytes * EVICT_TO_FRACTION
+        cursor = self._db.execute("SELECT sha256, size FROM entries ORDER BY last_used")
+        evicted = []
+        for sha256, size in cursor:
+            if self.total_bytes <= target:
+                break
+            evicted.append((sha256,))
+            self.total_bytes -= size
+        self._db.executemany("DELETE FROM entries WHERE sha256 = ?", evicted)
+
+    def close(self):
+        self._db.close()
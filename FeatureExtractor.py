@@ -8,10 +8,15 @@
 # TODO: change functions that use global unique_feature list to pass it out as an object
 
 import os
-from androguard.misc import AnalyzeAPK # APK analysis
-#from androguard.core.apk import APK # Simpler but faster analysis, doesn't give us everything
+import atexit # Closes unique_features when the run ends
+from typing import Callable
+#from androguard.misc import AnalyzeAPK # APK analysis, NOTE: replaced with the three steps it runs so cheap feature types can skip the expensive ones
+from androguard.core.apk import APK # Manifest only, simpler but faster analysis, enough for permissions, used_hsware and intents
+from androguard.core.dex import DEX # Parsed dex files, enough for urls (dex strings)
+from androguard.core.analysis.analysis import Analysis # Cross references, only needed for api_calls and libraries
 #from typing import Dict, List # dict to retain insertion order, NOTE: Dict has been replaced with dict, typing not needed (after 3.9)
 from collections import defaultdict # Used to set the default of value of the dictionary to be 1
+from UniqueFeatureStore import UniqueFeatureStore # Interned, bounded memory storage for unique features across the whole dataset
 
 '''
 #------------------------------------------------------------------------------------------------------------
@@ -51,6 +56,18 @@ from collections import defaultdict # Used to set the default of value of the di
 FEATURE_TYPES = ["permissions", "used_hsware", "intents", "api_calls", "libraries", "urls"]
 FEATURE_TAGS = ["Permission", "Used Hardware/Software", "Intent", "API", "Library", "URL"] # Tags that are written into the feature files
 
+# Bump whenever extract_features would produce different output for the same APK, 
+# cached extraction results (ExtractionCache.py) from an older version are thrown out
+EXTRACTOR_VERSION = 2
+
+# Extraction tiers, cheapest first. Only the tiers needed for the requested feature types are run
+MANIFEST_FEATURE_TYPES = FEATURE_TYPES[0:3] # permissions, used_hsware, intents: AndroidManifest.xml only
+DEX_FEATURE_TYPES = FEATURE_TYPES[5:6] # urls: dex string tables, no cross reference analysis
+XREF_FEATURE_TYPES = FEATURE_TYPES[3:5] # api_calls, libraries: full dx.get_methods()/get_xref_to() analysis, by far the slowest
+
+# Called classes that start with one of these are APIs, everything else is considered an external library
+API_PREFIXES = ("android", "java")
+
 # NOTE: Directory Path to test extracting a single file, change to extract from a different file
 #DEFAULT_TEST_APK_PATH = r"..\Datasets\Malicious\amd_data\DroidKungFu\variety2\0c3df9c1d759a53eb16024b931a3213a.apk"
 #DEFAULT_TEST_APK_PATH = r"..\Datasets\Malicious\amd_data\DroidKungFu\variety2\01c3cc236c3587d20584ed84751c655c.apk"
@@ -81,14 +98,42 @@ def feature_dictionary(feature_types: list[str] = FEATURE_TYPES) -> dict[str, di
         feature_dict[feature_type] = defaultdict(int)
     return feature_dict
 
+TAG_TO_TYPE = dict(zip(FEATURE_TAGS, FEATURE_TYPES))
+
+def parse_feature_line(line: str) -> tuple[str, str, int] | None:
+    """
+    Parses one line of a feature file, either "Tag: feature" (write_features) or "Tag: feature count" (ReduceCardinality.write_feature_file)
+
+    Args:
+        line (str): line of a feature or unique feature file
+    Returns:
+        tuple[str, str, int] | None: (feature_type, feature without its tag, count), None for empty or unknown lines
+    """
+    tag, _, body = line.partition(": ")
+    feature_type = TAG_TO_TYPE.get(tag)
+    if feature_type is None:
+        return None
+    feature = body.strip()
+    count = 1
+    head, _, tail = feature.rpartition(" ")
+    if head and tail.isdigit(): # Trailing count
+        feature = head.rstrip()
+        count = int(tail)
+    if not feature:
+        return None
+    return feature_type, feature, count
+
 # dictionary to store all unique features found across every apk
 # Retains insertion order
 # Capturing features seperately to put in separate files
-unique_features = feature_dictionary()
+# NOTE: a UniqueFeatureStore instead of feature_dictionary(), same dictionary interface but spills to disk at corpus scale
+UNIQUE_FEATURES_MEMORY_BUDGET = 2 * 1024 ** 3 # 2GB
+unique_features = UniqueFeatureStore(FEATURE_TYPES, UNIQUE_FEATURES_MEMORY_BUDGET)
+atexit.register(unique_features.close) # Past the memory budget it spills to a temporary SQLite file, GUI and CLI runs never close it
 
 # TODO: Have Extract features categorize and count
 # TODO: Remove Feature tags from dictionary keys, they mess with future functions (designed differently)
-def extract_features(apk_path: str) -> dict[str, dict[str, int]]: 
+def extract_features(apk_path: str, feature_types: list[str] = FEATURE_TYPES) -> dict[str, dict[str, int]]: 
     """
     Extracts features from an apk file and returns them as a list 
 
@@ -100,72 +145,147 @@ def extract_features(apk_path: str) -> dict[str, dict[str, int]]:
         External Libraries - Use of external libraries within the application NOTE: Highest actual cardinality, need to post process
         URL - URLS visited by the application, Cardinality is relatively low
 
+    Only the analysis needed for feature_types is run, manifest only types skip dex parsing 
+    and urls skip the cross reference analysis (see MANIFEST_FEATURE_TYPES, DEX_FEATURE_TYPES, XREF_FEATURE_TYPES)
+
     Args:
         apk_path (str): The path to the APK file.
+        feature_types (list[str]): feature types to extract. Defaults to FEATURE_TYPES (everything)
         
     Returns:
-        dict[str, dict[str, int]]: A dictionary of each feature type and a list of extracted features of that type from the APK.
+        dict[str, dict[str, int]]: A dictionary of each requested feature type and a list of extracted features of that type from the APK.
     """
 
     # Extract Features
-    extracted_features = feature_dictionary()
+    extracted_features = feature_dictionary(feature_types)
 
     try:
         # Load the APK file using androguard's APK class
-        #a = APK(apk_path) # Less compute intensive, but less data available
-        a, d, dx = AnalyzeAPK(apk_path) 
-        
-        # ---Extract Features---
-
-        # Permissions and used hardware/software are easy
-        # NOTE: No need to use dict[] because extracted features handles duplicates
-        permissions = a.get_permissions()
-        hardware_software = a.get_features()
-
-        # Intents need to be extracted from the string lists made by a.get_activities(), a.get_services() and a.get_recievers()
-        # a.get_intent_filters(itemtype, item) gets a dictionary of components for each item in each list
-        # itemtypes: activity, service, reciever 
-        # each component then has 3 main intent types (i.e. action, category, data)
-        # TODO: Make another enum for itemtypes for best coding practice
-        activities = a.get_activities()
-        services = a.get_services()
-        recievers = a.get_receivers()
-        intents = [] # NOTE: Using a list, overlaps will be removed by the extracted_features dict
-        for activity in activities: 
-            act = a.get_intent_filters("activity", activity)
-            for categories in act:
-                for intent in act[categories]:
-                    if type(intent) == str: # NOTE: No need to check for empty strings, checked when adding to extracted_features
-                        intents.append(intent)
-        for service in services: 
-            serv = a.get_intent_filters("service", service)
-            for categories in serv:
-                for intent in serv[categories]:
-                    if type(intent) == str: # NOTE: Needed to check the intent was a string and not another list data type (because that did happen once)
-                        intents.append(intent)
-        for reciever in recievers: 
-            rec = a.get_intent_filters("reciever", reciever)
-            for categories in rec:
-                for intent in rec[categories]:
-                    if type(intent) == str:
-                        intents.append(intent)
+        a = APK(apk_path) # Less compute intensive, manifest data is available right away
+        extract_manifest_features(a, extracted_features)
+        extract_dex_features(a, extracted_features)
+
+    except FileNotFoundError:
+        print(f"Error: APK file not found at path: {apk_path}")
+        return []
+    except Exception as e:
+        print(f"Error processing APK {apk_path}: {e}")
+        return []
     
+    return extracted_features
+
+def extract_features_tiered(apk_path: str, needs_full: Callable[[dict[str, dict[str, int]]], bool], 
+                            feature_types: list[str] = FEATURE_TYPES) -> dict[str, dict[str, int]]:
+    """
+    Triage extraction, runs the cheap manifest pass first and only runs the dex passes 
+    for APKs where needs_full(manifest_features) returns True (e.g. a fast model scores the APK as uncertain)
+
+    Args:
+        apk_path (str): The path to the APK file.
+        needs_full (Callable): takes the manifest features, returns True if the dex feature types should be extracted too
+        feature_types (list[str]): feature types to extract if the full pass runs. Defaults to FEATURE_TYPES
+    Returns:
+        dict[str, dict[str, int]]: manifest features, plus the dex feature types when the full pass ran
+    """
+    manifest_types = [feature_type for feature_type in feature_types if feature_type in MANIFEST_FEATURE_TYPES]
+    extracted_features = feature_dictionary(manifest_types)
+
+    try:
+        a = APK(apk_path)
+        extract_manifest_features(a, extracted_features)
+        if needs_full(extracted_features):
+            dex_features = feature_dictionary([feature_type for feature_type in feature_types if feature_type not in MANIFEST_FEATURE_TYPES])
+            extract_dex_features(a, dex_features)
+            extracted_features.update(dex_features)
+    except FileNotFoundError:
+        print(f"Error: APK file not found at path: {apk_path}")
+        return []
+    except Exception as e:
+        print(f"Error processing APK {apk_path}: {e}")
+        return []
+
+    return extracted_features
+
+def extract_manifest_features(a: APK, extracted_features: dict[str, dict[str, int]]):
+    """
+    Adds permissions, used hardware/software and intents from the manifest to extracted_features
+    Only the feature types that are keys of extracted_features are extracted
+
+    Args:
+        a (APK): androguard APK object
+        extracted_features (dict[str, dict[str, int]]): feature dictionary to fill in, see feature_dictionary()
+    """
+
+    # Permissions and used hardware/software are easy
+    # NOTE: No need to use dict[] because extracted features handles duplicates
+    if FEATURE_TYPES[0] in extracted_features:
+        for p in a.get_permissions():
+            if len(p): # Check for empty strings
+                extracted_features[FEATURE_TYPES[0]][f"{FEATURE_TAGS[0]}: {p}"] = 1 
+    if FEATURE_TYPES[1] in extracted_features:
+        for hs in a.get_features():
+            if len(hs):
+                extracted_features[FEATURE_TYPES[1]][f"{FEATURE_TAGS[1]}: {hs}"] = 1
+
+    # Intents need to be extracted from the string lists made by a.get_activities(), a.get_services() and a.get_recievers()
+    # a.get_intent_filters(itemtype, item) gets a dictionary of components for each item in each list
+    # itemtypes: activity, service, reciever 
+    # each component then has 3 main intent types (i.e. action, category, data)
+    # TODO: Make another enum for itemtypes for best coding practice
+    if FEATURE_TYPES[2] in extracted_features:
+        intents = [] # NOTE: Using a list, overlaps will be removed by the extracted_features dict
+        for itemtype, items in (("activity", a.get_activities()), ("service", a.get_services()), ("reciever", a.get_receivers())):
+            for item in items: 
+                filters = a.get_intent_filters(itemtype, item)
+                for categories in filters:
+                    for intent in filters[categories]:
+                        if type(intent) == str: # NOTE: Needed to check the intent was a string and not another list data type (because that did happen once)
+                            intents.append(intent)
+        # intents is a list[str], no longer a dictionary
+        for intent in intents:
+            if len(intent):
+                extracted_features[FEATURE_TYPES[2]][f"{FEATURE_TAGS[2]}: {intent}"] = 1
+
+def extract_dex_features(a: APK, extracted_features: dict[str, dict[str, int]]):
+    """
+    Adds api calls, libraries and urls from the APK's dex files to extracted_features
+    Dex files are only parsed if urls, api_calls or libraries are requested, 
+    and the cross reference analysis only runs for api_calls or libraries
+
+    Args:
+        a (APK): androguard APK object
+        extracted_features (dict[str, dict[str, int]]): feature dictionary to fill in, see feature_dictionary()
+    """
+    wants_xref = any(feature_type in extracted_features for feature_type in XREF_FEATURE_TYPES)
+    wants_strings = any(feature_type in extracted_features for feature_type in DEX_FEATURE_TYPES)
+    if not (wants_xref or wants_strings):
+        return
+
+    # NOTE: same steps as androguard's AnalyzeAPK, minus the decompiler which we never use
+    d = [DEX(dex_bytes, using_api=a.get_target_sdk_version()) for dex_bytes in a.get_all_dex()]
+
+    if wants_xref:
+        dx = Analysis()
+        for dex in d:
+            dx.add(dex)
+        dx.create_xref()
+
         # Classes (APIs and External Libraries) are extracted with the dx.get_methods() and the method.get_xref_to() commands
         # Checking method calls is the most effective way to assure all imported classes are found
-        # APIs start with android or java typically, everything else is considered an external library
-        apis = []
-        libraries = []
-        methods = dx.get_methods()
-        for method in methods:
-            for _, call, _ in method.get_xref_to():
-                classname = call.class_name[1:-1].replace("/", ".")   # Remove leading 'L' and trailing ';' Replace '/' with '.'
-                methodname = call.name
-                fullname = f"{classname}.{methodname}"
-                if fullname.startswith("android") or fullname.startswith("java"):
-                    apis.append(fullname)
-                else:
-                    libraries.append(fullname)
+        apis, libraries = collect_method_calls(dx.get_methods())
+
+        # apis
+        if FEATURE_TYPES[3] in extracted_features:
+            for api in apis:
+                if len(api):
+                    extracted_features[FEATURE_TYPES[3]][f"{FEATURE_TAGS[3]}: {api}"] = 1
+        # libraries or class calls, need to settle on a name
+        if FEATURE_TYPES[4] in extracted_features:
+            for library in libraries:
+                if len(library):
+                    extracted_features[FEATURE_TYPES[4]][f"{FEATURE_TAGS[4]}: {library}"] = 1
 
+    if wants_strings:
         # URLS are in the d object, which is an array of strings(?)
         # TODO: There is a lot of cleaning to be done on these strings 
         # and because we need tokenization to make them useful we will extract the raw strings 
@@ -179,40 +299,46 @@ def extract_features(apk_path: str) -> dict[str, dict[str, int]]:
                 string = string.strip()
                 if string.startswith("https://") or string.startswith("http://"):
                     urls.append(string.strip())
-
-        # Put features in extracted_features with labels (labels are helpful)
-        for p in permissions:
-            if len(p): # Check for empty strings
-                extracted_features[FEATURE_TYPES[0]][f"{FEATURE_TAGS[0]}: {p}"] = 1 
-        for hs in hardware_software:
-            if len(hs):
-                extracted_features[FEATURE_TYPES[1]][f"{FEATURE_TAGS[1]}: {hs}"] = 1
-        # intents is a list[str], no longer a dictionary
-        for intent in intents:
-            if len(intent):
-                extracted_features[FEATURE_TYPES[2]][f"{FEATURE_TAGS[2]}: {intent}"] = 1
-        # apis
-        for api in apis:
-            if len(api):
-                extracted_features[FEATURE_TYPES[3]][f"{FEATURE_TAGS[3]}: {api}"] = 1
-        # libraries or class calls, need to settle on a name
-        for library in libraries:
-            if len(library):
-                extracted_features[FEATURE_TYPES[4]][f"{FEATURE_TAGS[4]}: {library}"] = 1
         # urls
         for url in urls:
             if len(url):
                 extracted_features[FEATURE_TYPES[5]][f"{FEATURE_TAGS[5]}: {url}"] = 1
-
-    except FileNotFoundError:
-        print(f"Error: APK file not found at path: {apk_path}")
-        return []
-    except Exception as e:
-        print(f"Error processing APK {apk_path}: {e}")
-        return []
-    
-    return extracted_features
     
+def collect_method_calls(methods) -> tuple[list[str], list[str]]:
+    """
+    Walks every call edge (method.get_xref_to()) once and returns the distinct called methods as "package.Class.method" strings
+    split into APIs and libraries, in the order they were first called
+
+    Large apps have millions of call edges but only thousands of distinct called methods, 
+    so edges are deduplicated on the called MethodAnalysis object before any string work is done
+
+    Args:
+        methods (Iterable[MethodAnalysis]): dx.get_methods()
+    Returns:
+        tuple[list[str], list[str]]: (apis, libraries)
+    """
+
+    # Dedup callees by object, NOTE: MethodAnalysis doesn't define __hash__ so this is an identity lookup, no property access per edge
+    callees = {} # dict instead of set to keep first call order
+    for method in methods:
+        for _, call, _ in method.get_xref_to():
+            callees[call] = None
+
+    # Different MethodAnalysis objects can still share a class and method name (overloads), dedup those before building strings
+    called_names = {}
+    for call in callees:
+        called_names[(call.class_name, call.name)] = None
+
+    apis = []
+    libraries = []
+    for class_name, method_name in called_names:
+        fullname = f"{class_name[1:-1].replace('/', '.')}.{method_name}" # Remove leading 'L' and trailing ';' Replace '/' with '.'
+        if fullname.startswith(API_PREFIXES):
+            apis.append(fullname)
+        else:
+            libraries.append(fullname)
+    return apis, libraries
+
 def write_features(extracted_features: dict[str, dict[str, int]], apk_path: str, output_dir: str):
     """
     Writes a list of features to a file that shares a name with the apk with '.txt' appended.
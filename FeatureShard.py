@@ -0,0 +1,368 @@
+"""
+    FeatureShard.py
+    Binary container for the features of many APKs, an alternative to one "Tag: feature count" text file per APK
+
+    A shard holds every APK of a directory in one file:
+        - a vocabulary of (feature type, feature) pairs, features are stored once per shard and referred to by ID
+        - the APK names (feature file names, e.g. <md5>.apk.txt)
+        - one record per APK: (feature ID, count) pairs, found through an offset table
+
+    Layout (little endian, every section starts 8 byte aligned):
+        header          magic, version, record/vocabulary/entry counts and section offsets (HEADER_FORMAT)
+        entries         ENTRY_DTYPE[n_entries], the records back to back
+        record offsets  uint64[n_records + 1], record i is entries[offsets[i]:offsets[i + 1]]
+        names           uint64[n_records + 1] offsets into a utf-8 blob
+        vocabulary      uint8[n_features] feature type index, uint64[n_features + 1] offsets into a utf-8 blob
+        meta            JSON, the FEATURE_TYPES and FEATURE_TAGS the type indexes refer to
+
+    Readers memory map the file, a record is two numpy views and nothing is parsed until a string is asked for.
+    Feature IDs are local to a shard, map them to a global index once per shard with remap()
+
+    Usage:
+        python FeatureShard.py to-shard ..\\reduced_extracted_features\\malicious_features ..\\shards\\malicious.shard
+        python FeatureShard.py to-text ..\\shards\\malicious.shard ..\\reduced_extracted_features\\malicious_features
+"""
+
+import os
+import json
+import mmap
+import struct
+import argparse
+from array import array
+from typing import Iterator
+
+import numpy as np
+
+import FeatureExtractor
+
+MAGIC = b"APKSHRD\x00"
+VERSION = 1
+HEADER_FORMAT = "<8sII8Q" # magic, version, reserved, n_records, n_features, n_entries, offsets of: record offsets, names, vocabulary types, vocabulary strings, meta
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ENTRY_DTYPE = np.dtype([("id", "<u4"), ("count", "<u4")])
+MAX_COUNT = 2 ** 32 - 1
+SHARD_EXTENSION = ".shard"
+
+def _pad(f):
+    """
+    Pads the file to the next 8 byte boundary and returns the position
+    """
+    position = f.tell()
+    if position % 8:
+        f.write(b"\x00" * (8 - position % 8))
+    return f.tell()
+
+def _write_strings(f, strings: list[str]) -> int:
+    """
+    Writes uint64 offsets followed by the utf-8 blob, returns the section offset
+    """
+    section = _pad(f)
+    encoded = [string.encode("utf-8", errors="ignore") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    f.write(offsets.tobytes())
+    f.write(b"".join(encoded))
+    return section
+
+class ShardWriter:
+    """
+    Streams APK records into a new shard, only the vocabulary and the names are kept in memory
+
+    The shard is written to <shard_path>.tmp and renamed on close(), a shard that exists is always complete
+
+    Args:
+        shard_path (str): file to create
+    """
+
+    def __init__(self, shard_path: str):
+        self.shard_path = shard_path
+        shard_dir = os.path.dirname(shard_path)
+        if shard_dir and not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+        self._temp_path = shard_path + ".tmp"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(b"\x00" * HEADER_SIZE) # Filled in by close()
+
+        self._vocabulary_ids: dict[tuple[int, str], int] = {}
+        self._vocabulary_types = array("B")
+        self._vocabulary: list[str] = []
+        self._names: list[str] = []
+        self._record_offsets = array("Q", [0])
+        self._type_indexes = {feature_type: i for i, feature_type in enumerate(FeatureExtractor.FEATURE_TYPES)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else: # Don't leave a half written shard behind
+            self._file.close()
+            os.remove(self._temp_path)
+
+    def add(self, name: str, features: dict[str, dict[str, int]]):
+        """
+        Appends one APK
+
+        Args:
+            name (str): APK or feature file name
+            features (dict[str, dict[str, int]]): feature_dictionary() without tags in the keys, as read_feature_file returns
+        """
+        entries = array("I")
+        for feature_type, type_features in features.items():
+            type_index = self._type_indexes[feature_type]
+            for feature, count in type_features.items():
+                key = (type_index, feature)
+                feature_id = self._vocabulary_ids.get(key)
+                if feature_id is None:
+                    feature_id = len(self._vocabulary)
+                    self._vocabulary_ids[key] = feature_id
+                    self._vocabulary_types.append(type_index)
+                    self._vocabulary.append(feature)
+                entries.append(feature_id)
+                entries.append(min(max(int(count), 0), MAX_COUNT))
+        self._file.write(np.asarray(entries, dtype="<u4").tobytes())
+        self._record_offsets.append(self._record_offsets[-1] + len(entries) // 2)
+        self._names.append(name)
+
+    def close(self):
+        f = self._file
+        n_entries = self._record_offsets[-1]
+
+        records_offset = _pad(f)
+        f.write(np.asarray(self._record_offsets, dtype="<u8").tobytes())
+        names_offset = _write_strings(f, self._names)
+        types_offset = _pad(f)
+        f.write(self._vocabulary_types.tobytes())
+        vocabulary_offset = _write_strings(f, self._vocabulary)
+        meta_offset = _pad(f)
+        f.write(json.dumps({"feature_types": FeatureExtractor.FEATURE_TYPES, "feature_tags": FeatureExtractor.FEATURE_TAGS}).encode("utf-8"))
+
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, len(self._names), len(self._vocabulary), n_entries,
+                            records_offset, names_offset, types_offset, vocabulary_offset, meta_offset))
+        f.close()
+        os.replace(self._temp_path, self.shard_path)
+
+class FeatureShard:
+    """
+    Memory mapped, read only view of a shard
+
+        shard = FeatureShard(path)
+        ids, counts = shard[i]          # numpy views into the file
+        shard.features(i)               # feature_dictionary() like ReduceCardinality.read_feature_file
+        for name, features in shard:    # every APK in order
+
+    Args:
+        shard_path (str): shard written by ShardWriter
+    """
+
+    def __init__(self, shard_path: str):
+        self.shard_path = shard_path
+        self._file = open(shard_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        magic, version, _, n_records, n_features, n_entries, records_offset, names_offset, types_offset, vocabulary_offset, meta_offset = header
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{shard_path} is not a feature shard")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"{shard_path} is shard version {version}, expected {VERSION}")
+
+        meta = json.loads(bytes(self._mmap[meta_offset:]).decode("utf-8"))
+        self.feature_types: list[str] = meta["feature_types"]
+        self.feature_tags: list[str] = meta["feature_tags"]
+
+        self.entries = np.frombuffer(self._mmap, dtype=ENTRY_DTYPE, count=n_entries, offset=HEADER_SIZE)
+        self.record_offsets = np.frombuffer(self._mmap, dtype="<u8", count=n_records + 1, offset=records_offset)
+        self.vocabulary_types = np.frombuffer(self._mmap, dtype=np.uint8, count=n_features, offset=types_offset)
+        self._names_offset = names_offset
+        self._vocabulary_offset = vocabulary_offset
+        self._n_records = n_records
+        self._n_features = n_features
+        self._names = None
+        self._name_index = None
+        self._vocabulary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._n_records
+
+    def __getitem__(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (feature IDs, counts) of record i, views into the mapped file
+        """
+        if not -self._n_records <= i < self._n_records:
+            raise IndexError(i)
+        i %= self._n_records
+        record = self.entries[self.record_offsets[i]:self.record_offsets[i + 1]]
+        return record["id"], record["count"]
+
+    def __iter__(self) -> Iterator[tuple[str, dict[str, dict[str, int]]]]:
+        for i in range(self._n_records):
+            yield self.names[i], self.features(i)
+
+    def _read_strings(self, offset: int, count: int) -> list[str]:
+        offsets = np.frombuffer(self._mmap, dtype="<u8", count=count + 1, offset=offset)
+        blob = self._mmap[offset + offsets.nbytes:offset + offsets.nbytes + int(offsets[-1])]
+        ends = offsets.tolist()
+        return [blob[ends[i]:ends[i + 1]].decode("utf-8", errors="ignore") for i in range(count)]
+
+    @property
+    def names(self) -> list[str]:
+        if self._names is None:
+            self._names = self._read_strings(self._names_offset, self._n_records)
+        return self._names
+
+    @property
+    def vocabulary(self) -> list[str]:
+        """
+        Feature strings without their tags, indexed by feature ID
+        """
+        if self._vocabulary is None:
+            self._vocabulary = self._read_strings(self._vocabulary_offset, self._n_features)
+        return self._vocabulary
+
+    def tagged_vocabulary(self) -> list[str]:
+        """
+        Feature strings as they appear in feature files ("Tag: feature"), indexed by feature ID
+        """
+        tags = self.feature_tags
+        return [f"{tags[type_index]}: {feature}" for type_index, feature in zip(self.vocabulary_types.tolist(), self.vocabulary)]
+
+    def index(self, name: str) -> int:
+        """
+        Returns the record number of an APK name, raises KeyError if it is not in the shard
+        """
+        if self._name_index is None:
+            self._name_index = {record_name: i for i, record_name in enumerate(self.names)}
+        return self._name_index[name]
+
+    def remap(self, feature_index: dict[str, int], tagged: bool = True) -> np.ndarray:
+        """
+        Translates this shard's feature IDs to positions in a global feature index
+
+        Args:
+            feature_index (dict[str, int]): feature string -> global position
+            tagged (bool): whether the index keys are "Tag: feature" (True) or bare features
+        Returns:
+            np.ndarray: int64 position for every local feature ID, -1 where the feature is not in the index.
+            Use as positions = mapping[ids]
+        """
+        vocabulary = self.tagged_vocabulary() if tagged else self.vocabulary
+        return np.fromiter((feature_index.get(feature, -1) for feature in vocabulary), dtype=np.int64, count=len(vocabulary))
+
+    def features(self, i: int, tagged: bool = False) -> dict[str, dict[str, int]]:
+        """
+        Rebuilds record i as a feature_dictionary()
+
+        Args:
+            i (int): record number
+            tagged (bool): keep the tag in the keys ("Permission: x") like extract_features, default is bare features like read_feature_file
+        """
+        features = FeatureExtractor.feature_dictionary(self.feature_types)
+        vocabulary = self.vocabulary
+        types = self.vocabulary_types
+        ids, counts = self[i]
+        for feature_id, count in zip(ids.tolist(), counts.tolist()):
+            type_index = types[feature_id]
+            feature = vocabulary[feature_id]
+            if tagged:
+                feature = f"{self.feature_tags[type_index]}: {feature}"
+            features[self.feature_types[type_index]][feature] = count
+        return features
+
+    def close(self):
+        # NOTE: numpy views keep the map alive, drop them first. If a caller still holds one the map is closed by garbage collection
+        self.entries = self.record_offsets = self.vocabulary_types = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+# Converters
+def read_text_feature_file(file_path: str) -> dict[str, dict[str, int]]:
+    """
+    Reads a text feature file into a feature_dictionary() with bare feature keys, counts default to 1
+    """
+    features = FeatureExtractor.feature_dictionary()
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                parsed = FeatureExtractor.parse_feature_line(line)
+                if parsed is not None:
+                    feature_type, feature, count = parsed
+                    features[feature_type][feature] = count
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+    return features
+
+def text_to_shard(in_dir: str, shard_path: str) -> int:
+    """
+    Packs every feature file (*.txt) in a directory into one shard, in sorted file name order
+
+    Returns:
+        int: number of feature files packed
+    """
+    if not os.path.isdir(in_dir):
+        print(f"Directory does not exist: {in_dir}")
+        return 0
+    filenames = sorted(filename for filename in os.listdir(in_dir) if filename.endswith(".txt"))
+    with ShardWriter(shard_path) as writer:
+        for filename in filenames:
+            writer.add(filename, read_text_feature_file(os.path.join(in_dir, filename)))
+    return len(filenames)
+
+def shard_to_text(shard_path: str, out_dir: str, counts: bool = True) -> int:
+    """
+    Unpacks a shard into one text feature file per APK
+
+    Args:
+        counts (bool): write "Tag: feature count" (ReduceCardinality.write_feature_file layout), or "Tag: feature" (write_features layout)
+    Returns:
+        int: number of feature files written
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with FeatureShard(shard_path) as shard:
+        tagged_vocabulary = shard.tagged_vocabulary()
+        names = shard.names
+        for i in range(len(shard)):
+            ids, record_counts = shard[i]
+            # Records keep FEATURE_TYPES order because they were added from a feature_dictionary()
+            if counts:
+                lines = [f"{tagged_vocabulary[feature_id]} {count}\n" for feature_id, count in zip(ids.tolist(), record_counts.tolist())]
+            else:
+                lines = [f"{tagged_vocabulary[feature_id]}\n" for feature_id in ids.tolist()]
+            try:
+                with open(os.path.join(out_dir, names[i]), "w", encoding="utf-8", errors="ignore") as f:
+                    f.writelines(lines)
+            except Exception as e:
+                print(f"Error Writing to file {names[i]}\nException: {e}")
+    return len(names)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between text feature files and feature shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    to_shard = subparsers.add_parser("to-shard", help="pack a directory of feature files into a shard")
+    to_shard.add_argument("in_dir")
+    to_shard.add_argument("shard_path")
+    to_text = subparsers.add_parser("to-text", help="unpack a shard into feature files")
+    to_text.add_argument("shard_path")
+    to_text.add_argument("out_dir")
+    to_text.add_argument("--no-counts", action="store_true", help="write 'Tag: feature' lines like write_features")
+    args = parser.parse_args()
+
+    if args.command == "to-shard":
+        packed = text_to_shard(args.in_dir, args.shard_path)
+        print(f"Packed {packed} feature files into {args.shard_path}")
+    else:
+        unpacked = shard_to_text(args.shard_path, args.out_dir, counts=not args.no_counts)
+        print(f"Unpacked {unpacked} feature files into {args.out_dir}")
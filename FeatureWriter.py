@@ -0,0 +1,167 @@
+"""
+    FeatureWriter.py
+    Buffered, crash consistent replacement for calling write_features and update_unique_features once per APK
+
+    write_features reopens apk_log.txt and update_unique_features reopens all six unique_*.txt files for every APK.
+    FeatureWriter keeps those files open and appends to them in batches (every flush_count APKs or flush_interval seconds).
+
+    Each batch is journaled: before appending, the current size of every file is written to apk_log.journal,
+    the journal is deleted once every file has been appended and synced. If a run dies mid batch, the next run
+    truncates the files back to the journaled sizes (recover_journal), so apk_log.txt and the unique files always describe
+    the same set of APKs. APKs from a rolled back batch are simply extracted again.
+
+    Per APK feature files are written to a temporary file and renamed, so a feature file is never half written.
+"""
+
+import os
+import json
+import time
+
+import FeatureExtractor
+
+JOURNAL_NAME = "apk_log.journal"
+LOG_NAME = "apk_log.txt"
+DEFAULT_FLUSH_COUNT = 100 # APKs per batch
+DEFAULT_FLUSH_INTERVAL = 10.0 # Seconds before a partial batch is flushed anyway
+ENCODING = "utf-8"
+
+def recover_journal(out_dir: str) -> bool:
+    """
+    Rolls back a batch that was interrupted mid write, call before reading apk_log.txt (ResumeIndex) or the unique files
+
+    Args:
+        out_dir (str): directory holding apk_log.txt and apk_log.journal
+    Returns:
+        bool: True if a batch was rolled back
+    """
+    journal_path = os.path.join(out_dir, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        return False
+    try:
+        with open(journal_path, "r", encoding=ENCODING) as f:
+            sizes = json.load(f)
+    except ValueError: # Journal itself was half written, nothing was appended yet
+        os.remove(journal_path)
+        return False
+
+    for file_path, size in sizes.items():
+        if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+            with open(file_path, "r+b") as f:
+                f.truncate(size)
+    os.remove(journal_path)
+    print(f"INFO: Rolled back an interrupted write batch in {out_dir}, those APKs will be extracted again")
+    return True
+
+def _fsync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+class FeatureWriter:
+    """
+    Single writer for feature files, apk_log.txt and the unique_*.txt files
+
+    Args:
+        out_dir_features (str): directory for the per APK feature files, apk_log.txt is one level above (same as write_features)
+        out_dir_unique (str): directory of the unique_*.txt files
+        flush_count (int): APKs buffered before a batch is written
+        flush_interval (float): seconds before a partial batch is written
+    """
+
+    def __init__(self, out_dir_features: str, out_dir_unique: str,
+                 flush_count: int = DEFAULT_FLUSH_COUNT, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.out_dir_features = out_dir_features
+        self.out_dir_unique = out_dir_unique
+        self.flush_count = max(1, flush_count)
+        self.flush_interval = flush_interval
+
+        for directory in (out_dir_features, out_dir_unique):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        self.out_dir, _ = os.path.split(out_dir_features)
+        self.journal_path = os.path.join(self.out_dir, JOURNAL_NAME)
+        recover_journal(self.out_dir)
+
+        # Open handles, kept for the life of the writer
+        self._log_file = open(os.path.join(self.out_dir, LOG_NAME), "a", encoding=ENCODING, errors="ignore")
+        self._unique_files = {}
+        for feature_type in FeatureExtractor.FEATURE_TYPES:
+            file_path = os.path.join(out_dir_unique, f"unique_{feature_type}.txt")
+            self._unique_files[feature_type] = open(file_path, "a", encoding=ENCODING, errors="ignore")
+
+        # Pending batch
+        self._pending_apks: list[str] = []
+        self._pending_unique: dict[str, list[str]] = {feature_type: [] for feature_type in FeatureExtractor.FEATURE_TYPES}
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, extracted_features: dict[str, dict[str, int]], apk_path: str):
+        """
+        Writes an APK's feature file now and queues its log entry and new unique features for the next batch
+        Same output as FeatureExtractor.write_features followed by FeatureExtractor.update_unique_features
+        """
+        apk_name = os.path.basename(apk_path)
+        output_filepath = os.path.join(self.out_dir_features, f"{apk_name}.txt")
+        temp_filepath = output_filepath + ".tmp"
+        try:
+            with open(temp_filepath, "w", encoding=ENCODING, errors="ignore") as f:
+                for feature_type in extracted_features:
+                    for feature in extracted_features[feature_type]:
+                        if feature != "": # extra safety against empty strings
+                            f.write(f"{feature}\n")
+            os.replace(temp_filepath, output_filepath)
+        except Exception as e:
+            print(f"Error writing features for {apk_path}: {e}")
+            return # Not logged, so it is extracted again on the next run
+
+        # NOTE: the global unique_features store is updated right away so later APKs in the same batch don't repeat features
+        unique_features = FeatureExtractor.unique_features
+        for feature_type in extracted_features:
+            for feature in extracted_features[feature_type]:
+                if feature and feature not in unique_features[feature_type]:
+                    unique_features[feature_type][feature] = 1
+                    self._pending_unique[feature_type].append(feature)
+        self._pending_apks.append(apk_name)
+
+        if len(self._pending_apks) >= self.flush_count or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Appends the pending batch to apk_log.txt and the unique files under the journal
+        """
+        self._last_flush = time.monotonic()
+        if not self._pending_apks:
+            return
+
+        files = [(self._log_file, self._pending_apks)]
+        files += [(self._unique_files[feature_type], lines) for feature_type, lines in self._pending_unique.items()]
+
+        # 1. Journal the current size of every file
+        for f, _ in files:
+            f.flush()
+        sizes = {os.path.abspath(f.name): os.path.getsize(f.name) for f, _ in files}
+        with open(self.journal_path, "w", encoding=ENCODING) as journal:
+            json.dump(sizes, journal)
+            _fsync(journal)
+
+        # 2. Append and sync, unique files before the log so a logged APK always has its unique features
+        for f, lines in files[1:] + files[:1]:
+            if lines:
+                f.write("".join(f"{line}\n" for line in lines))
+                _fsync(f)
+
+        # 3. Batch is complete
+        os.remove(self.journal_path)
+        self._pending_apks = []
+        self._pending_unique = {feature_type: [] for feature_type in FeatureExtractor.FEATURE_TYPES}
+
+    def close(self):
+        self.flush()
+        self._log_file.close()
+        for f in self._unique_files.values():
+            f.close()
@@ -9,6 +9,7 @@ from collections import defaultdict
 
 import ReduceCardinality
 import FeatureExtractor
+from UniqueFeatureStore import UniqueFeatureStore
 
 ROOT_DIRECTORY = r'..\dataset_features\subsets\1'
 DIRECTORY_UNIQUE = r'unique_features'
@@ -25,7 +26,7 @@ if os.path.exists(ROOT_DIRECTORY):
     benign_dir = os.path.join(ROOT_DIRECTORY, DIRECTORY_BENIGN)
     malicious_dir = os.path.join(ROOT_DIRECTORY, DIRECTORY_MALICIOUS)
     unique_dir = os.path.join(ROOT_DIRECTORY, DIRECTORY_UNIQUE) 
-    unique_features = FeatureExtractor.feature_dictionary() # Making a feature_dictionary   
+    unique_features = UniqueFeatureStore(FeatureExtractor.FEATURE_TYPES) # Making a unique feature store, same interface as feature_dictionary()
 
     if not os.path.exists(unique_dir):
                 os.makedirs(unique_dir)
@@ -44,6 +45,7 @@ if os.path.exists(ROOT_DIRECTORY):
             unique_features = ReduceCardinality.update_unique_features(features, unique_features)
 
     ReduceCardinality.write_unique_features(unique_dir, unique_features) # Also collects counts and adds to the total number of features for each file
+    unique_features.close()
     ReduceCardinality.write_totals(ROOT_DIRECTORY) # Writes total number of files and the total number of features for each file
     print(f"Unique Features Extracted")
 else:
@@ -0,0 +1,332 @@
+"""
+    ParallelExtractor.py
+    Runs FeatureExtractor.extract_features over many APKs at once with a pool of worker processes
+
+    Each worker process owns one APK at a time, so a worker that hangs past the timeout
+    or crashes (androguard segfaults, out of memory, etc.) is killed and replaced without losing the rest of the run.
+    Extracted features are sent back to the main process, which is the only process that writes
+    feature files, apk_log.txt and the unique_*.txt files (through a FeatureWriter), so concurrent appends can never interleave.
+
+    Usage:
+        results = extract_parallel(apk_paths, out_dir_features, out_dir_unique, workers=8, timeout=600)
+"""
+
+import os
+import time
+import multiprocessing
+from multiprocessing import connection
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+import FeatureExtractor
+import ExtractionCache
+import FeatureWriter
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Leave a core for the writer/main process
+DEFAULT_TIMEOUT = 600 # Seconds an APK is allowed to take before its worker is killed
+FAILED_LOG_NAME = "apk_failed_log.txt" # Written next to apk_log.txt, APKs that timed out or crashed their worker
+
+# Result statuses
+STATUS_OK = "ok" # Features were extracted
+STATUS_EMPTY = "empty" # extract_features returned nothing (it prints its own error)
+STATUS_TIMEOUT = "timeout" # Worker ran past the timeout and was killed
+STATUS_CRASHED = "crashed" # Worker process died while extracting
+
+class ExtractionResult(NamedTuple):
+    apk_path: str
+    features: dict[str, dict[str, int]] # Empty dict unless status is STATUS_OK
+    status: str
+    seconds: float # Wall time spent on the APK inside the worker slot
+    sha256: str | None = None # Hash of the APK bytes, only computed when an extraction cache is used
+    cached: bool = False # Features came from the extraction cache instead of androguard
+
+def _worker_main(conn: connection.Connection, feature_types: list[str], needs_full: Callable | None, cache_path: str | None):
+    """
+    Worker process loop, receives APK paths over its pipe and sends back (features, sha256, cached)
+    A None path (or a closed pipe) stops the worker
+    needs_full switches to FeatureExtractor.extract_features_tiered, it must be a module level function so it can be pickled
+    cache_path enables read only lookups in the extraction cache, the main process writes new entries
+    """
+    cache = None
+    while True:
+        try:
+            apk_path = conn.recv()
+        except (EOFError, OSError):
+            break
+        if apk_path is None:
+            break
+
+        sha256 = None
+        features = None
+        if cache_path is not None:
+            try:
+                sha256 = ExtractionCache.hash_apk(apk_path)
+                if cache is None:
+                    cache = ExtractionCache.ExtractionCache(cache_path, read_only=True)
+                features = cache.get(sha256, feature_types)
+            except Exception as e: # A broken cache should never stop extraction
+                print(f"Error reading extraction cache for {apk_path}: {e}")
+        cached = features is not None
+
+        if not cached:
+            if needs_full is None:
+                features = FeatureExtractor.extract_features(apk_path, feature_types)
+            else:
+                features = FeatureExtractor.extract_features_tiered(apk_path, needs_full, feature_types)
+        # NOTE: extract_features returns [] on failure, normalize to an empty dict so the result type is consistent
+        conn.send((dict(features) if features else {}, sha256, cached))
+
+class _WorkerSlot:
+    """
+    One worker process and the APK it is currently working on
+    Processes are replaced when they time out or crash, the slot stays
+    """
+
+    def __init__(self, context, worker_args: tuple):
+        self.context = context
+        self.worker_args = worker_args
+        self.process = None
+        self.conn = None
+        self.apk_path = None # None when idle
+        self.started = 0.0
+        self.start_process()
+
+    def start_process(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child_conn, *self.worker_args), daemon=True)
+        self.process.start()
+        child_conn.close() # Only the worker keeps its end, so a dead worker shows up as EOF
+        self.conn = parent_conn
+
+    def stop_process(self, kill: bool = False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def restart_process(self):
+        self.stop_process(kill=True)
+        self.start_process()
+
+    def assign(self, apk_path: str):
+        self.conn.send(apk_path)
+        self.apk_path = apk_path
+        self.started = time.monotonic()
+
+    def release(self, features: dict[str, dict[str, int]], status: str, sha256: str | None = None, cached: bool = False) -> ExtractionResult:
+        result = ExtractionResult(self.apk_path, features, status, time.monotonic() - self.started, sha256, cached)
+        self.apk_path = None
+        return result
+
+class ExtractionPool:
+    """
+    Fixed number of extraction worker processes with per-APK timeouts and crash isolation
+    submit() hands an APK to an idle worker, poll() collects finished results
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                 feature_types: list[str] = FeatureExtractor.FEATURE_TYPES, needs_full: Callable | None = None,
+                 cache_path: str | None = None):
+        # NOTE: spawn instead of fork, workers start clean (no copied androguard state) and behave the same on windows and linux
+        self._context = multiprocessing.get_context("spawn")
+        self.timeout = timeout
+        self._slots = [_WorkerSlot(self._context, (list(feature_types), needs_full, cache_path)) for _ in range(max(1, workers))]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def busy_count(self) -> int:
+        return sum(1 for slot in self._slots if slot.apk_path is not None)
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._slots) - self.busy_count
+
+    def submit(self, apk_path: str) -> bool:
+        """
+        Gives the APK to an idle worker
+
+        Returns:
+            bool: False if every worker is busy, the APK was not submitted
+        """
+        for slot in self._slots:
+            if slot.apk_path is None:
+                try:
+                    slot.assign(apk_path)
+                except (BrokenPipeError, OSError): # Worker died while idle, replace it and try once more
+                    slot.restart_process()
+                    slot.assign(apk_path)
+                return True
+        return False
+
+    def poll(self, wait: float = 1.0) -> list[ExtractionResult]:
+        """
+        Waits up to `wait` seconds for workers to finish, then collects results, timeouts and crashes
+
+        Returns:
+            list[ExtractionResult]: every APK that finished since the last poll, may be empty
+        """
+        busy = [slot for slot in self._slots if slot.apk_path is not None]
+        if not busy:
+            return []
+
+        # Never sleep past the earliest deadline so timeouts are noticed promptly
+        now = time.monotonic()
+        earliest_deadline = min(slot.started + self.timeout for slot in busy)
+        wait = max(0.0, min(wait, earliest_deadline - now))
+        waitables = [slot.conn for slot in busy] + [slot.process.sentinel for slot in busy]
+        connection.wait(waitables, wait)
+
+        results = []
+        now = time.monotonic()
+        for slot in busy:
+            if slot.conn.poll():
+                try:
+                    features, sha256, cached = slot.conn.recv()
+                    results.append(slot.release(features, STATUS_OK if features else STATUS_EMPTY, sha256, cached))
+                except (EOFError, OSError): # Pipe closed, worker died mid extraction
+                    results.append(slot.release({}, STATUS_CRASHED))
+                    slot.restart_process()
+            elif not slot.process.is_alive():
+                results.append(slot.release({}, STATUS_CRASHED))
+                slot.restart_process()
+            elif now - slot.started > self.timeout:
+                results.append(slot.release({}, STATUS_TIMEOUT))
+                slot.restart_process()
+        return results
+
+    def close(self):
+        """
+        Stops every worker, APKs still in progress are abandoned
+        """
+        for slot in self._slots:
+            slot.stop_process(kill=slot.apk_path is not None)
+            slot.apk_path = None
+        self._slots = []
+
+def iter_extract(apk_paths: Iterable[str], workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                 feature_types: list[str] = FeatureExtractor.FEATURE_TYPES, needs_full: Callable | None = None,
+                 cache_path: str | None = None) -> Iterator[ExtractionResult]:
+    """
+    Extracts features from every APK in apk_paths with a pool of workers, yielding results as they finish
+    apk_paths is consumed lazily, only as workers become free, so it can be a generator that is still discovering files
+    Results come back in completion order, not input order
+
+    Args:
+        apk_paths (Iterable[str]): paths of the APKs to extract
+        workers (int): number of worker processes
+        timeout (float): seconds before a worker on a single APK is killed
+        feature_types (list[str]): feature types to extract, manifest only types are much faster
+        needs_full (Callable): optional triage check, see FeatureExtractor.extract_features_tiered
+        cache_path (str): optional extraction cache to look APKs up in, it must already exist (see ExtractionCache)
+    Yields:
+        ExtractionResult: one per APK
+    """
+    pending = iter(apk_paths)
+    exhausted = False
+
+    with ExtractionPool(workers, timeout, feature_types, needs_full, cache_path) as pool:
+        while True:
+            while not exhausted and pool.idle_count:
+                apk_path = next(pending, None)
+                if apk_path is None:
+                    exhausted = True
+                else:
+                    pool.submit(apk_path)
+            if exhausted and not pool.busy_count:
+                break
+            yield from pool.poll()
+
+def estimate_time_remaining(elapsed_time: float, files_processed: int, total_files: int) -> float:
+    """
+    Estimates the seconds left from the average time per file so far
+    Shared by the tkinter progress window and the headless runner
+    """
+    average_time_per_file = elapsed_time / (files_processed if files_processed else 1)
+    files_remaining = max(0, total_files - files_processed)
+    return files_remaining * average_time_per_file
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats seconds as "00h 00m 00s"
+    """
+    hours = int(seconds // 3600)
+    minutes = int((seconds // 60) % 60)
+    seconds = int(seconds % 60)
+    return f"{hours:02d}h {minutes:02d}m {seconds:02d}s"
+
+def log_failed_apk(result: ExtractionResult, output_dir: str):
+    """
+    Appends an APK that timed out or crashed its worker to apk_failed_log.txt
+    The log sits next to apk_log.txt (one level above output_dir) the same way write_features places its log
+    """
+    try:
+        upper, _ = os.path.split(output_dir)
+        log_path = os.path.join(upper, FAILED_LOG_NAME)
+        with open(log_path, "a") as f:
+            f.write(f"{os.path.basename(result.apk_path)}\t{result.status}\n")
+    except Exception as e:
+        print(f"Error writing to failed log {result.apk_path}: {e}")
+
+def extract_parallel(apk_paths: Iterable[str], out_dir_features: str, out_dir_unique: str,
+                     workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                     feature_types: list[str] = FeatureExtractor.FEATURE_TYPES, needs_full: Callable | None = None,
+                     cache_path: str | None = None, cache_max_bytes: int = ExtractionCache.DEFAULT_MAX_BYTES,
+                     flush_count: int = FeatureWriter.DEFAULT_FLUSH_COUNT, flush_interval: float = FeatureWriter.DEFAULT_FLUSH_INTERVAL,
+                     on_result: Callable[[ExtractionResult], None] | None = None) -> dict[str, int]:
+    """
+    Extracts features from many APKs in parallel, writing feature files and unique features from this process only
+
+    Args:
+        apk_paths (Iterable[str]): paths of the APKs to extract
+        out_dir_features (str): directory for the per APK feature files (apk_log.txt is written one level above)
+        out_dir_unique (str): directory of the unique_*.txt files, reloaded before extraction starts
+        workers (int): number of worker processes
+        timeout (float): seconds before a worker on a single APK is killed
+        feature_types (list[str]): feature types to extract, manifest only types are much faster
+        needs_full (Callable): optional triage check, see FeatureExtractor.extract_features_tiered
+        cache_path (str): optional SHA-256 keyed extraction cache, identical APKs are only analyzed once
+        cache_max_bytes (int): size limit of the extraction cache
+        flush_count (int): APKs per batched write of apk_log.txt and the unique files
+        flush_interval (float): seconds before a partial batch is written
+        on_result (Callable): optional callback for each result after it is written, used for progress reporting
+    Returns:
+        dict[str, int]: number of APKs that finished with each status
+    """
+    writer = FeatureWriter.FeatureWriter(out_dir_features, out_dir_unique, flush_count, flush_interval) # Rolls back an interrupted batch first
+    FeatureExtractor.reload_unique_features(out_dir_unique)
+    totals = {STATUS_OK: 0, STATUS_EMPTY: 0, STATUS_TIMEOUT: 0, STATUS_CRASHED: 0}
+    cache = ExtractionCache.ExtractionCache(cache_path, cache_max_bytes) if cache_path else None
+
+    try:
+        for result in iter_extract(apk_paths, workers, timeout, feature_types, needs_full, cache_path):
+            if result.status == STATUS_OK:
+                writer.write(result.features, result.apk_path)
+                if cache is not None and result.sha256:
+                    if result.cached:
+                        cache.touch(result.sha256)
+                    else:
+                        cache.put(result.sha256, result.features)
+            elif result.status in (STATUS_TIMEOUT, STATUS_CRASHED):
+                print(f"Error processing APK {result.apk_path}: worker {result.status} after {result.seconds:.0f}s")
+                log_failed_apk(result, out_dir_features)
+            totals[result.status] += 1
+            if on_result is not None:
+                on_result(result)
+    finally:
+        writer.close()
+        if cache is not None:
+            cache.close()
+    return totals
+
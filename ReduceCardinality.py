@@ -19,12 +19,14 @@
     Remove features that appear a low amount of times
 
     TODO: make a class to store unique_features to avoid passing it constantly
+    NOTE: unique features are kept in a UniqueFeatureStore (same dictionary interface, bounded memory)
 """
 
 
 import os
 from collections import defaultdict 
 import FeatureExtractor 
+from UniqueFeatureStore import UniqueFeatureStore
 
 ROOT_DIRECTORY = r'..\extracted_features'
 #ROOT_DIRECTORY = r'..\dataset_features\subsets\2'
@@ -106,11 +108,11 @@ def read_feature_file(file_path: str) -> dict[str: dict[str: int]]:
     return features
 
 #TODO: reconcile this and reload_unique_features (should do the same thing)
-def read_unique_features(in_dir: str) -> dict[str, dict[str, int]]: # NOTE: can't use read_feature_file because it is meant to read full features
+def read_unique_features(in_dir: str) -> UniqueFeatureStore: # NOTE: can't use read_feature_file because it is meant to read full features
     """
-    Reads unique feature files and creates a unique features dictionary
+    Reads unique feature files and creates a unique features store
     """
-    unique_features = FeatureExtractor.feature_dictionary()
+    unique_features = UniqueFeatureStore(FeatureExtractor.FEATURE_TYPES)
 
     for feature_type, feature_tag in zip(FeatureExtractor.FEATURE_TYPES, FeatureExtractor.FEATURE_TAGS):
         file_name = f"unique_{feature_type}.txt" 
@@ -148,17 +150,48 @@ def categorize_feature_file(file_path: str) -> dict[str: dict[str : int]]:
                 for feature_type, feature_tag in zip(FeatureExtractor.FEATURE_TYPES, FeatureExtractor.FEATURE_TAGS): # NOTE: zip() returns a tuple containing the elements from each list that have the same indeces 
                     if feature.startswith(feature_tag): # Check each line to see which feature_type it belongs to
                         feature = feature.removeprefix(f"{feature_tag}: ").split(" ")[0] # Removes feature tag and potential value, stores feature
-                        if (feature_type == FeatureExtractor.FEATURE_TYPES[3] or  
-                            feature_type == FeatureExtractor.FEATURE_TYPES[4]): #APIs or Libraries
-                            feature = level3_truncator(feature) #feature becomes the shortened version
-                        elif feature_type == FeatureExtractor.FEATURE_TYPES[5]:#URLs
-                            feature = find_categories(feature) #feature becomes the
-                        features[feature_type][feature.strip()] += 1 # Adds feature key and adds value as integer 
+                        features[feature_type][categorize_feature(feature_type, feature)] += 1 # Adds feature key and adds value as integer 
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
     return features
 
-def categorize_folder(in_dir: str, out_dir: str, unique_features: dict[str, dict[str, int]]) -> dict[str, dict[str, int]]:
+def categorize_feature(feature_type: str, feature: str) -> str:
+    """
+        Returns the category a feature (without its tag) is counted under
+        APIs and Libraries are truncated, URLs are categorized, other features are their own category
+    """
+    if (feature_type == FeatureExtractor.FEATURE_TYPES[3] or  
+        feature_type == FeatureExtractor.FEATURE_TYPES[4]): #APIs or Libraries
+        feature = level3_truncator(feature) #feature becomes the shortened version
+    elif feature_type == FeatureExtractor.FEATURE_TYPES[5]:#URLs
+        feature = find_categories(feature) #feature becomes the category
+    return feature.strip()
+
+def categorize_features(extracted_features: dict[str, dict[str, int]]) -> dict[str, dict[str, int]]:
+    """
+        categorize_feature_file for features that are still in memory (extract_features output, keys include the tag)
+        Same result as write_features followed by categorize_feature_file, without the files
+    """
+    features = FeatureExtractor.feature_dictionary()
+    for feature_type, feature_tag in zip(FeatureExtractor.FEATURE_TYPES, FeatureExtractor.FEATURE_TAGS):
+        for feature in extracted_features.get(feature_type, {}):
+            if feature == "": # write_features skips empty features too
+                continue
+            feature = feature.removeprefix(f"{feature_tag}: ").split(" ")[0]
+            features[feature_type][categorize_feature(feature_type, feature)] += 1
+    return features
+
+def feature_file_content(features: dict[str, dict[str, int]]) -> str:
+    """
+        The text write_feature_file writes for a feature dictionary ("Tag: feature count" lines), as a string
+    """
+    lines = []
+    for feature_type, feature_tag in zip(FeatureExtractor.FEATURE_TYPES, FeatureExtractor.FEATURE_TAGS):
+        for feature, count in features[feature_type].items():
+            lines.append(f"{feature_tag}: {feature.strip()} {count}\n")
+    return "".join(lines)
+
+def categorize_folder(in_dir: str, out_dir: str, unique_features: UniqueFeatureStore) -> UniqueFeatureStore:
     """
         Reduces cardinality of a folder by categorizing feature files in it 
         NOTE: ONE FOLDER AT A TIME
@@ -223,18 +256,19 @@ def find_categories(url: str) -> str:
     return url
 
 # Unique Features
-def update_unique_features(features: dict[str, dict[str, int]], unique_features: dict[str : defaultdict(int)]) -> dict[str, dict[str, int]]:
+def update_unique_features(features: dict[str, dict[str, int]], unique_features: UniqueFeatureStore) -> UniqueFeatureStore:
     """
         updates unique features from a new dictionary
         this version stores a count of each feature instance
         Cannot write to file as we go, because categories will be updated through out the reading process
     """
     for feature_type in features:
-        for feature in features[feature_type]:
-            unique_features[feature_type][feature] += features[feature_type][feature]
+        feature_counts = unique_features[feature_type]
+        for feature, count in features[feature_type].items():
+            feature_counts.add(feature, count)
     return unique_features
 
-def write_unique_features(out_dir: str, unique_features: dict[str : dict[str, int]]):
+def write_unique_features(out_dir: str, unique_features: UniqueFeatureStore | dict[str, dict[str, int]]):
     """
         Writes unique feature file to directory, feature types remain seperate
     """
@@ -246,8 +280,7 @@ def write_unique_features(out_dir: str, unique_features: dict[str : dict[str, in
             out_file = os.path.join(out_dir, f"unique_{feature_type}.txt") # For each type create the file of the same name
             try:
                 with open(out_file, "w", encoding="utf-8", errors="ignore") as f: # try to open the file
-                    for feature in unique_features[feature_type]: 
-                        count = unique_features[feature_type][feature]
+                    for feature, count in unique_features[feature_type].items(): 
                         f.write(f"{feature_tag}: {feature.strip()} {count}\n") # Write each feature tag, count, and feature name
             except Exception as e:
                 print(f"Error Writing to file {feature_type}.txt\nException: {e}")
@@ -255,7 +288,7 @@ def write_unique_features(out_dir: str, unique_features: dict[str : dict[str, in
         print(f"dictionary length mismatch:\nunique_features: {len(unique_features)}\nFEATURE_TAGS: {len(FeatureExtractor.FEATURE_TAGS)}")
 
 # Feature Reduction
-def reduce_unique_features(unique_features: dict[str, dict[str, int]]) -> dict[str, dict[str, int]]:
+def reduce_unique_features(unique_features: UniqueFeatureStore) -> dict[str, dict[str, int]]:
     """
         Reads unique_features
         removes features from dictionary if they occur a small number of times, or if they appear in every file in the dataset
@@ -264,10 +297,9 @@ def reduce_unique_features(unique_features: dict[str, dict[str, int]]) -> dict[s
     """
     reduced = FeatureExtractor.feature_dictionary()
     for feature_type in unique_features:
-        for feature in unique_features[feature_type]:
-            count = unique_features[feature_type][feature]
+        for feature, count in unique_features[feature_type].items():
             if FLOOR_OFFSET < count < total_files - CEIL_OFFSET: 
-                reduced[feature_type][feature] = unique_features[feature_type][feature]
+                reduced[feature_type][feature] = count
             # TODO: Reduction of max length features DOES NOT take into account groups currently, 
             # there could technically be a group larger than the number of files that isn't used by every file 
             # this seems exceedingly unlikely but is still a bug
@@ -319,7 +351,7 @@ def catagorize_dataset(in_dir: str, out_dir: str):
     if os.path.exists(in_dir): # if we have the input directory
         in_benign = os.path.join(in_dir, DIRECTORY_BENIGN)
         in_malicious = os.path.join(in_dir, DIRECTORY_MALICIOUS)
-        unique_features = FeatureExtractor.feature_dictionary() # Making a feature_dictionary
+        unique_features = UniqueFeatureStore(FeatureExtractor.FEATURE_TYPES) # Making a unique feature store, same interface as feature_dictionary()
 
         out_benign = os.path.join(out_dir, DIRECTORY_BENIGN) 
         out_malicious = os.path.join(out_dir, DIRECTORY_MALICIOUS)
@@ -336,6 +368,7 @@ def catagorize_dataset(in_dir: str, out_dir: str):
         unique_features = categorize_folder(in_benign, out_benign, unique_features) #TODO: Make a class for unique features #TODO: what did I mean by this? the feature_dictionary() funciton??
         unique_features = categorize_folder(in_malicious, out_malicious, unique_features) # TODO: a class to encapsulate the unique features dictionary so it isn't global in feature extractor
         write_unique_features(out_unique, unique_features) # Also collects counts and adds to the total number of features for each file
+        unique_features.close()
         write_totals(out_dir) # Writes total number of files and the total number of features for each file
         print(f"Categorization Complete")
     else:
@@ -377,6 +410,7 @@ def reduce_dataset(in_dir: str, out_dir: str):
 
         unique_features = read_unique_features(in_unique)
         reduced_unique = reduce_unique_features(unique_features)
+        unique_features.close()
         write_unique_features(out_unique, reduced_unique)
         total_files = 0 # NOTE: reset total_files for consistency and because write_totals saves total_files, best to count to be sure
         
@@ -0,0 +1,122 @@
+"""
+    ResumeIndex.py
+    Indexed record of which APKs have already been extracted, plus a scanner that streams the ones that have not
+
+    apk_log.txt stays the log that write_features appends to, the index is a SQLite copy of it (apk_index.sqlite, next to the log)
+    that remembers how far into the log it has read. Opening the index only reads log lines added since the last run,
+    instead of re-reading the whole log (once per directory, as preprocess_dir used to).
+"""
+
+import os
+import sqlite3
+from typing import Container, Iterator
+
+LOG_NAME = "apk_log.txt"
+INDEX_NAME = "apk_index.sqlite"
+SYNC_BATCH_SIZE = 10000
+
+class ResumeIndex:
+    """
+    Set of processed APK names backed by SQLite, kept in sync with apk_log.txt
+
+    Args:
+        out_dir (str): directory containing apk_log.txt, the index file is created next to it
+    """
+
+    def __init__(self, out_dir: str):
+        self.log_path = os.path.join(out_dir, LOG_NAME)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        self._db = sqlite3.connect(os.path.join(out_dir, INDEX_NAME))
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS processed (name TEXT PRIMARY KEY)")
+        self._db.commit()
+        self.sync()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return self._db.execute("SELECT 1 FROM processed WHERE name = ?", (name.strip(),)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+
+    def sync(self):
+        """
+        Reads apk_log.txt from where the last sync stopped and adds the new names to the index
+        If the log got shorter it was replaced, so the index is rebuilt from the start
+        """
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'log_offset'").fetchone()
+        offset = row[0] if row else 0
+
+        if not os.path.exists(self.log_path):
+            if offset:
+                self._db.execute("DELETE FROM processed")
+                self._set_offset(0)
+                self._db.commit()
+            return
+        if os.path.getsize(self.log_path) < offset:
+            print(f"INFO: {LOG_NAME} is shorter than the last time it was indexed, rebuilding {INDEX_NAME}")
+            self._db.execute("DELETE FROM processed")
+            offset = 0
+
+        try:
+            with open(self.log_path, "rb") as f: # binary so the offset is an exact byte position
+                f.seek(offset)
+                batch = []
+                for line in f:
+                    if not line.endswith(b"\n"): # Partially written last line, pick it up next sync
+                        break
+                    offset += len(line)
+                    name = line.decode("utf-8", errors="ignore").strip()
+                    if name: # Ignore Empty Lines
+                        batch.append((name,))
+                    if len(batch) >= SYNC_BATCH_SIZE:
+                        self._db.executemany("INSERT OR IGNORE INTO processed (name) VALUES (?)", batch)
+                        batch = []
+                self._db.executemany("INSERT OR IGNORE INTO processed (name) VALUES (?)", batch)
+        except Exception as e:
+            print(f"Error reading log file: {e}")
+        self._set_offset(offset)
+        self._db.commit()
+
+    def _set_offset(self, offset: int):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('log_offset', ?)", (offset,))
+
+    def close(self):
+        self._db.close()
+
+class UnprocessedApkScanner:
+    """
+    Walks a directory tree lazily and yields the paths of APKs that are not in any of the skip containers
+    Extraction can start on the first APK while the rest of the tree is still being walked
+
+    discovered counts APKs yielded so far and done is set once the walk finishes, for progress reporting
+
+    Args:
+        root_dir (str): directory of APKs, walked recursively
+        skip (list[Container[str]]): containers of APK file names to leave out (a ResumeIndex, failed APKs, ...)
+    """
+
+    def __init__(self, root_dir: str, skip: list[Container[str]] | None = None):
+        self.root_dir = root_dir
+        self.skip = skip or []
+        self.discovered = 0
+        self.skipped = 0
+        self.done = False
+
+    def __iter__(self) -> Iterator[str]:
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            # NOTE: DREBINS FILES DO NOT END WITH APK, every file is treated as an APK
+            for filename in filenames:
+                name = filename.strip()
+                if any(name in container for container in self.skip):
+                    self.skipped += 1
+                    continue
+                self.discovered += 1
+                yield os.path.join(dirpath, filename)
+        self.done = True
@@ -0,0 +1,225 @@
+"""
+    UniqueFeatureStore.py
+    Bounded memory replacement for the unique_features dictionary of defaultdicts
+
+    Every feature string is interned to an integer ID (per feature type, in first seen order) and counts are kept
+    in a compact array indexed by ID instead of a dict of Python ints. When the estimated memory use passes the budget,
+    the in memory features are spilled to a SQLite file and new features keep going into memory.
+
+    Used the same way as the old dictionaries:
+        unique_features = UniqueFeatureStore(FeatureExtractor.FEATURE_TYPES)
+        unique_features["permissions"]["Permission: android.permission.INTERNET"] = 1
+        unique_features["api_calls"].add("android.app.Activity.onCreate", 3)
+        for feature_type in unique_features:
+            for feature, count in unique_features[feature_type].items():
+                ...
+
+    Shared by FeatureExtractor.update_unique_features, ReduceCardinality.update_unique_features and GetUniqueFeatures
+"""
+
+import os
+import sqlite3
+import tempfile
+from array import array
+from collections.abc import Mapping, MutableMapping
+from typing import Iterator
+
+DEFAULT_MEMORY_BUDGET = 1024 ** 3 # 1GB of feature strings and counts before spilling to disk
+ENTRY_OVERHEAD = 120 # Approximate bytes per feature on top of the string itself (str header, dict slot, id int, count)
+SPILL_FETCH_SIZE = 10000
+
+class FeatureCounts(MutableMapping):
+    """
+    Counts for one feature type, behaves like defaultdict(int) except that reading a missing feature does not insert it
+
+    Features in memory: _ids maps the string to its ID, _counts[ID - _base] is the count
+    Spilled features: rows of the store's SQLite file, IDs below _base
+    """
+
+    def __init__(self, store: "UniqueFeatureStore", feature_type: str):
+        self._store = store
+        self.feature_type = feature_type
+        self._ids: dict[str, int] = {}
+        self._counts = array("q")
+        self._base = 0 # ID of the first in memory feature, everything below has been spilled
+
+    def _spilled_row(self, feature: str) -> tuple[int, int] | None:
+        if not self._base:
+            return None
+        return self._store._db.execute("SELECT id, count FROM features WHERE type = ? AND feature = ?",
+                                       (self.feature_type, feature)).fetchone()
+
+    def get_id(self, feature: str) -> int | None:
+        """
+        Returns the interned ID of a feature, None if it has never been added
+        """
+        feature_id = self._ids.get(feature)
+        if feature_id is not None:
+            return feature_id
+        row = self._spilled_row(feature)
+        return row[0] if row else None
+
+    def add(self, feature: str, count: int = 1) -> int:
+        """
+        Adds count to a feature, inserting it if it is new
+
+        Returns:
+            int: the feature's ID
+        """
+        feature_id = self._ids.get(feature)
+        if feature_id is not None:
+            self._counts[feature_id - self._base] += count
+            return feature_id
+        row = self._spilled_row(feature)
+        if row is not None:
+            self._store._db.execute("UPDATE features SET count = count + ? WHERE type = ? AND id = ?", (count, self.feature_type, row[0]))
+            return row[0]
+        return self._insert(feature, count)
+
+    def _insert(self, feature: str, count: int) -> int:
+        feature_id = self._base + len(self._counts)
+        self._ids[feature] = feature_id
+        self._counts.append(count)
+        self._store._grow(len(feature) + ENTRY_OVERHEAD)
+        return feature_id
+
+    def spill(self) -> int:
+        """
+        Moves every in memory feature to the SQLite file
+
+        Returns:
+            int: approximate number of bytes freed
+        """
+        if not self._ids:
+            return 0
+        rows = ((self.feature_type, feature, feature_id, self._counts[feature_id - self._base])
+                for feature, feature_id in self._ids.items())
+        self._store._db.executemany("INSERT INTO features (type, feature, id, count) VALUES (?, ?, ?, ?)", rows)
+        freed = sum(len(feature) + ENTRY_OVERHEAD for feature in self._ids)
+        self._base += len(self._counts)
+        self._ids = {}
+        self._counts = array("q")
+        return freed
+
+    # MutableMapping interface
+    def __contains__(self, feature) -> bool:
+        return feature in self._ids or self._spilled_row(feature) is not None
+
+    def __getitem__(self, feature: str) -> int:
+        feature_id = self._ids.get(feature)
+        if feature_id is not None:
+            return self._counts[feature_id - self._base]
+        row = self._spilled_row(feature)
+        return row[1] if row else 0 # NOTE: missing features read as 0 like defaultdict(int), so unique[type][feature] += n works
+
+    def __setitem__(self, feature: str, count: int):
+        feature_id = self._ids.get(feature)
+        if feature_id is not None:
+            self._counts[feature_id - self._base] = count
+            return
+        row = self._spilled_row(feature)
+        if row is not None:
+            self._store._db.execute("UPDATE features SET count = ? WHERE type = ? AND id = ?", (count, self.feature_type, row[0]))
+        else:
+            self._insert(feature, count)
+
+    def __delitem__(self, feature: str):
+        feature_id = self._ids.pop(feature, None)
+        if feature_id is not None:
+            self._counts[feature_id - self._base] = -1 # NOTE: slot is left unused, IDs never move
+            return
+        row = self._spilled_row(feature)
+        if row is None:
+            raise KeyError(feature)
+        self._store._db.execute("DELETE FROM features WHERE type = ? AND id = ?", (self.feature_type, row[0]))
+
+    def __iter__(self) -> Iterator[str]:
+        for feature, _ in self.items():
+            yield feature
+
+    def items(self) -> Iterator[tuple[str, int]]:
+        """
+        Yields (feature, count) in ID order (first seen order), spilled features first
+        """
+        if self._base:
+            cursor = self._store._db.execute("SELECT feature, count FROM features WHERE type = ? ORDER BY id", (self.feature_type,))
+            while True:
+                rows = cursor.fetchmany(SPILL_FETCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+        base = self._base
+        counts = self._counts
+        for feature, feature_id in list(self._ids.items()):
+            yield feature, counts[feature_id - base]
+
+    def __len__(self) -> int:
+        spilled = 0
+        if self._base:
+            spilled = self._store._db.execute("SELECT COUNT(*) FROM features WHERE type = ?", (self.feature_type,)).fetchone()[0]
+        return spilled + len(self._ids)
+
+class UniqueFeatureStore(Mapping):
+    """
+    Mapping of feature type -> FeatureCounts with a shared memory budget
+
+    Args:
+        feature_types (list[str]): feature types to keep counts for, usually FeatureExtractor.FEATURE_TYPES
+        memory_budget (int): approximate bytes of features kept in memory before spilling to disk
+        spill_path (str): SQLite file for spilled features, defaults to a temporary file that is deleted on close()
+    """
+
+    def __init__(self, feature_types: list[str], memory_budget: int = DEFAULT_MEMORY_BUDGET, spill_path: str | None = None):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self._spill_path = spill_path
+        self._temp_spill = spill_path is None
+        self._db = None
+        self._types = {feature_type: FeatureCounts(self, feature_type) for feature_type in feature_types}
+
+    def __getitem__(self, feature_type: str) -> FeatureCounts:
+        return self._types[feature_type]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._types)
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+    def add(self, feature_type: str, feature: str, count: int = 1) -> int:
+        return self._types[feature_type].add(feature, count)
+
+    def _open_spill_file(self):
+        if self._spill_path is None:
+            handle, self._spill_path = tempfile.mkstemp(prefix="unique_features_", suffix=".sqlite")
+            os.close(handle)
+        self._db = sqlite3.connect(self._spill_path)
+        self._db.execute("PRAGMA journal_mode=OFF") # Scratch data, nothing to recover after a crash
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE IF NOT EXISTS features (type TEXT, feature TEXT, id INTEGER, count INTEGER, PRIMARY KEY (type, feature))")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS features_id ON features (type, id)")
+        self._db.execute("DELETE FROM features") # Left over from a previous run that used the same spill_path
+
+    def _grow(self, size: int):
+        self.memory_used += size
+        if self.memory_used > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """
+        Moves every in memory feature of every type to the SQLite file
+        """
+        if self._db is None:
+            self._open_spill_file()
+        for counts in self._types.values():
+            self.memory_used -= counts.spill()
+        self._db.commit()
+        self.memory_used = max(0, self.memory_used)
+        print(f"INFO: Unique features passed the {self.memory_budget / 1024 ** 2:.0f}MB memory budget, spilled to {self._spill_path}")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            if self._temp_spill and os.path.exists(self._spill_path):
+                os.remove(self._spill_path)
@@ -1,82 +1,227 @@
 import os
 import sys
 import io
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import json
+import atexit
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context, url_for
 from werkzeug.utils import secure_filename
 import numpy as np
-from predict import load_feature_list, vectorize_apk, load_model, parse_feature_file
-import tensorflow as tf
-from tensorflow import keras
+from predict import get_predictor, model_input
+from feature_vectorizer import get_vectorizer
+from micro_batcher import MicroBatcher, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT
+from bulk_input import is_archive, iter_archive_members, iter_jsonl_records, iter_chunks, JSONL_MIMETYPES
+from verdict_cache import VerdictCache, model_version, feature_keys, DEFAULT_MAX_ENTRIES, DEFAULT_TTL
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['MODEL_PATH'] = os.environ.get('MODEL_PATH', 'apk_malware_cnn_model.keras')  # A .tflite export is served without TensorFlow
+# Concurrent /predict calls are run as one model batch (micro_batcher.py), 1 disables batching
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', DEFAULT_MAX_BATCH_SIZE))
+app.config['BATCH_MAX_WAIT'] = float(os.environ.get('BATCH_MAX_WAIT', DEFAULT_MAX_WAIT))  # Seconds
+# /predict_batch: the body is streamed, so it has its own size limit (None = no limit), each feature file is still capped
+app.config['BULK_MAX_CONTENT_LENGTH'] = None
+app.config['BULK_MAX_FILE_SIZE'] = 16 * 1024 * 1024
+app.config['BULK_CHUNK_FILES'] = 256  # Feature files predicted together
+app.config['BULK_CHUNK_BYTES'] = 64 * 1024 * 1024  # Content held in memory at once
+# /jobs: raw APKs are extracted by a pool of worker processes (job_queue.py), 0 workers disables it
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_TIMEOUT'] = float(os.environ.get('JOB_TIMEOUT', 300))  # Seconds per APK
+app.config['JOB_MAX_QUEUED'] = int(os.environ.get('JOB_MAX_QUEUED', 100))
+app.config['JOB_STORE'] = 'jobs.sqlite'
+app.config['JOB_MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # APKs are much larger than feature files
+app.config['JOB_MAX_WAIT'] = 60.0  # Longest long poll, seconds
+# Scores of already seen feature sets (verdict_cache.py), 0 entries disables it, a path keeps it across restarts
+app.config['VERDICT_CACHE_SIZE'] = int(os.environ.get('VERDICT_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+app.config['VERDICT_CACHE_TTL'] = float(os.environ.get('VERDICT_CACHE_TTL', DEFAULT_TTL))  # Seconds
+app.config['VERDICT_CACHE_PATH'] = os.environ.get('VERDICT_CACHE_PATH')
 
 # Create uploads directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Global variables for model and feature list (loaded once at startup)
+# Global variables for model and feature list (loaded at startup, reloaded by current_model when the files change)
 model = None
 feature_list = None
 feature_to_index = None
+batcher = None
+jobs = None
+verdict_cache = None
 
 def init_model():
     """Initialize model and feature list (called once at startup)"""
-    global model, feature_list, feature_to_index
+    global model, feature_list, feature_to_index, batcher
     
     try:
         print("Initializing model and feature list...")
-        feature_list, feature_to_index = load_feature_list()
+        # Loads the feature index and model and runs one dummy batch, so the first request doesn't pay for TensorFlow's setup
+        model, feature_list, feature_to_index = get_predictor(app.config['MODEL_PATH']).warm_up().load()
         print(f"Loaded {len(feature_list)} features")
-        
-        model = load_model('apk_malware_cnn_model.keras')
         print("Model loaded successfully!")
+        
+        if app.config['VERDICT_CACHE_SIZE'] > 0:
+            init_verdict_cache()
+        
+        if app.config['BATCH_MAX_SIZE'] > 1:
+            batcher = MicroBatcher(predict_batch, app.config['BATCH_MAX_SIZE'], app.config['BATCH_MAX_WAIT'])
+            print(f"Batching up to {app.config['BATCH_MAX_SIZE']} requests, waiting at most {app.config['BATCH_MAX_WAIT']*1000:.1f}ms")
+        
+        if app.config['JOB_WORKERS'] > 0:
+            init_jobs()
     except Exception as e:
         print(f"ERROR: Failed to initialize model: {e}")
         print("\nPlease ensure:")
-        print("  1. apk_malware_cnn_model.keras exists in the current directory")
-        print("  2. feature_list.npy exists OR unique_features/ directory exists")
+        print(f"  1. {app.config['MODEL_PATH']} exists in the current directory")
+        print("  2. feature_index.bin OR feature_list.npy OR unique_features/ directory exists")
+        print("     and the model was trained with that feature index")
         print("  3. All required dependencies are installed")
         raise
 
-def predict_from_content(content):
-    """Predict from file content string"""
+def init_verdict_cache():
+    """Create the verdict cache for the loaded model, or empty it if a different model or feature index was loaded"""
+    global verdict_cache
+    
+    version = model_version(app.config['MODEL_PATH'], feature_to_index)
+    if verdict_cache is not None:
+        verdict_cache.set_version(version)
+        return
+    
+    verdict_cache = VerdictCache(version, app.config['VERDICT_CACHE_SIZE'], app.config['VERDICT_CACHE_TTL'],
+                                 app.config['VERDICT_CACHE_PATH'])
+    if verdict_cache.path is not None:
+        atexit.register(verdict_cache.save)
+    print(f"Verdict cache: up to {verdict_cache.max_entries} feature sets, {len(verdict_cache)} loaded")
+
+def current_model():
+    """Returns (model, feature_list, feature_to_index), reloaded if a retrained model or new feature index replaced the files"""
     global model, feature_list, feature_to_index
     
-    # Parse features from content
-    features = {}
-    for line in content.split('\n'):
-        line = line.strip()
-        if line:
-            parts = line.rsplit(' ', 1)
-            if len(parts) == 2:
-                feature_name = parts[0]
-                try:
-                    count = int(parts[1])
-                    features[feature_name] = count
-                except ValueError:
-                    continue
-    
-    # Create feature vector
-    vector = np.zeros(len(feature_list), dtype=np.float32)
-    for feature_name, count in features.items():
-        if feature_name in feature_to_index:
-            vector[feature_to_index[feature_name]] = count
-    
-    # Reshape for model input
-    vector = vector.astype(np.float32)
-    vector = np.expand_dims(vector, axis=0)   
-    vector = np.expand_dims(vector, axis=-1)
-    
-    # Predict
-    prediction = model.predict(vector, verbose=0)
+    loaded = get_predictor(app.config['MODEL_PATH']).load()
+    if loaded[0] is not model:
+        model, feature_list, feature_to_index = loaded
+        print(f"Reloaded {app.config['MODEL_PATH']} with {len(feature_list)} features")
+        if verdict_cache is not None:
+            init_verdict_cache()  # Scores of the previous model must not be served for the new one
+    return loaded
+
+def predict_batch(contents):
+    """Predict a list of file content strings with one model call, returns (label, score, feature_count) for each"""
+    model, feature_list, feature_to_index = current_model()
+    
+    # Parse features from content (one batched lookup)
+    vectorizer = get_vectorizer(feature_list, feature_to_index)
+    rows, columns, counts, feature_counts = vectorizer.entries(contents)
+    
+    # Feature sets seen before (repackaged samples, app updates) reuse their score instead of running the model
+    scores = [None] * len(contents)
+    if verdict_cache is not None:
+        keys = feature_keys(rows, columns, counts, len(contents), verdict_cache.version)
+        scores = verdict_cache.get_many(keys)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    
+    if missing:
+        # Create feature vectors of the uncached contents, renumbered 0..len(missing)-1
+        # Sparse input models get the CSR matrix as is, the vocabulary wide dense vectors are only built for the CNN
+        position = np.full(len(contents), -1, dtype=np.int64)
+        position[missing] = np.arange(len(missing))
+        keep = position[rows] >= 0
+        sparse_input = getattr(model, 'sparse_input', False)
+        vectors = vectorizer.to_matrix(position[rows[keep]], columns[keep], counts[keep], len(missing), sparse_output=sparse_input)
+        
+        # Reshape for model input
+        vectors = model_input(vectors, model)
+        
+        # Predict
+        prediction = np.asarray(model.predict_on_batch(vectors)).reshape(-1)
+        for i, score in zip(missing, prediction.tolist()):
+            scores[i] = float(score)
+        if verdict_cache is not None:
+            verdict_cache.put_many([keys[i] for i in missing], [scores[i] for i in missing])
     
     # Get label and score
-    score = float(prediction[0][0])
-    label = 1 if score >= 0.5 else 0
+    results = []
+    for score, feature_count in zip(scores, feature_counts.tolist()):
+        label = 1 if score >= 0.5 else 0
+        results.append((label, score, int(feature_count)))
+    return results
+
+def init_jobs():
+    """Start the APK extraction job queue, the web demo still works without androguard"""
+    global jobs
+    
+    try:
+        from job_queue import JobQueue
+    except ImportError as e:
+        print(f"WARNING: APK jobs disabled, extraction dependencies are missing: {e}")
+        return
     
-    return label, score, len(features)
+    jobs = JobQueue(lambda content: prediction_result(*predict_from_content(content)),
+                    app.config['UPLOAD_FOLDER'], app.config['JOB_STORE'], app.config['JOB_WORKERS'],
+                    app.config['JOB_TIMEOUT'], app.config['JOB_MAX_QUEUED'])
+    print(f"APK jobs enabled: {app.config['JOB_WORKERS']} extraction workers, up to {app.config['JOB_MAX_QUEUED']} queued")
+
+def predict_from_content(content):
+    """Predict from file content string"""
+    # Joins the requests that arrive at the same time into one batch, the batcher thread is the only one using the model
+    if batcher is not None:
+        return batcher.submit(content)
+    return predict_batch([content])[0]
+
+def predict_from_contents(contents):
+    """Predict many file content strings, returns (label, score, feature_count) or the Exception for each"""
+    if batcher is not None:
+        futures = [batcher.submit_async(content) for content in contents]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+    try:
+        return predict_batch(contents)
+    except Exception as e:
+        return [e] * len(contents)
+
+def prediction_result(label, score, feature_count):
+    """JSON result of one prediction"""
+    label_name = "Malicious" if label == 1 else "Benign"
+    confidence = score if label == 1 else (1 - score)
+    
+    return {
+        'success': True,
+        'label': label,
+        'label_name': label_name,
+        'score': score,
+        'confidence': confidence,
+        'feature_count': feature_count,
+        'message': f'The APK is classified as {label_name} with {confidence*100:.2f}% confidence.'
+    }
+
+def predict_stream(items):
+    """Predicts (name, content) items chunk by chunk and yields one NDJSON line per item, then a summary line"""
+    count = 0
+    errors = 0
+    try:
+        for chunk in iter_chunks(items, app.config['BULK_CHUNK_FILES'], app.config['BULK_CHUNK_BYTES']):
+            contents = [content for _, content in chunk if isinstance(content, str)]
+            predictions = iter(predict_from_contents(contents) if contents else [])
+            for name, content in chunk:
+                if not isinstance(content, str):  # Member or line the reader could not use
+                    errors += 1
+                    line = {'name': name, 'success': False, 'error': f'Invalid input: {str(content)}'}
+                else:
+                    result = next(predictions)
+                    if isinstance(result, Exception):
+                        errors += 1
+                        line = {'name': name, 'success': False, 'error': f'Prediction failed: {str(result)}'}
+                    else:
+                        line = {'name': name, **prediction_result(*result)}
+                count += 1
+                yield json.dumps(line) + '\n'
+    except Exception as e:  # Unreadable archive or body, the lines already sent stay valid
+        yield json.dumps({'success': False, 'error': f'Reading input failed: {str(e)}'}) + '\n'
+    yield json.dumps({'done': True, 'count': count, 'errors': errors}) + '\n'
 
 @app.route('/')
 def index():
@@ -101,31 +246,99 @@ def predict():
         # Make prediction
         label, score, feature_count = predict_from_content(content)
         
-        label_name = "Malicious" if label == 1 else "Benign"
-        confidence = score if label == 1 else (1 - score)
-        
-        result = {
-            'success': True,
-            'label': label,
-            'label_name': label_name,
-            'score': score,
-            'confidence': confidence,
-            'feature_count': feature_count,
-            'message': f'The APK is classified as {label_name} with {confidence*100:.2f}% confidence.'
-        }
-        
-        return jsonify(result)
+        return jsonify(prediction_result(label, score, feature_count))
     
     except Exception as e:
         return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
 
+def read_archive(stream, filename, max_file_size):
+    """iter_archive_members that closes the archive when it is done"""
+    try:
+        yield from iter_archive_members(stream, filename, max_file_size)
+    finally:
+        stream.close()
+
+@app.route('/predict_batch', methods=['POST'])
+def bulk_predict():
+    """
+    Predict many feature files in one request, results are streamed back as NDJSON while the input is read
+    Input: a multipart 'file' that is a .zip/.tar/.tar.gz/.tgz of feature files,
+    or a JSONL body (Content-Type application/x-ndjson) with one {"name": ..., "content": ...} per line
+    """
+    request.max_content_length = app.config['BULK_MAX_CONTENT_LENGTH']
+    max_file_size = app.config['BULK_MAX_FILE_SIZE']
+    
+    if request.mimetype in JSONL_MIMETYPES:
+        items = iter_jsonl_records(request.stream, max_file_size)
+    else:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided, send a zip/tar archive as file or a JSONL body'}), 400
+        file = request.files['file']  # Large uploads are spooled to a temporary file, not kept in memory
+        if not is_archive(file.filename or ''):
+            return jsonify({'error': 'file must be a .zip, .tar, .tar.gz or .tgz archive of feature files'}), 400
+        # Take the spooled upload from the request, request.close() would close it before the response is streamed
+        stream, file.stream = file.stream, io.BytesIO()
+        items = read_archive(stream, file.filename, max_file_size)
+    
+    return Response(stream_with_context(predict_stream(items)), mimetype='application/x-ndjson')
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a raw APK for extraction and prediction, returns a job ID to poll"""
+    if jobs is None:
+        return jsonify({'error': 'APK jobs are not enabled on this server'}), 503
+    
+    request.max_content_length = app.config['JOB_MAX_CONTENT_LENGTH']
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    from job_queue import QueueFull
+    try:
+        job_id = jobs.submit(file.save, secure_filename(file.filename))
+    except QueueFull as e:
+        # Backpressure: the client should retry later instead of piling more APKs on the workers
+        response = jsonify({'error': f'Too many APKs queued, try again later ({str(e)})'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Job status and verdict, ?wait=<seconds> long polls until the job finishes"""
+    if jobs is None:
+        return jsonify({'error': 'APK jobs are not enabled on this server'}), 503
+    
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['JOB_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    
+    job = jobs.wait(job_id, wait) if wait > 0 else jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'model_loaded': model is not None,
-        'features_loaded': feature_list is not None
+        'features_loaded': feature_list is not None,
+        'batching': batcher.stats() if batcher is not None else None,
+        'jobs': jobs.stats() if jobs is not None else None,
+        'verdict_cache': verdict_cache.stats() if verdict_cache is not None else None
     })
 
 if __name__ == '__main__':
@@ -142,9 +355,11 @@ if __name__ == '__main__':
         print("  Local:   http://127.0.0.1:5000")
         print("  Network: http://0.0.0.0:5000")
         print("\nPress Ctrl+C to stop the server")
+        print("For production use a WSGI server, see wsgi.py")
         print("="*60 + "\n")
         
-        app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
+        # threaded: concurrent uploads have to reach the batcher at the same time to be batched
+        app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False, threaded=True)
     except KeyboardInterrupt:
         print("\n\nServer stopped by user")
     except Exception as e:
@@ -0,0 +1,108 @@
+"""
+Streaming readers for /predict_batch uploads
+
+Both readers yield one (name, content) pair at a time, so only the feature files currently being predicted are in memory:
+    - a .zip / .tar / .tar.gz / .tgz archive of feature files (.txt members, other members are skipped)
+    - a JSONL body, one {"name": ..., "content": ...} object per line
+
+A member or line that cannot be used yields (name, Exception) instead of stopping the stream,
+content larger than max_size is rejected without being read into memory.
+"""
+
+import json
+import tarfile
+import zipfile
+from typing import IO, Iterator
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+JSONL_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines')
+FEATURE_FILE_EXTENSION = '.txt'
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def iter_archive_members(stream: IO[bytes], filename: str, max_size: int | None = None) -> Iterator[tuple[str, str | Exception]]:
+    """
+    Yields (member name, decoded content) for every feature file in a zip or tar archive
+
+    Args:
+        stream (IO[bytes]): archive file, zip needs it to be seekable, tar is read front to back
+        filename (str): upload name, picks zip or tar by extension
+        max_size (int): largest member read, bigger ones yield a ValueError
+    """
+    if filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.endswith(FEATURE_FILE_EXTENSION):
+                    continue
+                if max_size is not None and info.file_size > max_size:
+                    yield info.filename, ValueError(f"{info.file_size} bytes is over the {max_size} byte limit")
+                    continue
+                try:
+                    yield info.filename, archive.read(info).decode('utf-8')
+                except Exception as e:
+                    yield info.filename, e
+    else:
+        with tarfile.open(fileobj=stream, mode='r|*') as archive: # Stream mode, members are read in order without seeking
+            for member in archive:
+                if not member.isfile() or not member.name.endswith(FEATURE_FILE_EXTENSION):
+                    continue
+                if max_size is not None and member.size > max_size:
+                    yield member.name, ValueError(f"{member.size} bytes is over the {max_size} byte limit")
+                    continue
+                try:
+                    yield member.name, archive.extractfile(member).read().decode('utf-8')
+                except Exception as e:
+                    yield member.name, e
+
+def iter_jsonl_records(stream: IO[bytes], max_size: int | None = None) -> Iterator[tuple[str, str | Exception]]:
+    """
+    Yields (name, content) for every {"name": ..., "content": ...} line of a JSONL stream, name defaults to "line <n>"
+
+    Args:
+        stream (IO[bytes]): request body, read one line at a time
+        max_size (int): longest line read, longer lines are skipped and yield a ValueError
+    """
+    line_number = 0
+    while True:
+        line = stream.readline(max_size + 1) if max_size is not None else stream.readline()
+        if not line:
+            break
+        line_number += 1
+        name = f"line {line_number}"
+
+        if max_size is not None and len(line) > max_size and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'): # Skip the rest of the line without keeping it
+                line = stream.readline(max_size + 1)
+            yield name, ValueError(f"line is over the {max_size} byte limit")
+            continue
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+            name = str(record.get('name', name))
+            content = record['content']
+            if not isinstance(content, str):
+                raise ValueError("content must be a string")
+        except Exception as e:
+            yield name, e
+            continue
+        yield name, content
+
+def iter_chunks(items: Iterator[tuple[str, str | Exception]], max_items: int, max_bytes: int) -> Iterator[list[tuple[str, str | Exception]]]:
+    """
+    Groups items into chunks of at most max_items items and (about) max_bytes of content
+    """
+    chunk = []
+    chunk_bytes = 0
+    for name, content in items:
+        chunk.append((name, content))
+        if isinstance(content, str):
+            chunk_bytes += len(content)
+        if len(chunk) >= max_items or chunk_bytes >= max_bytes:
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+    if chunk:
+        yield chunk
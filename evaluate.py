@@ -1,10 +1,8 @@
 import os
 import sys
+import queue
+import threading
 import numpy as np
-from collections import defaultdict
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, classification_report
-import tensorflow as tf
-from tensorflow import keras
 
 # Try to import tqdm for progress bar, fallback to simple iteration if not available
 try:
@@ -16,47 +14,92 @@ except ImportError:
         return iterable
 
 # Import functions from predict.py
-from predict import load_feature_list, vectorize_apk, load_model, parse_feature_file
+from predict import load_feature_list, load_model, model_input
+from feature_vectorizer import get_vectorizer
 
-def batch_predict(feature_files, true_labels, feature_list, feature_to_index, model):
-    """Batch predict on multiple feature files"""
-    predictions = []
-    scores = []
-    
-    print(f"Processing {len(feature_files)} files...")
-    
-    iterator = tqdm(feature_files, desc="Predicting") if USE_TQDM else feature_files
-    for i, filepath in enumerate(iterator):
-        if not USE_TQDM and (i + 1) % 50 == 0:
-            print(f"  Processed {i + 1}/{len(feature_files)} files...")
-        try:
-            # Vectorize APK
-            vector = vectorize_apk(filepath, feature_list, feature_to_index)
-            
-            # Reshape for model input (same as in predict.py)
-            vector = vector.astype(np.float32)
-            vector = np.expand_dims(vector, axis=0)   
-            vector = np.expand_dims(vector, axis=-1)
+DEFAULT_BATCH_SIZE = 256 # Files per model call
+QUEUED_BATCHES = 2 # Batches vectorized ahead of the model
+
+def vectorize_batches(feature_files, feature_list, feature_to_index, batch_size, batches, model=None):
+    """Producer: vectorizes feature_files batch_size at a time and puts (start, rows, vectors) on batches, None when done"""
+    sparse_input = getattr(model, 'sparse_input', False)
+    vectorizer = get_vectorizer(feature_list, feature_to_index)
+    try:
+        for start in range(0, len(feature_files), batch_size):
+            rows = []
+            texts = []
+            for row, filepath in enumerate(feature_files[start:start + batch_size], start):
+                try:
+                    with open(filepath, 'r', encoding='utf-8') as f:
+                        texts.append(f.read())
+                    rows.append(row)
+                except Exception as e:
+                    print(f"\nError processing {filepath}: {e}")
             
-            # Predict
-            prediction = model.predict(vector, verbose=0)
+            try:
+                # Reshape for model input (same as in predict.py): (batch, features, 1), or CSR for sparse input models
+                vectors = model_input(vectorizer.transform_texts(texts, sparse_output=sparse_input), model)
+            except Exception as e:
+                for row in rows:
+                    print(f"\nError processing {feature_files[row]}: {e}")
+                rows, vectors = [], None
+            batches.put((start, rows, vectors))
+    finally:
+        batches.put(None)
+
+def batch_predict(feature_files, true_labels, feature_list, feature_to_index, model, batch_size=DEFAULT_BATCH_SIZE):
+    """Batch predict on multiple feature files"""
+    # Files that fail keep the default prediction (benign)
+    predictions = np.zeros(len(feature_files), dtype=np.int64)
+    scores = np.zeros(len(feature_files), dtype=np.float64)
+    
+    print(f"Processing {len(feature_files)} files in batches of {batch_size}...")
+    
+    # Vectorize the next batches in a thread while the model runs on the current one
+    batches = queue.Queue(maxsize=QUEUED_BATCHES)
+    producer = threading.Thread(target=vectorize_batches, args=(feature_files, feature_list, feature_to_index, batch_size, batches, model), daemon=True)
+    producer.start()
+    
+    progress = tqdm(total=len(feature_files), desc="Predicting") if USE_TQDM else None
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        start, rows, vectors = batch
+        
+        if rows:
+            try:
+                # Predict, one model call for the whole batch
+                batch_scores = np.asarray(model.predict_on_batch(vectors)).reshape(-1)
+            except Exception:
+                # Retry file by file so one bad file only loses its own prediction
+                batch_scores = np.zeros(len(rows))
+                for i, row in enumerate(rows):
+                    try:
+                        batch_scores[i] = float(np.asarray(model.predict_on_batch(vectors[i:i + 1])).reshape(-1)[0])
+                    except Exception as e:
+                        print(f"\nError processing {feature_files[row]}: {e}")
+                        rows[i] = -1
             
             # Get label and score
-            score = float(prediction[0][0])
-            label = 1 if score >= 0.5 else 0
-            
-            predictions.append(label)
-            scores.append(score)
-        except Exception as e:
-            print(f"\nError processing {filepath}: {e}")
-            # Use default prediction (benign) if error occurs
-            predictions.append(0)
-            scores.append(0.0)
-    
-    return np.array(predictions), np.array(scores)
+            for row, score in zip(rows, batch_scores):
+                if row >= 0:
+                    scores[row] = float(score)
+                    predictions[row] = 1 if score >= 0.5 else 0
+        
+        done = min(start + batch_size, len(feature_files))
+        if progress is not None:
+            progress.update(done - start)
+        else:
+            print(f"  Processed {done}/{len(feature_files)} files...")
+    producer.join()
+    if progress is not None:
+        progress.close()
+    
+    return predictions, scores
 
 def evaluate_model(benign_dir='benign_features', malicious_dir='malicious_features', 
-                   model_path='apk_malware_cnn_model.keras'):
+                   model_path='apk_malware_cnn_model.keras', batch_size=DEFAULT_BATCH_SIZE):
     """Evaluate model on test dataset"""
     
     print("="*60)
@@ -70,7 +113,7 @@ def evaluate_model(benign_dir='benign_features', malicious_dir='malicious_featur
     
     # Load model
     print("\n[2/4] Loading model...")
-    model = load_model(model_path)
+    model = load_model(model_path, feature_to_index)
     
     # Collect all feature files and their true labels
     print("\n[3/4] Collecting test files...")
@@ -100,10 +143,12 @@ def evaluate_model(benign_dir='benign_features', malicious_dir='malicious_featur
     # Batch predict
     print("\n[4/4] Running predictions...")
     predicted_labels, predicted_scores = batch_predict(
-        feature_files, true_labels, feature_list, feature_to_index, model
+        feature_files, true_labels, feature_list, feature_to_index, model, batch_size
     )
     
-    # Calculate metrics
+    # Calculate metrics (sklearn is only imported here, it is slow to import and only needed for the report)
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, classification_report
+    
     print("\n" + "="*60)
     print("Evaluation Results")
     print("="*60)
@@ -195,8 +240,13 @@ def main():
     else:
         malicious_dir = 'malicious_features'
     
+    if len(sys.argv) > 4:
+        batch_size = int(sys.argv[4])
+    else:
+        batch_size = DEFAULT_BATCH_SIZE
+    
     try:
-        results = evaluate_model(benign_dir, malicious_dir, model_path)
+        results = evaluate_model(benign_dir, malicious_dir, model_path, batch_size)
     except Exception as e:
         print(f"\nError during evaluation: {e}")
         import traceback
@@ -0,0 +1,346 @@
+"""
+Compiled feature index: the feature -> column mapping shared by training (vectorizeFeatures, generate_vectors)
+and serving (predict, evaluate, app)
+
+The mapping used to be rebuilt from text files or a pickled feature_list.npy on every start, three slightly different ways
+(bare vs "Tag: feature" names, different unique_*.txt file orders). A model is only valid with the exact column order its
+vectors were built with, and nothing checked that. feature_index.bin is compiled once and memory mapped by every reader:
+
+Layout (little endian, every section starts 8 byte aligned):
+    header      magic, version, n_features, section offsets and the sha256 of the names (HEADER_FORMAT)
+    names       uint64[n_features + 1] offsets into a utf-8 blob, feature names in column order ("Tag: feature")
+    hashes      uint64[n_features] stable 64 bit hashes of the names, sorted
+    columns     uint32[n_features] column of every sorted hash
+
+A lookup hashes the name and binary searches the sorted hashes, so opening an index does not read or hash any name.
+The sha256 identifies the column layout: stamp_model() records it next to a trained model and check_model()
+refuses to serve a model with an index it was not trained on, instead of silently mis-mapping columns
+
+Usage:
+    python feature_index.py unique_features feature_index.bin     # compile from unique_*.txt files
+    python feature_index.py feature_list.npy feature_index.bin    # compile from an existing feature_list.npy
+"""
+
+import os
+import sys
+import json
+import mmap
+import bisect
+import struct
+import hashlib
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+MAGIC = b"APKFIDX\x00"
+VERSION = 1
+HEADER_FORMAT = "<8sII4Q32s" # magic, version, reserved, n_features, offsets of: names, hashes, columns, sha256 of the names section
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FEATURE_INDEX_FILENAME = "feature_index.bin"
+FEATURE_LIST_FILENAME = "feature_list.npy"
+UNIQUE_FEATURES_DIRECTORY = "unique_features"
+STAMP_SUFFIX = ".features.json" # <model_path>.features.json, written by stamp_model
+
+# Column order of the unique feature files, the order feature_list.npy and the trained CNN use
+UNIQUE_FEATURE_FILES = [
+    "unique_permissions.txt",
+    "unique_intents.txt",
+    "unique_api_calls.txt",
+    "unique_libraries.txt",
+    "unique_urls.txt",
+    "unique_used_hsware.txt"
+]
+
+class FeatureIndexMismatch(ValueError):
+    """
+    Raised when a model was trained with a different feature index than the one being served
+    """
+
+def name_hash(name: str) -> int:
+    """
+    Stable 64 bit hash of a feature name (str hashes change between processes)
+    """
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8", errors="surrogatepass"), digest_size=8).digest(), "little")
+
+def parse_tagged_line(line: str) -> tuple[str, int] | None:
+    """
+    Parses a feature file line, "Tag: feature" or "Tag: feature count", into the tagged name the index stores
+
+    Returns:
+        tuple[str, int] | None: ("Tag: feature", count), None for empty lines and lines without a tag
+    """
+    line = line.strip()
+    head, _, tail = line.rpartition(" ")
+    if head and tail.isdigit(): # Trailing count
+        line, count = head.rstrip(), int(tail)
+    else:
+        count = 1
+    tag, separator, feature = line.partition(": ")
+    if not (tag and separator and feature.strip()):
+        return None
+    return line, count
+
+def read_unique_feature_files(unique_dir: str = UNIQUE_FEATURES_DIRECTORY) -> list[str]:
+    """
+    Reads the unique_*.txt files in UNIQUE_FEATURE_FILES order, every distinct tagged name once
+
+    Returns:
+        list[str]: feature names in column order
+    """
+    feature_list = []
+    seen = set()
+    for filename in UNIQUE_FEATURE_FILES:
+        file_path = os.path.join(unique_dir, filename)
+        if not os.path.isfile(file_path):
+            print(f"[WARN] Unique feature file not found, skipping: {file_path}")
+            continue
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                parsed = parse_tagged_line(line)
+                if parsed is not None and parsed[0] not in seen:
+                    seen.add(parsed[0])
+                    feature_list.append(parsed[0])
+    return feature_list
+
+def _pad(f) -> int:
+    """
+    Pads the file to the next 8 byte boundary and returns the position
+    """
+    position = f.tell()
+    if position % 8:
+        f.write(b"\x00" * (8 - position % 8))
+    return f.tell()
+
+def write_feature_index(index_path: str, feature_list: Sequence[str]) -> str:
+    """
+    Compiles feature_list (names in column order) into an index file, written to <index_path>.tmp and renamed
+
+    Returns:
+        str: sha256 of the names, the index version models are stamped with
+    """
+    encoded = [name.encode("utf-8", errors="surrogatepass") for name in feature_list]
+    if len(set(encoded)) != len(encoded):
+        raise ValueError("[ERROR] feature_list has repeated names, every name needs exactly one column")
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    names_section = offsets.tobytes() + b"".join(encoded)
+    digest = hashlib.sha256(names_section).digest()
+
+    hashes = np.fromiter((name_hash(name) for name in feature_list), dtype="<u8", count=len(feature_list))
+    order = np.argsort(hashes, kind="stable")
+
+    index_dir = os.path.dirname(index_path)
+    if index_dir and not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(b"\x00" * HEADER_SIZE) # Filled in below
+        names_offset = _pad(f)
+        f.write(names_section)
+        hashes_offset = _pad(f)
+        f.write(hashes[order].tobytes())
+        columns_offset = _pad(f)
+        f.write(order.astype("<u4").tobytes())
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, len(encoded), names_offset, hashes_offset, columns_offset, digest))
+    os.replace(temp_path, index_path)
+    return digest.hex()
+
+class FeatureNames(Sequence):
+    """
+    Read only list of the feature names in column order, decoded from the mapped file as they are asked for
+    """
+
+    def __init__(self, index: "FeatureIndex"):
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._index.name(column) for column in range(len(self))[i]]
+        return self._index.name(i)
+
+class FeatureIndex(Mapping):
+    """
+    Memory mapped feature index, a read only {name: column} mapping
+
+        index = FeatureIndex("feature_index.bin")
+        index["Permission: android.permission.INTERNET"]    # column, KeyError if missing
+        index.get(name, -1)
+        index.names[column]                                 # name of a column
+        index.sha256                                        # version of the column layout
+
+    Lookups are a hash and a binary search on the mapped file. Hot loops that look up millions of names
+    should use to_dict() once instead. Pickles as its path, so it is cheap to send to worker processes
+
+    Args:
+        index_path (str): file written by write_feature_index
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._file = open(index_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, n_features, names_offset, hashes_offset, columns_offset, digest = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"[ERROR] {index_path} is not a feature index")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"[ERROR] {index_path} is feature index version {version}, expected {VERSION}")
+
+        self._n_features = n_features
+        self.sha256: str = digest.hex()
+        # NOTE: memoryview casts index with plain ints (bisect, slicing), far cheaper per lookup than numpy scalars
+        view = memoryview(self._mmap)
+        self._offsets = view[names_offset:names_offset + 8 * (n_features + 1)].cast("Q")
+        self._blob_offset = names_offset + 8 * (n_features + 1)
+        self._hashes = view[hashes_offset:hashes_offset + 8 * n_features].cast("Q")
+        self._columns = view[columns_offset:columns_offset + 4 * n_features].cast("I")
+        view.release()
+        self.names = FeatureNames(self)
+        self._dict = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __reduce__(self):
+        return (FeatureIndex, (self.index_path,))
+
+    def close(self):
+        for view in ("_offsets", "_hashes", "_columns"):
+            if hasattr(self, view):
+                getattr(self, view).release()
+        self._mmap.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self._n_features
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def _name_bytes(self, column: int) -> bytes:
+        start = self._blob_offset + self._offsets[column]
+        return self._mmap[start:self._blob_offset + self._offsets[column + 1]]
+
+    def name(self, column: int) -> str:
+        """
+        Returns the feature name of a column
+        """
+        if not -self._n_features <= column < self._n_features:
+            raise IndexError(column)
+        return self._name_bytes(column % self._n_features).decode("utf-8", errors="surrogatepass")
+
+    def get(self, name: str, default=None):
+        encoded = name.encode("utf-8", errors="surrogatepass")
+        value = int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
+        position = bisect.bisect_left(self._hashes, value)
+        while position < self._n_features and self._hashes[position] == value: # Hash collisions are checked against the name
+            column = self._columns[position]
+            if self._name_bytes(column) == encoded:
+                return column
+            position += 1
+        return default
+
+    def __getitem__(self, name: str) -> int:
+        column = self.get(name)
+        if column is None:
+            raise KeyError(name)
+        return column
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.get(name) is not None
+
+    def columns(self, names: list[str]) -> np.ndarray:
+        """
+        Columns of many names at once, -1 for names that are not in the index
+        """
+        return np.fromiter((self.get(name, -1) for name in names), dtype=np.int64, count=len(names))
+
+    def to_dict(self) -> dict[str, int]:
+        """
+        The index as a plain dict, built once and cached
+        """
+        if self._dict is None:
+            self._dict = {name: column for column, name in enumerate(self.names)}
+        return self._dict
+
+def compile_feature_index(index_path: str = FEATURE_INDEX_FILENAME, feature_list_path: str = FEATURE_LIST_FILENAME,
+                          unique_dir: str = UNIQUE_FEATURES_DIRECTORY) -> str:
+    """
+    Compiles index_path from feature_list.npy if it exists, otherwise from the unique_*.txt files in unique_dir
+
+    Returns:
+        str: sha256 of the compiled index
+    """
+    if os.path.exists(feature_list_path):
+        print(f"[INFO] Compiling {index_path} from {feature_list_path}...")
+        feature_list = np.load(feature_list_path, allow_pickle=True).tolist()
+    else:
+        print(f"[INFO] Compiling {index_path} from {unique_dir}...")
+        feature_list = read_unique_feature_files(unique_dir)
+    if not feature_list:
+        raise FileNotFoundError(f"[ERROR] No features found for {index_path}: {feature_list_path} and {unique_dir} are missing or empty")
+    return write_feature_index(index_path, feature_list)
+
+def load_feature_index(index_path: str = FEATURE_INDEX_FILENAME, feature_list_path: str = FEATURE_LIST_FILENAME,
+                       unique_dir: str = UNIQUE_FEATURES_DIRECTORY) -> FeatureIndex:
+    """
+    Opens the compiled index, compiling it first (see compile_feature_index) if it does not exist yet
+    """
+    if not os.path.exists(index_path):
+        compile_feature_index(index_path, feature_list_path, unique_dir)
+    return FeatureIndex(index_path)
+
+def stamp_path(model_path: str) -> str:
+    return model_path + STAMP_SUFFIX
+
+def stamp_model(model_path: str, index: FeatureIndex):
+    """
+    Records the feature index a model was trained with next to the model (<model_path>.features.json)
+    """
+    with open(stamp_path(model_path), "w", encoding="utf-8") as f:
+        json.dump({"feature_index_sha256": index.sha256, "n_features": len(index)}, f)
+
+def check_model(model_path: str, index: FeatureIndex, input_features: int | None = None):
+    """
+    Fails fast if a model was not trained with this feature index
+
+    Args:
+        model_path (str): model file, its stamp is <model_path>.features.json
+        index (FeatureIndex): index about to be used for serving
+        input_features (int): number of features the model takes, checked against the index when given
+    Raises:
+        FeatureIndexMismatch: the stamp or the model input size does not match the index
+    """
+    if input_features is not None and input_features != len(index):
+        raise FeatureIndexMismatch(f"[ERROR] {model_path} takes {input_features} features but {index.index_path} has {len(index)}")
+
+    if not os.path.exists(stamp_path(model_path)):
+        print(f"[WARN] {model_path} has no {STAMP_SUFFIX} stamp, cannot check it was trained with {index.index_path} ({index.sha256[:12]})")
+        return
+    with open(stamp_path(model_path), "r", encoding="utf-8") as f:
+        stamp = json.load(f)
+    if stamp.get("feature_index_sha256") != index.sha256:
+        raise FeatureIndexMismatch(f"[ERROR] {model_path} was trained with feature index {str(stamp.get('feature_index_sha256'))[:12]}, "
+                                   f"{index.index_path} is {index.sha256[:12]}. Rebuild the index or the model so the columns match")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python feature_index.py <unique_features dir | feature_list.npy> [feature_index.bin]")
+        sys.exit(1)
+
+    source = sys.argv[1]
+    index_path = sys.argv[2] if len(sys.argv) > 2 else FEATURE_INDEX_FILENAME
+    if os.path.isdir(source):
+        feature_list = read_unique_feature_files(source)
+    else:
+        feature_list = np.load(source, allow_pickle=True).tolist()
+    digest = write_feature_index(index_path, feature_list)
+    print(f"[INFO] Wrote {len(feature_list)} features to {index_path} (sha256 {digest[:12]})")
@@ -0,0 +1,196 @@
+"""
+Batched feature file -> vector conversion
+
+predict.vectorize_apk and app.predict_from_content parsed every line into a dict, then stored one count at a time
+into a zeros vector. FeatureVectorizer vectorizes many feature files (or strings) per call:
+
+    1. every raw line is resolved through one lookup table, line -> packed (column, count), with a single C level
+       map(dict.get) over the batch. The table is built from feature_list as lines are seen, so a line is parsed in Python
+       only the first time it appears (feature files share most of their lines)
+    2. the whole batch is scattered into a dense matrix or built as one CSR matrix, no per-line numpy stores
+
+Same results as predict.vectorize_apk: lines are "name count", name is looked up in feature_to_index as is
+(e.g. "API: android.app.Activity.onCreate"), the last count of a repeated name wins, lines without an integer count are skipped
+
+Usage:
+    vectorizer = FeatureVectorizer(feature_list)
+    X = vectorizer.transform_files(paths)           # [n_files, len(feature_list)] float32
+    X = vectorizer.transform_texts(texts, sparse_output=True)
+"""
+
+import threading
+import numpy as np
+from typing import Callable
+from collections.abc import Mapping
+from scipy import sparse
+
+DEFAULT_TABLE_SIZE = 2_000_000 # Lines remembered before the lookup table is reset
+MAX_COUNT = 2 ** 30 - 1 # Counts are packed next to the column in one int64
+COLUMN_BITS = 32
+PARSED_BIT = 1 << COLUMN_BITS # Set when the line parsed, even if the feature is not in the index
+
+def parse_count_line(line: str) -> tuple[str, int] | None:
+    """
+    Parses a line the way predict.parse_feature_file does: "name count" split on the last space
+
+    Returns:
+        tuple[str, int] | None: (name, count), None if the line has no integer count
+    """
+    line = line.strip()
+    if not line:
+        return None
+    parts = line.rsplit(' ', 1)
+    if len(parts) != 2:
+        return None
+    try:
+        return parts[0], int(parts[1])
+    except ValueError:
+        return None
+
+class FeatureVectorizer:
+    """
+    Vectorizes batches of feature files against a fixed feature index
+
+    Args:
+        feature_list (list[str] | np.ndarray | Mapping[str, int]): features in column order, or a feature -> column mapping
+        feature_to_index (Mapping[str, int]): prebuilt index for feature_list, a dict or feature_index.FeatureIndex (predict.load_feature_list returns both)
+        dtype: dtype of the output vectors
+        parse_line (Callable): line -> (name, count) or None, defaults to parse_count_line
+        table_size (int): lines kept in the lookup table before it is reset (bounds memory on unusual inputs)
+    """
+
+    def __init__(self, feature_list, feature_to_index: Mapping[str, int] | None = None, dtype=np.float32,
+                 parse_line: Callable[[str], tuple[str, int] | None] = parse_count_line, table_size: int = DEFAULT_TABLE_SIZE):
+        if feature_to_index is None:
+            if isinstance(feature_list, Mapping): # dict or feature_index.FeatureIndex
+                feature_to_index = feature_list
+            else:
+                # NOTE: same as predict.load_feature_list, a repeated feature maps to its last position
+                feature_to_index = {feature: idx for idx, feature in enumerate(feature_list)}
+        self.feature_to_index = feature_to_index
+        self.dimension = len(feature_list)
+        self.dtype = np.dtype(dtype)
+        self.parse_line = parse_line
+        self.table_size = table_size
+        self._table: dict[str, int] = {}
+        self._unknown: dict[str, int] = {} # Names not in the index get IDs past dimension, so repeated ones are counted once
+        self._lock = threading.Lock() # get_vectorizer shares one vectorizer, request threads must not learn or reset the table at once
+
+    def _learn(self, line: str) -> int:
+        """
+        Parses a line seen for the first time and adds it to the lookup table
+        Packed value: count << 33 | parsed << 32 | column, 0 for lines that don't parse
+        column is past dimension for names that are not in the index
+        """
+        parsed = self.parse_line(line)
+        if parsed is None:
+            value = 0
+        else:
+            name, count = parsed
+            column = self.feature_to_index.get(name)
+            if column is None:
+                column = self._unknown.setdefault(name, self.dimension + len(self._unknown))
+            value = (min(max(count, -MAX_COUNT), MAX_COUNT) << (COLUMN_BITS + 1)) | PARSED_BIT | column
+        self._table[line] = value
+        return value
+
+    def _lookup(self, texts) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Resolves every line of every text, one batch at a time
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: packed values of all lines (int64), number of lines per text
+        """
+        values = []
+        lengths = np.empty(len(texts), dtype=np.int64)
+        with self._lock:
+            if len(self._table) >= self.table_size: # Reset between batches only, unknown IDs must stay unique within a batch
+                self._table.clear()
+                self._unknown.clear()
+            get = self._table.get
+            for i, text in enumerate(texts):
+                lines = text.split('\n')
+                resolved = list(map(get, lines))
+                if None in resolved: # Only new lines are parsed in Python
+                    resolved = [self._learn(line) if value is None else value for line, value in zip(lines, resolved)]
+                values.extend(resolved)
+                lengths[i] = len(resolved)
+        return np.array(values, dtype=np.int64), lengths
+
+    def entries(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (rows, columns, counts) of the set entries, one per (row, column) with the last count winning,
+        plus the number of distinct parsed features per text (len() of predict.parse_feature_file's dict)
+        Lets callers look at the parsed features (e.g. app's verdict cache) before building the matrix with to_matrix()
+        """
+        values, lengths = self._lookup(texts)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        parsed = (values & PARSED_BIT) != 0
+        rows, values = rows[parsed], values[parsed]
+        columns = values & (PARSED_BIT - 1)
+        counts = values >> (COLUMN_BITS + 1)
+
+        # Last occurrence of each (row, name) wins, like assigning into a dict line by line
+        keys = rows * (int(columns.max()) + 1 if len(columns) else 1) + columns
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last)
+        rows, columns, counts = rows[keep], columns[keep], counts[keep]
+        feature_counts = np.bincount(rows, minlength=len(texts))
+
+        hit = columns < self.dimension
+        return rows[hit], columns[hit], counts[hit], feature_counts
+
+    def transform_texts(self, texts: list[str], sparse_output: bool = False, return_feature_counts: bool = False):
+        """
+        Vectorizes feature file contents
+
+        Args:
+            texts (list[str]): contents of feature files
+            sparse_output (bool): return a CSR matrix instead of a dense one
+            return_feature_counts (bool): also return how many lines of each text parsed (app's feature_count)
+        Returns:
+            np.ndarray | sparse.csr_matrix: [len(texts), dimension] matrix of counts,
+            plus an int array of parsed line counts with return_feature_counts
+        """
+        rows, columns, counts, feature_counts = self.entries(texts)
+        matrix = self.to_matrix(rows, columns, counts, len(texts), sparse_output)
+        return (matrix, feature_counts) if return_feature_counts else matrix
+
+    def to_matrix(self, rows: np.ndarray, columns: np.ndarray, counts: np.ndarray, n_rows: int, sparse_output: bool = False):
+        """
+        Builds the [n_rows, dimension] matrix of entries() (or a subset of them with rows renumbered)
+        """
+        shape = (n_rows, self.dimension)
+        if sparse_output:
+            return sparse.csr_matrix((counts.astype(self.dtype), (rows, columns)), shape=shape)
+        matrix = np.zeros(shape, dtype=self.dtype)
+        matrix[rows, columns] = counts
+        return matrix
+
+    def transform_files(self, paths: list[str], sparse_output: bool = False, encoding: str = 'utf-8', errors: str = 'strict'):
+        """
+        Vectorizes feature files, see transform_texts
+        """
+        texts = []
+        for path in paths:
+            with open(path, 'r', encoding=encoding, errors=errors) as f:
+                texts.append(f.read())
+        return self.transform_texts(texts, sparse_output)
+
+    def transform_file(self, path: str, encoding: str = 'utf-8', errors: str = 'strict') -> np.ndarray:
+        """
+        Vectorizes a single feature file, returns a 1-D vector
+        """
+        return self.transform_files([path], encoding=encoding, errors=errors)[0]
+
+_cached_vectorizer: tuple[object, object, FeatureVectorizer] | None = None
+
+def get_vectorizer(feature_list, feature_to_index: dict[str, int] | None = None) -> FeatureVectorizer:
+    """
+    Returns a FeatureVectorizer for feature_list, reusing the last one (and its lookup table) while the same objects are passed
+    Lets predict.vectorize_apk keep its (file, feature_list, feature_to_index) signature
+    """
+    global _cached_vectorizer
+    if _cached_vectorizer is None or _cached_vectorizer[0] is not feature_list or _cached_vectorizer[1] is not feature_to_index:
+        _cached_vectorizer = (feature_list, feature_to_index, FeatureVectorizer(feature_list, feature_to_index))
+    return _cached_vectorizer[2]
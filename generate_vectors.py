@@ -1,40 +1,17 @@
 import os
 import numpy as np
+from array import array
+from scipy import sparse
 from collections import defaultdict
+from feature_index import read_unique_feature_files, write_feature_index, FEATURE_INDEX_FILENAME
+
+SPARSE = False # Saves X_vectors.npz (scipy.sparse CSR) instead of the dense X_vectors.npy
 
 def load_unique_features():
     """Load all unique features from the unique_features directory"""
-    feature_list = []
-    feature_to_index = {}
-    
-    # List of unique feature files
-    feature_files = [
-        'unique_permissions.txt',
-        'unique_intents.txt',
-        'unique_api_calls.txt',
-        'unique_libraries.txt',
-        'unique_urls.txt',
-        'unique_used_hsware.txt'
-    ]
-    
-    unique_features_dir = 'unique_features'
-    
-    for filename in feature_files:
-        filepath = os.path.join(unique_features_dir, filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        # Extract feature name (remove count at the end)
-                        # Format: "Feature: name count"
-                        parts = line.rsplit(' ', 1)
-                        if len(parts) == 2:
-                            feature_name = parts[0]  # Already includes prefix like "Intent: ", "API: ", etc.
-                            
-                            if feature_name not in feature_to_index:
-                                feature_to_index[feature_name] = len(feature_list)
-                                feature_list.append(feature_name)
+    # Same file order and parsing as every other reader, see feature_index.read_unique_feature_files
+    feature_list = read_unique_feature_files('unique_features')
+    feature_to_index = {feature: idx for idx, feature in enumerate(feature_list)}
     
     return feature_list, feature_to_index
 
@@ -102,13 +79,41 @@ def create_feature_vectors(benign_dir, malicious_dir, feature_list, feature_to_i
 
     return X_vectors, y_labels
 
+def create_sparse_feature_vectors(benign_dir, malicious_dir, feature_list, feature_to_index):
+    """Same rows and labels as create_feature_vectors, built as a CSR matrix without dense rows"""
+    indices = array('i')
+    data = array('f')
+    indptr = array('q', [0])
+    y_labels = []
+
+    for label, feature_dir in [(0, benign_dir), (1, malicious_dir)]:
+        files = sorted([f for f in os.listdir(feature_dir) if f.endswith('.txt')])
+        print(f"Processing {len(files)} {'malicious' if label else 'benign'} files...")
+
+        for filename in files:
+            features = parse_feature_file(os.path.join(feature_dir, filename))
+            row = sorted((feature_to_index[name], count) for name, count in features.items() if name in feature_to_index)
+            indices.extend(column for column, _ in row)
+            data.extend(count for _, count in row)
+            indptr.append(len(indices))
+            y_labels.append(label)
+
+    X_vectors = sparse.csr_matrix((np.frombuffer(data, dtype=np.float32),
+                                   np.frombuffer(indices, dtype=np.intc),
+                                   np.frombuffer(indptr, dtype=np.int64)),
+                                  shape=(len(y_labels), len(feature_list)))
+    y_labels = np.array(y_labels, dtype=np.int8)
+
+    return X_vectors, y_labels
+
 def main():
     print("Loading unique features...")
     feature_list, feature_to_index = load_unique_features()
     print(f"Found {len(feature_list)} unique features")
     
     print("\nCreating feature vectors...")
-    X_vectors, y_labels = create_feature_vectors(
+    create = create_sparse_feature_vectors if SPARSE else create_feature_vectors
+    X_vectors, y_labels = create(
         'benign_features',
         'malicious_features',
         feature_list,
@@ -121,14 +126,20 @@ def main():
     
     # Save numpy arrays
     print("\nSaving numpy arrays...")
-    np.save('X_vectors.npy', X_vectors)
+    X_filename = 'X_vectors.npz' if SPARSE else 'X_vectors.npy'
+    if SPARSE:
+        sparse.save_npz(X_filename, X_vectors, compressed=False)
+    else:
+        np.save(X_filename, X_vectors)
     np.save('y_labels.npy', y_labels)
     np.save('feature_list.npy', np.array(feature_list, dtype=object))
+    index_sha256 = write_feature_index(FEATURE_INDEX_FILENAME, feature_list) # What predict/evaluate/app load, models trained on these vectors match it
     
     print("\nDone! Files saved:")
-    print("  - X_vectors.npy")
+    print(f"  - {X_filename}")
     print("  - y_labels.npy")
     print("  - feature_list.npy")
+    print(f"  - {FEATURE_INDEX_FILENAME} (sha256 {index_sha256[:12]})")
     
     # Print some statistics
     print(f"\nStatistics:")
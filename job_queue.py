@@ -0,0 +1,284 @@
+"""
+Asynchronous APK upload -> verdict jobs for app.py
+
+app.py only scored feature files that were extracted out of band. A JobQueue takes raw APKs instead:
+    1. submit() saves the upload and records a queued job in a local SQLite store, then returns its ID right away
+    2. one dispatcher thread hands queued APKs to a ParallelExtractor.ExtractionPool (worker processes running
+       FeatureExtractor.extract_features, with a per APK timeout and crash isolation)
+    3. extracted features are categorized in memory like ReduceCardinality does for the training set,
+       turned into feature file text and scored by the predict callable
+    4. the verdict (or the error) is stored, get() / wait() return the job, wait() long polls until it finishes
+
+Backpressure: at most max_queued jobs wait for a worker, submit() raises QueueFull past that.
+Jobs survive a restart: queued and running jobs whose APK is still on disk are queued again.
+
+Usage:
+    jobs = JobQueue(predict, upload_dir="uploads", workers=2)
+    job_id = jobs.submit(file.save, file.filename)
+    job = jobs.wait(job_id, timeout=30)
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+from typing import Any, Callable
+
+import ParallelExtractor
+import ReduceCardinality
+
+DEFAULT_STORE_NAME = "jobs.sqlite"
+DEFAULT_WORKERS = 2 # Extraction processes, androguard needs a lot of memory per APK
+DEFAULT_TIMEOUT = 300 # Seconds an APK is allowed to take before its worker is killed
+DEFAULT_MAX_QUEUED = 100 # Jobs waiting for a worker before submit() is refused
+DEFAULT_RETENTION = 24 * 3600 # Seconds finished jobs are kept
+POLL_INTERVAL = 0.2 # Seconds between dispatcher checks
+PURGE_INTERVAL = 60.0 # Seconds between deletes of expired jobs
+
+# Job statuses
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+class QueueFull(Exception):
+    """
+    Raised by submit() when max_queued jobs are already waiting
+    """
+
+class JobStore:
+    """
+    SQLite table of jobs, safe to use from several threads
+
+    Args:
+        store_path (str): SQLite file, created if missing
+    """
+
+    def __init__(self, store_path: str):
+        store_dir = os.path.dirname(store_path)
+        if store_dir and not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(store_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                         "job_id TEXT PRIMARY KEY, status TEXT, filename TEXT, apk_path TEXT, "
+                         "created REAL, started REAL, finished REAL, result TEXT, error TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self._db.commit()
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            rows = self._db.execute(sql, parameters).fetchall()
+            self._db.commit()
+            return rows
+
+    def create(self, job_id: str, filename: str, apk_path: str):
+        self._execute("INSERT INTO jobs (job_id, status, filename, apk_path, created) VALUES (?, ?, ?, ?, ?)",
+                      (job_id, STATUS_QUEUED, filename, apk_path, time.time()))
+
+    def set_status(self, job_id: str, status: str):
+        started = time.time() if status == STATUS_RUNNING else None
+        self._execute("UPDATE jobs SET status = ?, started = ? WHERE job_id = ?", (status, started, job_id))
+
+    def finish(self, job_id: str, status: str, result: dict[str, Any] | None = None, error: str | None = None):
+        self._execute("UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE job_id = ?",
+                      (status, time.time(), json.dumps(result) if result is not None else None, error, job_id))
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        rows = self._execute("SELECT job_id, status, filename, created, started, finished, result, error FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def unfinished(self) -> list[tuple[str, str]]:
+        """
+        (job_id, apk_path) of every job that was queued or running, oldest first
+        """
+        rows = self._execute("SELECT job_id, apk_path FROM jobs WHERE status IN (?, ?) ORDER BY created", (STATUS_QUEUED, STATUS_RUNNING))
+        return [(row["job_id"], row["apk_path"]) for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """
+        Deletes finished jobs that finished before older_than (time.time()), returns how many
+        """
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?", (*FINISHED_STATUSES, older_than))
+            self._db.commit()
+            return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class JobQueue:
+    """
+    APK extraction + prediction jobs run by a pool of extraction processes
+
+    Args:
+        predict (Callable): feature file text -> verdict dict, called on the dispatcher thread
+        upload_dir (str): where uploaded APKs are kept until their job finishes
+        store_path (str): SQLite job store
+        workers (int): extraction processes, the most APKs extracted at the same time
+        timeout (float): seconds before an APK's worker is killed and the job fails
+        max_queued (int): jobs allowed to wait for a worker
+        retention (float): seconds finished jobs can still be fetched
+    """
+
+    def __init__(self, predict: Callable[[str], dict[str, Any]], upload_dir: str, store_path: str = DEFAULT_STORE_NAME,
+                 workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT, max_queued: int = DEFAULT_MAX_QUEUED,
+                 retention: float = DEFAULT_RETENTION):
+        self.predict = predict
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.retention = retention
+        os.makedirs(upload_dir, exist_ok=True)
+
+        self.store = JobStore(store_path)
+        self._pending: queue.Queue = queue.Queue() # (job_id, apk_path) waiting for a worker
+        self._queued = 0 # Jobs submitted or pending, guarded by _changed
+        self._changed = threading.Condition() # Notified whenever a job changes status
+        self._stopping = threading.Event()
+        self._recover()
+
+        self._thread = threading.Thread(target=self._run, name="JobQueue", daemon=True)
+        self._thread.start()
+
+    def _recover(self):
+        """
+        Queues the jobs a previous run did not finish again, fails those whose APK is gone
+        """
+        for job_id, apk_path in self.store.unfinished():
+            if apk_path and os.path.exists(apk_path):
+                self.store.set_status(job_id, STATUS_QUEUED)
+                self._queued += 1
+                self._pending.put((job_id, apk_path))
+            else:
+                self.store.finish(job_id, STATUS_FAILED, error="Server restarted and the uploaded APK is gone")
+
+    def submit(self, save: Callable[[str], None], filename: str) -> str:
+        """
+        Creates a job for an uploaded APK
+
+        Args:
+            save (Callable): writes the APK to the path it is given (e.g. werkzeug FileStorage.save)
+            filename (str): name the APK was uploaded as, only stored for the caller
+        Returns:
+            str: job ID
+        Raises:
+            QueueFull: max_queued jobs are already waiting, try again later
+        """
+        with self._changed:
+            if self._queued >= self.max_queued:
+                raise QueueFull(f"{self._queued} jobs are already queued")
+            self._queued += 1 # Reserved before the upload is written so concurrent submits can't overshoot
+
+        job_id = uuid.uuid4().hex
+        apk_path = os.path.join(self.upload_dir, f"{job_id}.apk")
+        try:
+            save(apk_path)
+            self.store.create(job_id, filename, apk_path)
+        except Exception:
+            with self._changed:
+                self._queued -= 1
+            if os.path.exists(apk_path):
+                os.remove(apk_path)
+            raise
+        self._pending.put((job_id, apk_path))
+        return job_id
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        """
+        Returns the job (status, timestamps, result or error), None for unknown or expired IDs
+        """
+        return self.store.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> dict[str, Any] | None:
+        """
+        Long poll: returns the job as soon as it finishes, or as it is after timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self.store.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    def stats(self) -> dict[str, Any]:
+        with self._changed:
+            queued = self._queued
+        return {'workers': self.workers, 'queued': queued, 'max_queued': self.max_queued, 'jobs': self.store.counts()}
+
+    def close(self):
+        """
+        Stops the dispatcher and the extraction workers, unfinished jobs are picked up again on the next start
+        """
+        self._stopping.set()
+        self._thread.join()
+        self.store.close()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _run(self):
+        running: dict[str, str] = {} # apk_path -> job_id
+        last_purge = 0.0
+        # NOTE: the pool is created and used on this thread only, ExtractionPool is not thread safe
+        with ParallelExtractor.ExtractionPool(self.workers, self.timeout) as pool:
+            while not self._stopping.is_set():
+                while pool.idle_count:
+                    try:
+                        # Block for new work only while nothing is running, otherwise keep polling the pool
+                        job_id, apk_path = self._pending.get(timeout=POLL_INTERVAL) if not running else self._pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    with self._changed:
+                        self._queued -= 1
+                    self.store.set_status(job_id, STATUS_RUNNING)
+                    pool.submit(apk_path)
+                    running[apk_path] = job_id
+                    self._notify()
+
+                for result in pool.poll(POLL_INTERVAL):
+                    self._finish(running.pop(result.apk_path), result)
+                    self._notify()
+
+                if time.monotonic() - last_purge > PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    self.store.purge(time.time() - self.retention)
+
+    def _finish(self, job_id: str, result: ParallelExtractor.ExtractionResult):
+        """
+        Scores an extraction result and stores the verdict, the uploaded APK is deleted either way
+        """
+        try:
+            if result.status != ParallelExtractor.STATUS_OK:
+                reason = "no features could be extracted" if result.status == ParallelExtractor.STATUS_EMPTY else f"worker {result.status}"
+                self.store.finish(job_id, STATUS_FAILED, error=f"Extraction failed: {reason} after {result.seconds:.0f}s")
+                return
+            features = ReduceCardinality.categorize_features(result.features)
+            verdict = self.predict(ReduceCardinality.feature_file_content(features))
+            self.store.finish(job_id, STATUS_DONE, result=verdict)
+        except Exception as e:
+            self.store.finish(job_id, STATUS_FAILED, error=f"Prediction failed: {str(e)}")
+        finally:
+            try:
+                os.remove(result.apk_path)
+            except OSError:
+                pass
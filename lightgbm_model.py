@@ -0,0 +1,244 @@
+"""
+Gradient boosted trees (LightGBM) training and serving, from LightGBM.ipynb
+
+LightGBM.ipynb trains an 800 tree LGBMClassifier in Colab and the serving stack only knew the CNN.
+This module trains the same booster from any vectors vector_dataset reads (sparse .npz, dense .npy or packed
+vectors, all handed to LightGBM as CSR), saves the native booster file and serves it through predict.load_model:
+    *.lgbm model paths are loaded as LightGBMModel (sparse_input, so app.py / predict.py / evaluate.py pass CSR matrices)
+    if the booster was compiled with lleaves (pip install lleaves) and the compiled file is newer than the booster,
+    predictions run on the compiled native code instead of the LightGBM library
+
+Usage:
+    python lightgbm_model.py train vectors.npz|vectors.npy|packed_dir labels.npy [--index feature_index.bin] [--out apk_malware_lgbm.lgbm] [--compile]
+    python lightgbm_model.py compile apk_malware_lgbm.lgbm [--vectors vectors.npz]     # --vectors checks the compiled scores
+    MODEL_PATH=apk_malware_lgbm.lgbm python app.py
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+from scipy import sparse
+
+from vector_dataset import load_csr_matrix, stratified_split
+from feature_index import FeatureIndex, stamp_model, FEATURE_INDEX_FILENAME
+from sparse_model import to_csr, binary_metrics
+
+DEFAULT_MODEL_FILENAME = "apk_malware_lgbm.lgbm"
+COMPILED_SUFFIX = ".so" # lleaves cache next to the booster: apk_malware_lgbm.lgbm.so
+# Same hyperparameters as LightGBM.ipynb (n_estimators=800, learning_rate=0.05, num_leaves=64, n_jobs=-1)
+DEFAULT_PARAMS = {"objective": "binary", "learning_rate": 0.05, "num_leaves": 64, "num_threads": 0, "verbosity": -1}
+DEFAULT_ROUNDS = 800
+EARLY_STOPPING_ROUNDS = 50 # Rounds without a better validation loss before training stops
+SMALL_BATCH_ROWS = 64 # Batches up to this size predict on one thread, OpenMP start up costs more than it saves
+COMPILED_CHUNK_ROWS = 64 # lleaves takes dense float64 rows, densified this many at a time
+TOP_FEATURES = 30
+
+def balanced_weights(labels: np.ndarray) -> np.ndarray:
+    """
+    Per row weights like class_weight="balanced": n_rows / (n_classes * rows of the row's class)
+    """
+    classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    return (len(labels) / (len(classes) * counts))[inverse].astype(np.float32)
+
+def train_booster(x: sparse.csr_matrix, labels: np.ndarray, train_indices: np.ndarray, validation_indices: np.ndarray | None = None,
+                  rounds: int = DEFAULT_ROUNDS, params: dict | None = None):
+    """
+    Trains a binary booster on the selected rows, stops early on the validation rows' loss
+
+    Returns:
+        lightgbm.Booster: trained booster, best_iteration is set when early stopping ran
+    """
+    import lightgbm
+
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    labels = np.asarray(labels, dtype=np.float32)
+    train_indices = np.sort(train_indices)
+    train_set = lightgbm.Dataset(x[train_indices], labels[train_indices], weight=balanced_weights(labels[train_indices]), free_raw_data=True)
+    valid_sets, callbacks = [], [lightgbm.log_evaluation(period=50)]
+    if validation_indices is not None and len(validation_indices):
+        validation_indices = np.sort(validation_indices)
+        valid_sets.append(lightgbm.Dataset(x[validation_indices], labels[validation_indices], reference=train_set))
+        callbacks.append(lightgbm.early_stopping(EARLY_STOPPING_ROUNDS, verbose=True))
+    return lightgbm.train(params, train_set, num_boost_round=rounds, valid_sets=valid_sets, callbacks=callbacks)
+
+def compiled_path(model_path: str) -> str:
+    return model_path + COMPILED_SUFFIX
+
+def compile_booster(model_path: str):
+    """
+    Compiles a saved booster to native code with lleaves, cached next to it (compiled_path), needs lleaves
+
+    Returns:
+        lleaves.Model: compiled model, predict(dense float64 rows) gives the same probabilities as the booster
+    """
+    import lleaves
+
+    cache_path = compiled_path(model_path)
+    # lleaves loads an existing cache without checking it, a cache older than the booster is from a previous model
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) < os.path.getmtime(model_path):
+        os.remove(cache_path)
+    compiled = lleaves.Model(model_file=model_path)
+    compiled.compile(cache=cache_path)
+    return compiled
+
+class LightGBMModel:
+    """
+    A saved booster with the parts of the Keras model API the serving code uses: input_shape and predict_on_batch
+
+    Args:
+        model_path (str): booster file saved by train (Booster.save_model)
+        use_compiled (bool | None): predict with the lleaves compiled booster, None uses it when it exists and is up to date
+        num_threads (int | None): prediction threads, None uses one for small batches and all cores for large ones
+    """
+
+    sparse_input = True # Callers pass CSR matrices (FeatureVectorizer sparse_output), trees only look at set features
+
+    def __init__(self, model_path: str, use_compiled: bool | None = None, num_threads: int | None = None):
+        import lightgbm
+
+        self.model_path = model_path
+        self.booster = lightgbm.Booster(model_file=model_path)
+        self.input_shape = (None, self.booster.num_feature())
+        self.num_threads = num_threads
+        self._lock = threading.Lock()
+
+        self.compiled = None
+        cache_path = compiled_path(model_path)
+        compiled_is_current = os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(model_path)
+        if use_compiled or (use_compiled is None and compiled_is_current):
+            try:
+                self.compiled = compile_booster(model_path)
+            except ImportError:
+                if use_compiled:
+                    raise
+                print(f"[WARN] {cache_path} exists but lleaves is not installed, predicting with the LightGBM library")
+
+    def _threads(self, rows: int) -> int:
+        if self.num_threads is not None:
+            return self.num_threads
+        return 1 if rows <= SMALL_BATCH_ROWS else (os.cpu_count() or 1)
+
+    def predict_on_batch(self, x) -> np.ndarray:
+        """
+        Scores a CSR matrix (or a dense batch), returns [batch, 1] malicious probabilities like the keras model
+        """
+        x = to_csr(x)
+        if x.shape[1] != self.input_shape[1]:
+            raise ValueError(f"input has {x.shape[1]} features, the booster was trained with {self.input_shape[1]}")
+        threads = self._threads(x.shape[0])
+        if self.compiled is not None:
+            scores = [self.compiled.predict(x[start:start + COMPILED_CHUNK_ROWS].toarray().astype(np.float64), n_jobs=threads)
+                      for start in range(0, x.shape[0], COMPILED_CHUNK_ROWS)]
+            scores = np.concatenate(scores) if scores else np.zeros(0)
+        else:
+            with self._lock:
+                scores = self.booster.predict(x, num_threads=threads)
+        return np.asarray(scores, dtype=np.float32).reshape(-1, 1)
+
+    def predict(self, x, verbose=0) -> np.ndarray:
+        return self.predict_on_batch(x)
+
+def print_top_features(booster, index_path: str, count: int = TOP_FEATURES):
+    """
+    Most important features by total gain, named from the feature index (the notebook's feature_importances_ cell)
+    """
+    gains = booster.feature_importance(importance_type="gain")
+    names = None
+    if os.path.exists(index_path):
+        with FeatureIndex(index_path) as index:
+            names = list(index.names)
+    for column in np.argsort(gains)[::-1][:count]:
+        if gains[column] > 0:
+            print(f"  {gains[column]:12.1f}  {names[column] if names is not None and column < len(names) else column}")
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train, compile and check the LightGBM malware model")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="train a booster from vectors and labels")
+    train.add_argument("vectors", help="vectors.npz / X_vectors.npz (CSR), a dense .npy or a packed vectors directory")
+    train.add_argument("labels", help="labels.npy / y_labels.npy")
+    train.add_argument("--index", default=FEATURE_INDEX_FILENAME, help="feature index the vectors were built with, the model is stamped with it")
+    train.add_argument("--out", default=DEFAULT_MODEL_FILENAME, help="booster file to write")
+    train.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="most boosting rounds (trees)")
+    train.add_argument("--seed", type=int, default=42)
+    train.add_argument("--compile", action="store_true", help="also compile the booster with lleaves")
+
+    compile_command = commands.add_parser("compile", help="compile a saved booster with lleaves")
+    compile_command.add_argument("model", help="booster file")
+    compile_command.add_argument("--vectors", help="vectors to compare the compiled and library scores on")
+    return parser.parse_args(argv)
+
+def check_compiled(model_path: str, x: sparse.csr_matrix) -> float:
+    """
+    Compiles the booster and returns the largest score difference to the LightGBM library on the rows of x
+    """
+    start = time.perf_counter()
+    library = LightGBMModel(model_path, use_compiled=False)
+    compiled = LightGBMModel(model_path, use_compiled=True)
+    print(f"[INFO] Compiled {model_path} to {compiled_path(model_path)} in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    library_scores = library.predict_on_batch(x)
+    library_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled_scores = compiled.predict_on_batch(x)
+    compiled_seconds = time.perf_counter() - start
+    print(f"[INFO] {x.shape[0]} rows: lightgbm {library_seconds * 1000:.1f}ms, compiled {compiled_seconds * 1000:.1f}ms")
+    return float(np.max(np.abs(library_scores - compiled_scores))) if x.shape[0] else 0.0
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "compile":
+        if not os.path.exists(args.model):
+            print(f"Error: Model file not found: {args.model}")
+            sys.exit(1)
+        if args.vectors:
+            print(f"[INFO] Max score difference: {check_compiled(args.model, load_csr_matrix(args.vectors)):.2e}")
+        else:
+            compile_booster(args.model)
+            print(f"[INFO] Compiled {args.model} to {compiled_path(args.model)}")
+        sys.exit(0)
+
+    x = load_csr_matrix(args.vectors)
+    labels = np.load(args.labels).astype(np.float32)
+    if len(labels) != x.shape[0]:
+        print(f"[ERROR] {args.labels} has {len(labels)} labels for {x.shape[0]} vectors")
+        sys.exit(1)
+    print(f"[INFO] {x.shape[0]} vectors, {x.shape[1]} features, {x.nnz / max(x.shape[0], 1):.0f} set per vector on average")
+
+    # Same 80/20 split as the notebooks, with 10% of the training side held out for early stopping
+    train_indices, test_indices = stratified_split(labels, test_size=0.2, random_state=args.seed)
+    train_indices, validation_indices = stratified_split(labels, test_size=0.1, random_state=args.seed, indices=train_indices)
+
+    start = time.perf_counter()
+    booster = train_booster(x, labels, train_indices, validation_indices, args.rounds, {"seed": args.seed})
+    print(f"[INFO] Trained {booster.num_trees()} trees in {time.perf_counter() - start:.1f}s")
+
+    # Save only the trees up to the best validation round
+    tmp_path = args.out + ".tmp"
+    booster.save_model(tmp_path, num_iteration=booster.best_iteration or None)
+    os.replace(tmp_path, args.out)
+    if os.path.exists(args.index):
+        with FeatureIndex(args.index) as index:
+            if len(index) != x.shape[1]:
+                print(f"[WARN] {args.index} has {len(index)} features, the vectors have {x.shape[1]}, {args.out} is not stamped")
+            else:
+                stamp_model(args.out, index)
+    else:
+        print(f"[WARN] {args.index} not found, {args.out} is not stamped with its feature index")
+    print(f"[INFO] Saved {args.out}")
+
+    model = LightGBMModel(args.out, use_compiled=False)
+    test_indices = np.sort(test_indices)
+    scores = model.predict_on_batch(x[test_indices]).reshape(-1)
+    print("[INFO] Test set: " + ", ".join(f"{key} {value:.4f}" for key, value in binary_metrics(labels[test_indices], scores).items()))
+    print(f"[INFO] Top {TOP_FEATURES} features by gain:")
+    print_top_features(model.booster, args.index)
+
+    if args.compile:
+        print(f"[INFO] Max compiled score difference on the test set: {check_compiled(args.out, x[test_indices]):.2e}")
@@ -0,0 +1,123 @@
+"""
+Request coalescing for model inference
+
+Every /predict call used to run its own model forward pass. MicroBatcher collects the calls that arrive within
+max_wait seconds of each other (up to max_batch_size), runs them through one batched function call on a single
+worker thread, and hands each caller its own result. Request threads block only on their own result.
+
+The worker thread is the only one that touches the model (and the FeatureVectorizer lookup table), so the batch
+function does not need to be thread safe even under a multi threaded server.
+
+Usage:
+    batcher = MicroBatcher(predict_batch, max_batch_size=32, max_wait=0.005)
+    label, score, feature_count = batcher.submit(content)   # from any request thread
+"""
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT = 0.005 # Seconds the first request of a batch waits for others to join
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submit() calls into batches for one worker thread
+
+    Args:
+        predict_batch (Callable): list of items -> list of results in the same order
+        max_batch_size (int): most items per predict_batch call
+        max_wait (float): seconds to wait for more items after the first one, 0 runs whatever is already queued
+    """
+
+    def __init__(self, predict_batch: Callable[[list[Any]], list[Any]], max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait: float = DEFAULT_MAX_WAIT):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}")
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0 # Statistics for /health
+        self.items = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock() # Nothing is queued after the stop marker
+        self._thread = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+        self._thread.start()
+
+    def submit_async(self, item: Any) -> Future:
+        """
+        Queues an item, the returned Future resolves to its result or raises the batch's exception
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((item, future))
+        return future
+
+    def submit(self, item: Any, timeout: float | None = None) -> Any:
+        """
+        Queues an item and blocks until its batch has run
+        """
+        return self.submit_async(item).result(timeout)
+
+    def close(self):
+        """
+        Runs what is already queued, then stops the worker thread
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None: # Finish this batch, then stop
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list[tuple[Any, Future]]):
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self.predict_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"predict_batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
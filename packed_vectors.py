@@ -0,0 +1,193 @@
+"""
+Bit-packed storage for binary feature vectors (8 features per byte)
+
+vectorizeFeatures builds strictly 0/1 vectors but vectors.npy keeps one byte per feature (np.bool), and
+generate_vectors keeps four (float32). Packed with np.packbits the same matrix is 8x / 32x smaller on disk and in RAM.
+Rows are unpacked in batches only when a model needs them.
+
+Files (next to labels.npy / names.npy from vectorizeFeatures):
+    vectors_packed.npy    uint8 [n_samples, ceil(n_features / 8)], row major so a batch of rows is one contiguous read
+    vectors_packed.json   {"n_features": ..., "bitorder": "big"}
+
+Usage:
+    python packed_vectors.py ..\\vectors          # packs ..\\vectors\\vectors.npy (or vectors.npz) in place
+"""
+
+import os
+import sys
+import json
+import numpy as np
+from scipy import sparse
+
+import vectorizeFeatures
+
+PACKED_VECTORS_FILENAME = "vectors_packed.npy"
+PACKED_META_FILENAME = "vectors_packed.json"
+BITORDER = "big" # np.packbits default, feature 0 is the high bit of byte 0
+DEFAULT_BATCH_SIZE = 1024
+
+# Bits set in every byte value, fallback for numpy < 2.0 which has no np.bitwise_count
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def pack_vectors(vectors: np.ndarray | sparse.spmatrix) -> np.ndarray:
+    """
+    Packs a binary matrix, every non zero entry becomes a set bit
+
+    Args:
+        vectors (np.ndarray | sparse.spmatrix): dense [n_samples, n_features] or CSR from build_sparse_vector_dataset
+    Returns:
+        np.ndarray: uint8 [n_samples, ceil(n_features / 8)]
+    """
+    if sparse.issparse(vectors): # Set bits straight from the CSR indices, the matrix is never made dense
+        vectors = vectors.tocsr()
+        n_samples, n_features = vectors.shape
+        packed = np.zeros((n_samples, (n_features + 7) // 8), dtype=np.uint8)
+        rows = np.repeat(np.arange(n_samples), np.diff(vectors.indptr))
+        columns = np.asarray(vectors.indices, dtype=np.int64)
+        set_entries = np.asarray(vectors.data) != 0
+        rows, columns = rows[set_entries], columns[set_entries]
+        np.bitwise_or.at(packed, (rows, columns >> 3), (0x80 >> (columns & 7)).astype(np.uint8))
+        return packed
+    return np.packbits(np.asarray(vectors) != 0, axis=1, bitorder=BITORDER)
+
+def unpack_vectors(packed: np.ndarray, n_features: int, dtype=np.float32) -> np.ndarray:
+    """
+    Unpacks packed rows back to a dense [n_rows, n_features] matrix
+    """
+    return np.unpackbits(packed, axis=1, count=n_features, bitorder=BITORDER).astype(dtype, copy=False)
+
+def popcount(packed: np.ndarray) -> np.ndarray:
+    """
+    Number of set features in every packed row
+
+    Returns:
+        np.ndarray: int64 [n_rows]
+    """
+    packed = np.atleast_2d(packed)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(packed).sum(axis=1, dtype=np.int64)
+    return POPCOUNT_TABLE[packed].sum(axis=1, dtype=np.int64)
+
+def jaccard(query: np.ndarray, packed: np.ndarray, batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """
+    Jaccard similarity |a & b| / |a | b| between packed rows, computed on the packed bytes
+
+    Args:
+        query (np.ndarray): one packed row [n_bytes] or several [n_queries, n_bytes]
+        packed (np.ndarray): packed rows to compare against [n_rows, n_bytes], may be memory mapped
+        batch_size (int): rows of `packed` compared at a time, bounds the temporary arrays
+    Returns:
+        np.ndarray: float64 [n_rows] for one query row, [n_queries, n_rows] otherwise. 0.0 where both rows are empty
+    """
+    single = query.ndim == 1
+    query = np.atleast_2d(query)
+    similarity = np.empty((query.shape[0], packed.shape[0]), dtype=np.float64)
+
+    for start in range(0, packed.shape[0], batch_size):
+        rows = np.asarray(packed[start:start + batch_size])
+        for q, query_row in enumerate(query):
+            intersection = popcount(rows & query_row)
+            union = popcount(rows | query_row)
+            similarity[q, start:start + len(rows)] = np.divide(intersection, union, out=np.zeros(len(rows)), where=union > 0)
+    return similarity[0] if single else similarity
+
+def save_packed_vectors(out_dir: str, packed: np.ndarray, n_features: int):
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    np.save(os.path.join(out_dir, PACKED_VECTORS_FILENAME), packed)
+    with open(os.path.join(out_dir, PACKED_META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({"n_features": int(n_features), "bitorder": BITORDER}, f)
+
+class PackedVectors:
+    """
+    Row oriented reader for a packed dataset, the packed matrix is memory mapped and unpacked one batch at a time
+
+        dataset = PackedVectors(r"..\\vectors")
+        for X, y in dataset.iter_batches(256):
+            model.train_on_batch(X, y)
+
+    Args:
+        in_dir (str): directory with vectors_packed.npy / .json, plus labels.npy and names.npy if present
+        mmap (bool): memory map the packed matrix instead of reading it into RAM
+    """
+
+    def __init__(self, in_dir: str, mmap: bool = True):
+        with open(os.path.join(in_dir, PACKED_META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("bitorder", BITORDER) != BITORDER:
+            raise ValueError(f"[ERROR] {in_dir} was packed with bitorder {meta['bitorder']}")
+        self.n_features: int = meta["n_features"]
+        self.packed = np.load(os.path.join(in_dir, PACKED_VECTORS_FILENAME), mmap_mode="r" if mmap else None)
+
+        labels_path = os.path.join(in_dir, vectorizeFeatures.LABELS_FILENAME)
+        names_path = os.path.join(in_dir, vectorizeFeatures.NAMES_FILENAME)
+        self.labels = np.load(labels_path) if os.path.exists(labels_path) else None
+        self.names = np.load(names_path).tolist() if os.path.exists(names_path) else None
+
+    def __len__(self) -> int:
+        return self.packed.shape[0]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (len(self), self.n_features)
+
+    def rows(self, index, dtype=np.float32) -> np.ndarray:
+        """
+        Unpacks the rows selected by a slice or an array of row numbers
+        """
+        return unpack_vectors(np.asarray(self.packed[index]), self.n_features, dtype)
+
+    def iter_batches(self, batch_size: int = DEFAULT_BATCH_SIZE, indices: np.ndarray | None = None, dtype=np.float32):
+        """
+        Yields (X, y) batches of unpacked rows, y is None when there are no labels
+
+        Args:
+            batch_size (int): rows per batch
+            indices (np.ndarray): row order to read in (e.g. a shuffled or split subset), defaults to every row in order
+            dtype: dtype of the unpacked rows
+        """
+        if indices is None:
+            for start in range(0, len(self), batch_size):
+                index = slice(start, start + batch_size)
+                yield self.rows(index, dtype), None if self.labels is None else self.labels[index]
+        else:
+            indices = np.asarray(indices)
+            for start in range(0, len(indices), batch_size):
+                index = np.sort(indices[start:start + batch_size]) # Sorted reads are sequential in the mapped file
+                order = np.argsort(np.argsort(indices[start:start + batch_size])) # Back to the requested order
+                X = self.rows(index, dtype)[order]
+                yield X, None if self.labels is None else self.labels[index][order]
+
+    def popcount(self) -> np.ndarray:
+        """
+        Set features per row, computed a batch at a time
+        """
+        return np.concatenate([popcount(np.asarray(self.packed[start:start + DEFAULT_BATCH_SIZE]))
+                               for start in range(0, len(self), DEFAULT_BATCH_SIZE)] or [np.zeros(0, dtype=np.int64)])
+
+    def jaccard(self, query: np.ndarray) -> np.ndarray:
+        """
+        Jaccard similarity of packed query row(s) against every row in the dataset
+        """
+        return jaccard(query, self.packed)
+
+if __name__ == "__main__":
+    vectors_dir = sys.argv[1] if len(sys.argv) > 1 else vectorizeFeatures.OUT_DIRECTORY
+    dense_path = os.path.join(vectors_dir, vectorizeFeatures.VECTORS_FILENAME)
+    sparse_path = os.path.join(vectors_dir, vectorizeFeatures.SPARSE_VECTORS_FILENAME)
+
+    if os.path.exists(sparse_path):
+        vectors, _, _ = vectorizeFeatures.load_sparse_vector_dataset(vectors_dir)
+    elif os.path.exists(dense_path):
+        vectors = np.load(dense_path, mmap_mode="r")
+    else:
+        raise SystemExit(f"[FATAL] No {vectorizeFeatures.VECTORS_FILENAME} or {vectorizeFeatures.SPARSE_VECTORS_FILENAME} in {vectors_dir}")
+
+    if sparse.issparse(vectors):
+        packed = pack_vectors(vectors)
+    else: # Pack in batches so a large dense file is never fully in memory
+        packed = np.concatenate([pack_vectors(vectors[start:start + DEFAULT_BATCH_SIZE])
+                                 for start in range(0, vectors.shape[0], DEFAULT_BATCH_SIZE)])
+    save_packed_vectors(vectors_dir, packed, vectors.shape[1])
+
+    print(f"[INFO] Packed {vectors.shape[0]} x {vectors.shape[1]} vectors into {packed.nbytes:,} bytes ({PACKED_VECTORS_FILENAME})")
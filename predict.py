@@ -1,57 +1,25 @@
 import os
 import sys
+import threading
 import numpy as np
 from collections import defaultdict
-import tensorflow as tf
-from tensorflow import keras
+from feature_vectorizer import get_vectorizer
+from feature_index import load_feature_index, read_unique_feature_files, check_model, FEATURE_INDEX_FILENAME
+# NOTE: TensorFlow is imported by load_model, importing it takes seconds and the CLI should check its arguments first
+
+DEFAULT_MODEL_PATH = 'apk_malware_cnn_model.keras'
 
 def load_feature_list():
     """Load feature list and create feature_to_index mapping"""
-    # Try to load from saved npy file first
-    if os.path.exists('feature_list.npy'):
-        print("Loading feature_list from feature_list.npy...")
-        feature_list = np.load('feature_list.npy', allow_pickle=True).tolist()
-        feature_to_index = {feature: idx for idx, feature in enumerate(feature_list)}
-        return feature_list, feature_to_index
-    else:
-        # Fallback to loading from unique_features directory
-        print("Loading feature_list from unique_features directory...")
-        return load_unique_features()
+    # Memory maps feature_index.bin, compiled once from feature_list.npy (or the unique_features directory) if it doesn't exist yet
+    print("Loading feature index...")
+    feature_index = load_feature_index()
+    return feature_index.names, feature_index
 
 def load_unique_features():
     """Load all unique features from the unique_features directory"""
-    feature_list = []
-    feature_to_index = {}
-    
-    # List of unique feature files
-    feature_files = [
-        'unique_permissions.txt',
-        'unique_intents.txt',
-        'unique_api_calls.txt',
-        'unique_libraries.txt',
-        'unique_urls.txt',
-        'unique_used_hsware.txt'
-    ]
-    
-    unique_features_dir = 'unique_features'
-    
-    for filename in feature_files:
-        filepath = os.path.join(unique_features_dir, filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        # Extract feature name (remove count at the end)
-                        # Format: "Feature: name count"
-                        parts = line.rsplit(' ', 1)
-                        if len(parts) == 2:
-                            feature_name = parts[0]  # Already includes prefix like "Intent: ", "API: ", etc.
-                            
-                            if feature_name not in feature_to_index:
-                                feature_to_index[feature_name] = len(feature_list)
-                                feature_list.append(feature_name)
-    
+    feature_list = read_unique_feature_files('unique_features')
+    feature_to_index = {feature: idx for idx, feature in enumerate(feature_list)}
     return feature_list, feature_to_index
 
 def parse_feature_file(filepath):
@@ -75,52 +43,148 @@ def parse_feature_file(filepath):
 
 def vectorize_apk(apk_feature_file, feature_list, feature_to_index):
     """Convert APK feature file to feature vector"""
-    features = parse_feature_file(apk_feature_file)
-    
-    # Create feature vector
-    vector = np.zeros(len(feature_list), dtype=np.float32)
-    for feature_name, count in features.items():
-        if feature_name in feature_to_index:
-            vector[feature_to_index[feature_name]] = count
-    
-    return vector
+    # Same result as parse_feature_file + one store per feature, done by the batched FeatureVectorizer
+    return get_vectorizer(feature_list, feature_to_index).transform_file(apk_feature_file)
 
-def load_model(model_path='apk_malware_cnn_model.keras'):
-    """Load the trained model"""
+def vectorize_apks(apk_feature_files, feature_list, feature_to_index, sparse_output=False):
+    """Convert many APK feature files to a [n_files, len(feature_list)] matrix in one batch"""
+    return get_vectorizer(feature_list, feature_to_index).transform_files(apk_feature_files, sparse_output=sparse_output)
+
+def load_model(model_path=DEFAULT_MODEL_PATH, feature_index=None):
+    """Load the trained model, checked against the feature index it will be served with"""
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found: {model_path}")
     
     print(f"Loading model from {model_path}...")
-    model = keras.models.load_model(model_path)
+    if model_path.endswith('.tflite'):
+        # Exported with tflite_model.py, runs on the TFLite interpreter without the TensorFlow runtime
+        from tflite_model import TFLiteModel
+        model = TFLiteModel(model_path)
+    elif model_path.endswith('.npz'):
+        # Embedding bag model from sparse_model.py, takes CSR matrices (model.sparse_input) and runs on numpy
+        from sparse_model import load_sparse_model
+        model = load_sparse_model(model_path)
+    elif model_path.endswith('.lgbm'):
+        # LightGBM booster from lightgbm_model.py, predicted by its lleaves compiled code when that is up to date
+        from lightgbm_model import LightGBMModel
+        model = LightGBMModel(model_path)
+    else:
+        from tensorflow import keras
+        model = keras.models.load_model(model_path)
+    if feature_index is not None:
+        check_model(model_path, feature_index, model.input_shape[1])
     return model
 
-def predict(apk_feature_file, model_path='apk_malware_cnn_model.keras'):
+def model_input(vectors, model):
+    """Shapes a batch of vectors for the model: CSR for sparse input models (sparse_model.py), (batch, features, 1) float32 for the CNN"""
+    if getattr(model, 'sparse_input', False):
+        return vectors.tocsr() if hasattr(vectors, 'tocsr') else vectors
+    if hasattr(vectors, 'toarray'):
+        vectors = vectors.toarray()
+    return np.expand_dims(vectors.astype(np.float32, copy=False), axis=-1)
+
+class Predictor:
+    """
+    Long lived feature index + model for repeated predictions
+    Nothing is loaded (or TensorFlow imported) until the first prediction or warm_up(). The model and index are
+    reloaded when their file's modification time changes, so a retrained model is picked up without a restart.
+    A reload that fails keeps the previously loaded pair, the files are tried again when they change again
+    
+    Args:
+        model_path (str): trained Keras model
+        index_path (str): compiled feature index, compiled from feature_list.npy or unique_features/ if missing
+    """
+    
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, index_path=FEATURE_INDEX_FILENAME):
+        self.model_path = model_path
+        self.index_path = index_path
+        self._model = None
+        self._model_mtime = None
+        self._index = None
+        self._index_mtime = None
+        self._failed_mtimes = None  # (index, model) modification times of the last reload that failed
+        self._lock = threading.Lock()
+    
+    def load(self):
+        """Loads the index and model, or reloads whichever changed on disk, returns (model, feature_list, feature_to_index)"""
+        with self._lock:
+            index_mtime = os.stat(self.index_path).st_mtime_ns if os.path.exists(self.index_path) else None
+            model_mtime = os.stat(self.model_path).st_mtime_ns if os.path.exists(self.model_path) else None
+            loaded = self._model is not None
+            if loaded and (index_mtime, model_mtime) in ((self._index_mtime, self._model_mtime), self._failed_mtimes):
+                return self._model, self._index.names, self._index
+            
+            # The new pair replaces the served one only once the model passed check_model against the new index
+            try:
+                index = self._index
+                if index is None or index_mtime != self._index_mtime:
+                    print("Loading feature index...")
+                    index = load_feature_index(self.index_path)
+                model = load_model(self.model_path, index)
+            except Exception as e:
+                if not loaded:
+                    raise
+                print(f"[ERROR] Reloading {self.model_path} failed, still serving the previous model: {e}")
+                self._failed_mtimes = (index_mtime, model_mtime)
+                return self._model, self._index.names, self._index
+            
+            self._index, self._model = index, model
+            self._index_mtime = os.stat(self.index_path).st_mtime_ns  # Written by load_feature_index if it was missing
+            self._model_mtime = model_mtime
+            self._failed_mtimes = None
+            return self._model, self._index.names, self._index
+    
+    def warm_up(self):
+        """Loads everything and runs one dummy batch, so the first real prediction doesn't pay for TensorFlow's setup"""
+        model, feature_list, feature_to_index = self.load()
+        vectorizer = get_vectorizer(feature_list, feature_to_index)
+        model.predict_on_batch(model_input(vectorizer.transform_texts([''], sparse_output=True), model))
+        return self
+    
+    def predict_texts(self, texts):
+        """Predict feature file contents with one model call, returns (label, score, feature_count) for each"""
+        model, feature_list, feature_to_index = self.load()
+        vectors, feature_counts = get_vectorizer(feature_list, feature_to_index).transform_texts(texts, sparse_output=True, return_feature_counts=True)
+        vectors = model_input(vectors, model)
+        
+        # Assuming binary classification: 0 = benign, 1 = malicious
+        scores = np.asarray(model.predict_on_batch(vectors)).reshape(-1)
+        return [(1 if score >= 0.5 else 0, float(score), int(feature_count))
+                for score, feature_count in zip(scores.tolist(), feature_counts.tolist())]
+    
+    def predict_files(self, apk_feature_files):
+        """Predict feature files, returns (label, score) for each"""
+        texts = []
+        for apk_feature_file in apk_feature_files:
+            with open(apk_feature_file, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+        return [(label, score) for label, score, _ in self.predict_texts(texts)]
+
+_predictors = {}
+
+def get_predictor(model_path=DEFAULT_MODEL_PATH, index_path=FEATURE_INDEX_FILENAME):
+    """Returns the Predictor for these paths, created once per process so its model stays loaded"""
+    key = (os.path.abspath(model_path), os.path.abspath(index_path))
+    if key not in _predictors:
+        _predictors[key] = Predictor(model_path, index_path)
+    return _predictors[key]
+
+def predict(apk_feature_file, model_path=DEFAULT_MODEL_PATH, use_daemon=True):
     """Main prediction function"""
-    # Load feature list
-    print("Loading feature list...")
-    feature_list, feature_to_index = load_feature_list()
-    print(f"Loaded {len(feature_list)} features")
-    
-    # Load model
-    model = load_model(model_path)
-    
-    # Vectorize APK
-    print(f"Vectorizing APK features from: {apk_feature_file}")
-    vector = vectorize_apk(apk_feature_file, feature_list, feature_to_index)
-    
-    # Reshape for model input
-    vector = vector.astype(np.float32)
-    vector = np.expand_dims(vector, axis=0)   
-    vector = np.expand_dims(vector, axis=-1)
-    
-    # Predict
-    print("Running prediction...")
-    prediction = model.predict(vector, verbose=0)
-    
-    # Get label and score
-    # Assuming binary classification: 0 = benign, 1 = malicious
-    score = float(prediction[0][0])  # Probability of being malicious
-    label = 1 if score >= 0.5 else 0
+    # A running predict_daemon.py already has the model loaded, ask it first
+    results = None
+    if use_daemon:
+        from predict_daemon import predict_texts as daemon_predict_texts
+        with open(apk_feature_file, 'r', encoding='utf-8') as f:
+            results = daemon_predict_texts([f.read()], model_path)
+    
+    if results is not None:
+        print("Prediction by the prediction daemon")
+        label, score, _ = results[0]
+    else:
+        # No daemon: feature index and model are loaded on the first call and reused by later ones
+        print("Running prediction...")
+        label, score = get_predictor(model_path).predict_files([apk_feature_file])[0]
     
     # Output results
     label_name = "Malicious" if label == 1 else "Benign"
@@ -137,10 +201,12 @@ def main():
         print("Usage: python predict.py <apk_feature_file> [model_path]")
         print("Example: python predict.py sample_apk.txt")
         print("Example: python predict.py sample_apk.txt apk_malware_cnn_model.keras")
+        print("Example: python predict.py sample_apk.txt apk_malware_cnn_model.tflite   (see tflite_model.py)")
+        print("Start predict_daemon.py to keep the model loaded between runs (PREDICT_SOCKET= disables it)")
         sys.exit(1)
     
     apk_feature_file = sys.argv[1]
-    model_path = sys.argv[2] if len(sys.argv) > 2 else 'apk_malware_cnn_model.keras'
+    model_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_MODEL_PATH
     
     if not os.path.exists(apk_feature_file):
         print(f"Error: Feature file not found: {apk_feature_file}")
@@ -0,0 +1,259 @@
+"""
+Local prediction daemon for predict.py
+
+Every predict.py run used to import TensorFlow and load the model and feature index again, seconds of fixed cost per
+scan when CI calls it once per built APK. The daemon loads them once (predict.Predictor, warmed up) and answers
+predictions over a Unix domain socket. predict.py tries the daemon first and predicts in process when none is running.
+
+Protocol: one JSON object per line each way, a connection can send any number of requests
+    {"op": "predict", "texts": [...], "model_path": ..., "index_path": ...}  -> {"results": [[label, score, feature_count], ...]}
+    {"op": "ping"}                                                            -> {"ok": true, "pid": ..., "model_path": ...}
+    {"op": "shutdown"}                                                        -> {"ok": true}
+    errors                                                                    -> {"error": "..."}
+The client sends feature file contents, not paths, and absolute model/index paths resolved in its own directory.
+The socket is only accessible to the user running the daemon, and the client only talks to a socket owned by its own user.
+
+Usage:
+    python predict_daemon.py [--socket PATH] [--model apk_malware_cnn_model.keras]     # start, Ctrl+C stops it
+    python predict_daemon.py --status | --stop
+The socket path defaults to $PREDICT_SOCKET, or apk_predict.sock in $XDG_RUNTIME_DIR, or in a private
+apk_predict-<uid> directory in the temp directory
+"""
+
+import os
+import sys
+import json
+import stat
+import socket
+import argparse
+import threading
+import tempfile
+import socketserver
+
+from predict import get_predictor, DEFAULT_MODEL_PATH
+from feature_index import FEATURE_INDEX_FILENAME
+
+SOCKET_FILENAME = "apk_predict.sock"
+CONNECT_TIMEOUT = 0.5 # Seconds, a missing daemon has to be noticed quickly so the fallback stays cheap
+RESPONSE_TIMEOUT = 300.0 # Seconds, first request for a new model loads it
+MAX_REQUEST_BYTES = 256 * 1024 * 1024
+
+def default_socket_path() -> str:
+    """
+    Per user socket path, the shared temp directory would let another user answer in the daemon's place
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, SOCKET_FILENAME)
+    return os.path.join(tempfile.gettempdir(), f"apk_predict-{os.getuid()}", SOCKET_FILENAME)
+
+def socket_path_from_env() -> str | None:
+    """
+    Socket to use: $PREDICT_SOCKET, or the default path. An empty $PREDICT_SOCKET disables the daemon
+    """
+    path = os.environ.get("PREDICT_SOCKET")
+    if path is None:
+        return default_socket_path() if supported() else None
+    return path or None
+
+def supported() -> bool:
+    """
+    Unix domain sockets (and user ids) are missing on Windows Pythons
+    """
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "getuid")
+
+def owned_socket(socket_path: str) -> bool:
+    """
+    True if socket_path is a socket created by this user, anything else may be another user's fake daemon
+    """
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+def private_socket_dir(socket_path: str) -> bool:
+    """
+    Creates the default apk_predict-<uid> directory with mode 0700, and checks that an existing one is ours and private
+
+    Returns:
+        bool: False if the directory belongs to another user or others can access it
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    if socket_path != default_socket_path() or os.environ.get("XDG_RUNTIME_DIR"):
+        return True # A --socket/$PREDICT_SOCKET directory is the user's choice, $XDG_RUNTIME_DIR is private already
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and info.st_mode & 0o077 == 0
+
+def _send(sock_file, message: dict):
+    sock_file.write(json.dumps(message).encode("utf-8") + b"\n")
+    sock_file.flush()
+
+def _receive(sock_file) -> dict | None:
+    line = sock_file.readline(MAX_REQUEST_BYTES + 1)
+    if not line:
+        return None
+    if len(line) > MAX_REQUEST_BYTES:
+        raise ValueError(f"request is over {MAX_REQUEST_BYTES} bytes")
+    return json.loads(line)
+
+def request(message: dict, socket_path: str | None = None) -> dict | None:
+    """
+    Sends one request to the daemon
+
+    Returns:
+        dict | None: the daemon's response, None if no daemon is listening on socket_path
+    """
+    socket_path = socket_path or socket_path_from_env()
+    if socket_path is None or not supported() or not owned_socket(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError, socket.timeout): # Stale socket file or daemon starting
+            return None
+        sock.settimeout(RESPONSE_TIMEOUT)
+        with sock.makefile("rwb") as sock_file:
+            _send(sock_file, message)
+            return _receive(sock_file)
+    finally:
+        sock.close()
+
+def predict_texts(texts: list[str], model_path: str = DEFAULT_MODEL_PATH, index_path: str = FEATURE_INDEX_FILENAME,
+                  socket_path: str | None = None) -> list[tuple[int, float, int]] | None:
+    """
+    Predicts feature file contents with the daemon, same results as predict.Predictor.predict_texts
+
+    Returns:
+        list | None: (label, score, feature_count) per text, None if no daemon is running
+    Raises:
+        RuntimeError: the daemon is running but the prediction failed
+    """
+    response = request({"op": "predict", "texts": texts, "model_path": os.path.abspath(model_path),
+                        "index_path": os.path.abspath(index_path)}, socket_path)
+    if response is None:
+        return None
+    if "error" in response:
+        raise RuntimeError(f"Prediction daemon: {response['error']}")
+    return [(int(label), float(score), int(feature_count)) for label, score, feature_count in response["results"]]
+
+class PredictionHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the requests of one client connection, see the module docstring for the protocol
+    """
+
+    def handle(self):
+        while True:
+            try:
+                message = _receive(self.rfile)
+            except ValueError as e:
+                _send(self.wfile, {"error": f"Invalid request: {str(e)}"})
+                return
+            if message is None:
+                return
+            try:
+                response = self.server.answer(message)
+            except Exception as e:
+                response = {"error": str(e)}
+            _send(self.wfile, response)
+            if message.get("op") == "shutdown":
+                # shutdown() waits for serve_forever to return, which can't happen while this request is handled
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+class PredictionServer(socketserver.UnixStreamServer):
+    """
+    Serves one connection at a time, requests reach the model one after another
+    """
+
+    def __init__(self, socket_path: str, model_path: str, index_path: str):
+        self.model_path = os.path.abspath(model_path)
+        self.index_path = os.path.abspath(index_path)
+        # The socket is created with the umask's permissions, owner only from the start instead of chmod after bind
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, PredictionHandler)
+        finally:
+            os.umask(umask)
+
+    def answer(self, message: dict) -> dict:
+        op = message.get("op")
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid(), "model_path": self.model_path}
+        if op == "shutdown":
+            return {"ok": True}
+        if op == "predict":
+            predictor = get_predictor(message.get("model_path", self.model_path), message.get("index_path", self.index_path))
+            return {"results": predictor.predict_texts(message["texts"])}
+        return {"error": f"Unknown op: {op}"}
+
+def remove_stale_socket(socket_path: str) -> bool:
+    """
+    Removes a socket file left by a daemon that died
+
+    Returns:
+        bool: False if a daemon is still listening on it or the path belongs to someone else
+    """
+    if not os.path.lexists(socket_path):
+        return True
+    if not owned_socket(socket_path):
+        print(f"[ERROR] {socket_path} is not a socket owned by this user, use --socket to choose another path")
+        return False
+    if request({"op": "ping"}, socket_path) is not None:
+        print(f"[ERROR] A prediction daemon is already running on {socket_path}")
+        return False
+    os.remove(socket_path)
+    return True
+
+def serve(socket_path: str, model_path: str = DEFAULT_MODEL_PATH, index_path: str = FEATURE_INDEX_FILENAME):
+    """
+    Loads and warms up the model, then answers requests until Ctrl+C or a shutdown request
+    """
+    if not private_socket_dir(socket_path):
+        print(f"[ERROR] {os.path.dirname(socket_path)} belongs to another user or is accessible to others")
+        sys.exit(1)
+    if not remove_stale_socket(socket_path):
+        sys.exit(1)
+
+    print(f"[INFO] Loading {model_path}...")
+    get_predictor(os.path.abspath(model_path), os.path.abspath(index_path)).warm_up()
+
+    with PredictionServer(socket_path, model_path, index_path) as server:
+        print(f"[INFO] Prediction daemon listening on {socket_path} (pid {os.getpid()})")
+        try:
+            server.serve_forever(poll_interval=0.2)
+        except KeyboardInterrupt:
+            print("\n[INFO] Stopped by user")
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Keep the malware model loaded and answer predict.py over a Unix socket")
+    parser.add_argument("--socket", default=socket_path_from_env() or (default_socket_path() if supported() else None),
+                        help="Unix socket path")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Model loaded at startup")
+    parser.add_argument("--index", default=FEATURE_INDEX_FILENAME, help="Feature index loaded at startup")
+    parser.add_argument("--status", action="store_true", help="Report whether a daemon is running and exit")
+    parser.add_argument("--stop", action="store_true", help="Stop the running daemon and exit")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not supported():
+        print("[ERROR] This Python has no Unix domain sockets, run predict.py without the daemon")
+        sys.exit(1)
+
+    if args.status or args.stop:
+        response = request({"op": "shutdown" if args.stop else "ping"}, args.socket)
+        if response is None:
+            print(f"[INFO] No prediction daemon on {args.socket}")
+            sys.exit(1)
+        print(f"[INFO] {'Stopped' if args.stop else 'Running'}: {response}")
+        sys.exit(0)
+
+    serve(args.socket, args.model, args.index)
@@ -0,0 +1,275 @@
+"""
+Sparse input model: embedding bag + small MLP, trained and served with numpy/scipy only
+
+The CNN needs every APK as a dense (n_features, 1) float32 vector although an APK sets a few hundred of ~50k features,
+so each prediction touches the whole vocabulary. SparseBagModel takes the set features directly:
+    bag    = sum over set features of log1p(count) * embedding[feature], divided by sqrt(number of set features)
+    hidden = relu(bag @ W1 + b1)
+    score  = sigmoid(hidden @ w2 + b2)
+Inference costs O(set features * embedding_dim), independent of the vocabulary size.
+
+Training reads any vectors vector_dataset accepts as CSR (the SPARSE .npz files memory mapped, dense and packed
+vectors converted in chunks) with mini-batch Adam. Only the embedding rows of the features present in a batch are
+updated (lazy Adam), so an epoch also scales with the number of set entries rather than rows * vocabulary.
+
+Serving: predict.load_model loads *.npz model paths with load_sparse_model. The model has sparse_input = True,
+app.py, predict.Predictor and evaluate.py then hand it CSR matrices from FeatureVectorizer instead of dense vectors.
+
+Usage:
+    python sparse_model.py vectors.npz|vectors.npy|packed_dir labels.npy [--index feature_index.bin] [--out apk_malware_bag_model.npz]
+    MODEL_PATH=apk_malware_bag_model.npz python app.py
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from scipy import sparse
+
+from vector_dataset import load_csr_matrix, stratified_split
+from feature_index import FeatureIndex, stamp_model, FEATURE_INDEX_FILENAME
+
+DEFAULT_MODEL_FILENAME = "apk_malware_bag_model.npz"
+DEFAULT_EMBEDDING_DIM = 32
+DEFAULT_HIDDEN_UNITS = 32
+DEFAULT_EPOCHS = 10
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_LEARNING_RATE = 0.005
+DEFAULT_PATIENCE = 3 # Epochs without a better validation loss before training stops (like the CNN's EarlyStopping)
+PARAMETERS = ("embeddings", "W1", "b1", "w2", "b2")
+
+def to_csr(x) -> sparse.csr_matrix:
+    """
+    CSR view of model input: a CSR matrix as is, a dense (n, F) or (n, F, 1) array converted (the old dense callers)
+    """
+    if sparse.issparse(x):
+        return x.tocsr()
+    x = np.asarray(x)
+    if x.ndim == 3:
+        x = x[..., 0]
+    return sparse.csr_matrix(x)
+
+def binary_metrics(labels: np.ndarray, scores: np.ndarray, prefix: str = "") -> dict[str, float]:
+    """
+    loss, accuracy, precision, recall and f1 of malicious scores (threshold 0.5 like predict.py)
+    """
+    y = np.asarray(labels, dtype=np.float32)
+    clipped = np.clip(scores, 1e-7, 1 - 1e-7)
+    predicted = scores >= 0.5
+    true_positives = float(np.sum(predicted & (y == 1)))
+    precision = true_positives / max(float(np.sum(predicted)), 1)
+    recall = true_positives / max(float(np.sum(y == 1)), 1)
+    return {
+        f"{prefix}loss": float(-np.mean(y * np.log(clipped) + (1 - y) * np.log(1 - clipped))),
+        f"{prefix}accuracy": float(np.mean(predicted == (y == 1))),
+        f"{prefix}precision": precision,
+        f"{prefix}recall": recall,
+        f"{prefix}f1": 2 * precision * recall / max(precision + recall, 1e-12)
+    }
+
+class SparseBagModel:
+    """
+    Embedding bag + one hidden layer binary classifier over feature index columns
+
+    Args:
+        n_features (int): vocabulary size, the feature index length
+        embedding_dim (int): size of each feature's embedding
+        hidden_units (int): hidden layer width
+        seed (int): initialization seed
+    """
+
+    sparse_input = True # Callers pass CSR matrices (FeatureVectorizer sparse_output) instead of dense vectors
+
+    def __init__(self, n_features: int, embedding_dim: int = DEFAULT_EMBEDDING_DIM, hidden_units: int = DEFAULT_HIDDEN_UNITS,
+                 seed: int | None = 0):
+        rng = np.random.default_rng(seed)
+        self.n_features = n_features
+        self.input_shape = (None, n_features) # Checked against the feature index like the keras model's
+        self.embeddings = rng.normal(0.0, 0.05, size=(n_features, embedding_dim)).astype(np.float32)
+        self.W1 = (rng.normal(0.0, 1.0, size=(embedding_dim, hidden_units)) * np.sqrt(2.0 / embedding_dim)).astype(np.float32)
+        self.b1 = np.zeros(hidden_units, dtype=np.float32)
+        self.w2 = (rng.normal(0.0, 1.0, size=hidden_units) * np.sqrt(1.0 / hidden_units)).astype(np.float32)
+        self.b2 = np.zeros(1, dtype=np.float32)
+
+    def _weighted(self, x) -> sparse.csr_matrix:
+        """
+        log1p(count) / sqrt(set features) weights of every set entry, rows without features stay empty
+        """
+        x = to_csr(x)
+        if x.shape[1] != self.n_features:
+            raise ValueError(f"input has {x.shape[1]} features, the model was trained with {self.n_features}")
+        weights = x.astype(np.float32, copy=True)
+        weights.data = np.log1p(np.maximum(weights.data, 0))
+        n_set = np.diff(weights.indptr)
+        weights.data /= np.sqrt(np.repeat(np.maximum(n_set, 1), n_set)).astype(np.float32)
+        return weights
+
+    def _forward(self, weights: sparse.csr_matrix) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        bag = np.asarray(weights @ self.embeddings, dtype=np.float32)
+        hidden = np.maximum(bag @ self.W1 + self.b1, 0)
+        scores = 1 / (1 + np.exp(-(hidden @ self.w2 + self.b2[0])))
+        return bag, hidden, scores
+
+    def predict_on_batch(self, x) -> np.ndarray:
+        """
+        Scores a CSR matrix (or a dense batch), returns [batch, 1] like the keras model
+        """
+        return self._forward(self._weighted(x))[2].reshape(-1, 1)
+
+    def predict(self, x, verbose=0) -> np.ndarray:
+        return self.predict_on_batch(x)
+
+    def fit(self, x: sparse.csr_matrix, labels: np.ndarray, train_indices: np.ndarray, validation_indices: np.ndarray | None = None,
+            epochs: int = DEFAULT_EPOCHS, batch_size: int = DEFAULT_BATCH_SIZE, learning_rate: float = DEFAULT_LEARNING_RATE,
+            patience: int = DEFAULT_PATIENCE, seed: int | None = 0) -> list[dict[str, float]]:
+        """
+        Mini-batch Adam on binary cross entropy, keeps the parameters of the best validation epoch
+
+        Args:
+            x (sparse.csr_matrix): every row, only the indexed ones are read
+            labels (np.ndarray): 0 benign / 1 malicious per row
+            train_indices, validation_indices (np.ndarray): rows to train and validate on (stratified_split)
+        Returns:
+            list[dict[str, float]]: loss (and val_loss, val_accuracy) per epoch
+        """
+        rng = np.random.default_rng(seed)
+        labels = np.asarray(labels, dtype=np.float32)
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-7
+        moments = {name: (np.zeros_like(getattr(self, name)), np.zeros_like(getattr(self, name))) for name in PARAMETERS}
+        embedding_steps = np.zeros(self.n_features, dtype=np.int64) # Lazy Adam: each row counts its own updates
+        step = 0
+        history = []
+        best_loss, best_parameters, waited = np.inf, None, 0
+
+        for epoch in range(epochs):
+            start_time = time.perf_counter()
+            epoch_loss = 0.0
+            order = rng.permutation(train_indices)
+            for start in range(0, len(order), batch_size):
+                rows = np.sort(order[start:start + batch_size]) # Sorted reads are sequential in the mapped file
+                weights = self._weighted(x[rows])
+                y = labels[rows]
+                bag, hidden, scores = self._forward(weights)
+                scores = np.clip(scores, 1e-7, 1 - 1e-7)
+                epoch_loss -= float(np.sum(y * np.log(scores) + (1 - y) * np.log(1 - scores)))
+
+                # Backward pass, mean binary cross entropy
+                d_logits = ((scores - y) / len(rows)).astype(np.float32)
+                d_hidden = np.outer(d_logits, self.w2) * (hidden > 0)
+                gradients = {
+                    "w2": hidden.T @ d_logits,
+                    "b2": np.array([d_logits.sum()], dtype=np.float32),
+                    "W1": bag.T @ d_hidden,
+                    "b1": d_hidden.sum(axis=0)
+                }
+                d_bag = d_hidden @ self.W1.T
+
+                step += 1
+                for name, gradient in gradients.items():
+                    m, v = moments[name]
+                    m *= beta1
+                    m += (1 - beta1) * gradient
+                    v *= beta2
+                    v += (1 - beta2) * gradient ** 2
+                    update = learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + epsilon)
+                    getattr(self, name)[...] -= update
+
+                # Embedding rows of the features in this batch only
+                columns, local = np.unique(weights.indices, return_inverse=True)
+                local_weights = sparse.csr_matrix((weights.data, local, weights.indptr), shape=(len(rows), len(columns)))
+                d_rows = np.asarray(local_weights.T @ d_bag, dtype=np.float32)
+                m, v = moments["embeddings"]
+                embedding_steps[columns] += 1
+                t = embedding_steps[columns][:, None]
+                m[columns] = beta1 * m[columns] + (1 - beta1) * d_rows
+                v[columns] = beta2 * v[columns] + (1 - beta2) * d_rows ** 2
+                self.embeddings[columns] -= learning_rate * (m[columns] / (1 - beta1 ** t)) / (np.sqrt(v[columns] / (1 - beta2 ** t)) + epsilon)
+
+            record = {"loss": epoch_loss / len(order)}
+            if validation_indices is not None and len(validation_indices):
+                record.update(self.evaluate(x, labels, validation_indices, batch_size, prefix="val_"))
+            history.append(record)
+            print(f"Epoch {epoch + 1}/{epochs} ({time.perf_counter() - start_time:.1f}s): "
+                  + ", ".join(f"{key} {value:.4f}" for key, value in record.items()))
+
+            monitored = record.get("val_loss", record["loss"])
+            if monitored < best_loss:
+                best_loss, waited = monitored, 0
+                best_parameters = {name: getattr(self, name).copy() for name in PARAMETERS}
+            else:
+                waited += 1
+                if waited >= patience:
+                    print(f"Early stopping, best loss {best_loss:.4f}")
+                    break
+
+        if best_parameters is not None:
+            for name, value in best_parameters.items():
+                setattr(self, name, value)
+        return history
+
+    def evaluate(self, x: sparse.csr_matrix, labels: np.ndarray, indices: np.ndarray, batch_size: int = DEFAULT_BATCH_SIZE,
+                 prefix: str = "") -> dict[str, float]:
+        """
+        binary_metrics() on the given rows
+        """
+        indices = np.sort(indices)
+        scores = np.concatenate([self.predict_on_batch(x[indices[i:i + batch_size]]).reshape(-1) for i in range(0, len(indices), batch_size)])
+        return binary_metrics(np.asarray(labels)[indices], scores, prefix)
+
+    def save(self, model_path: str):
+        tmp_path = model_path + ".tmp.npz"
+        np.savez(tmp_path, n_features=self.n_features, **{name: getattr(self, name) for name in PARAMETERS})
+        os.replace(tmp_path, model_path)
+
+def load_sparse_model(model_path: str) -> SparseBagModel:
+    """
+    Loads a SparseBagModel saved with save()
+    """
+    with np.load(model_path, allow_pickle=False) as saved:
+        model = SparseBagModel(int(saved["n_features"]), saved["embeddings"].shape[1], saved["W1"].shape[1])
+        for name in PARAMETERS:
+            setattr(model, name, saved[name].astype(np.float32))
+    return model
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train the sparse input (embedding bag) malware model")
+    parser.add_argument("vectors", help="vectors.npz / X_vectors.npz (CSR), a dense .npy or a packed vectors directory")
+    parser.add_argument("labels", help="labels.npy / y_labels.npy")
+    parser.add_argument("--index", default=FEATURE_INDEX_FILENAME, help="feature index the vectors were built with, the model is stamped with it")
+    parser.add_argument("--out", default=DEFAULT_MODEL_FILENAME, help="model file to write")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=DEFAULT_LEARNING_RATE)
+    parser.add_argument("--embedding-dim", type=int, default=DEFAULT_EMBEDDING_DIM)
+    parser.add_argument("--hidden-units", type=int, default=DEFAULT_HIDDEN_UNITS)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    x = load_csr_matrix(args.vectors)
+    labels = np.load(args.labels).astype(np.float32)
+    if len(labels) != x.shape[0]:
+        print(f"[ERROR] {args.labels} has {len(labels)} labels for {x.shape[0]} vectors")
+        sys.exit(1)
+    print(f"[INFO] {x.shape[0]} vectors, {x.shape[1]} features, {x.nnz / max(x.shape[0], 1):.0f} set per vector on average")
+
+    # Same 80/20 split as CNN.ipynb, with 10% of the training side held out for early stopping
+    train_indices, test_indices = stratified_split(labels, test_size=0.2, random_state=args.seed)
+    train_indices, validation_indices = stratified_split(labels, test_size=0.1, random_state=args.seed, indices=train_indices)
+
+    model = SparseBagModel(x.shape[1], args.embedding_dim, args.hidden_units, seed=args.seed)
+    model.fit(x, labels, train_indices, validation_indices, args.epochs, args.batch_size, args.learning_rate, seed=args.seed)
+    print("[INFO] Test set: " + ", ".join(f"{key} {value:.4f}" for key, value in model.evaluate(x, labels, test_indices).items()))
+
+    model.save(args.out)
+    if os.path.exists(args.index):
+        with FeatureIndex(args.index) as index:
+            if len(index) != x.shape[1]:
+                print(f"[WARN] {args.index} has {len(index)} features, the vectors have {x.shape[1]}, {args.out} is not stamped")
+            else:
+                stamp_model(args.out, index)
+    else:
+        print(f"[WARN] {args.index} not found, {args.out} is not stamped with its feature index")
+    print(f"[INFO] Saved {args.out}")
@@ -0,0 +1,65 @@
+# BenchmarkFeatureVectorizer.py
+# Checks feature_vectorizer.FeatureVectorizer against the old predict.vectorize_apk loop and times both
+# The example feature files have no counts, so every line gets a pseudo random count appended ("name count" like predict expects).
+# feature_list is every distinct example feature plus unseen ones, so some lines miss the index like in real use
+import os
+import sys
+import time
+import random
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from feature_vectorizer import FeatureVectorizer, parse_count_line
+
+EXAMPLE_FEATURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exampleFeatures", "malicious_features")
+COPIES = 20 # Each example file is vectorized this many times, with different counts
+REPEATS = 3
+
+def legacy_vectorize(text, feature_list, feature_to_index):
+    # predict.vectorize_apk before feature_vectorizer: dict of parsed lines, then one store per feature
+    features = {}
+    for line in text.split('\n'):
+        parsed = parse_count_line(line)
+        if parsed is not None:
+            features[parsed[0]] = parsed[1]
+    vector = np.zeros(len(feature_list), dtype=np.float32)
+    for feature_name, count in features.items():
+        if feature_name in feature_to_index:
+            vector[feature_to_index[feature_name]] = count
+    return vector, len(features)
+
+if __name__ == "__main__":
+    random.seed(0)
+    texts = []
+    distinct = set()
+    for filename in sorted(os.listdir(EXAMPLE_FEATURES_DIR)):
+        with open(os.path.join(EXAMPLE_FEATURES_DIR, filename), 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        distinct.update(lines)
+        for _ in range(COPIES):
+            texts.append('\n'.join(f"{line} {random.randint(1, 9)}" for line in lines) + '\n')
+
+    feature_list = sorted(distinct)
+    feature_list = feature_list[::2] + [f"Unseen: feature{i}" for i in range(1000)] # Half the example features miss the index
+    feature_to_index = {feature: idx for idx, feature in enumerate(feature_list)}
+    print(f"{len(texts)} texts, {sum(text.count(chr(10)) for text in texts):,} lines, {len(feature_list)} features")
+
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        legacy = [legacy_vectorize(text, feature_list, feature_to_index) for text in texts]
+    legacy_seconds = (time.perf_counter() - start) / REPEATS
+
+    vectorizer = FeatureVectorizer(feature_list, feature_to_index)
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        X, feature_counts = vectorizer.transform_texts(texts, return_feature_counts=True)
+    batched_seconds = (time.perf_counter() - start) / REPEATS
+
+    assert np.array_equal(X, np.stack([vector for vector, _ in legacy])), "vectors differ"
+    assert feature_counts.tolist() == [count for _, count in legacy], "feature counts differ"
+    X_sparse = vectorizer.transform_texts(texts, sparse_output=True)
+    assert np.array_equal(X_sparse.toarray(), X), "sparse output differs"
+    print("Vectors OK")
+
+    print(f"Per file loop:     {legacy_seconds * 1000:.1f}ms")
+    print(f"FeatureVectorizer: {batched_seconds * 1000:.1f}ms")
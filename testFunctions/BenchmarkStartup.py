@@ -0,0 +1,54 @@
+# BenchmarkStartup.py
+# Times how long the entry points take to start, each run in a fresh interpreter:
+#   predict.py without arguments   (prints its usage, should not import TensorFlow)
+#   import app                      (Flask app and routes, the model is only loaded by init_model)
+#   import evaluate                 (sklearn is only imported once the metrics are computed)
+#   Predictor warm up               (feature index + model + one dummy batch, only if the model file exists)
+# and reports whether TensorFlow / sklearn were imported by each, next to the time "import tensorflow" takes on its own
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MODEL_PATH = os.path.join(REPO_DIR, "apk_malware_cnn_model.keras")
+REPEATS = 5
+
+# Prints which heavy modules the snippet pulled in, as the last line of output
+REPORT = "import sys; print('loaded:', ','.join(m for m in ('tensorflow', 'sklearn') if m in sys.modules) or 'none')"
+
+ENTRY_POINTS = [
+    ("predict.py (usage)", "sys.argv = ['predict.py']\ntry:\n    import runpy; runpy.run_path('predict.py', run_name='__main__')\nexcept SystemExit:\n    pass"),
+    ("import app", "import app"),
+    ("import evaluate", "import evaluate"),
+]
+
+def time_snippet(code: str) -> tuple[float | None, str]:
+    """
+    Runs code in a new interpreter from the repo directory, returns (seconds, last output line), seconds is None if it failed
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", f"import sys\n{code}\n{REPORT}"], cwd=REPO_DIR,
+                            capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    lines = (result.stdout.strip() or result.stderr.strip()).splitlines()
+    return (seconds if result.returncode == 0 else None), lines[-1] if lines else ""
+
+if __name__ == "__main__":
+    entry_points = list(ENTRY_POINTS)
+    if os.path.exists(MODEL_PATH):
+        entry_points.append(("Predictor warm up", "from predict import get_predictor\nget_predictor().warm_up()"))
+    else:
+        print(f"{MODEL_PATH} not found, skipping the model warm up\n")
+    entry_points.append(("import tensorflow", "import tensorflow"))
+    time_snippet("pass") # Warm the OS file cache
+
+    print(f"{'entry point':<22}{'median':>10}{'min':>10}   modules")
+    for name, code in entry_points:
+        runs = [time_snippet(code) for _ in range(REPEATS)]
+        seconds = [run[0] for run in runs]
+        if None in seconds:
+            print(f"{name:<22}{'failed':>10}{'':>10}   {runs[-1][1]}")
+            continue
+        print(f"{name:<22}{statistics.median(seconds):>9.2f}s{min(seconds):>9.2f}s   {runs[-1][1]}")
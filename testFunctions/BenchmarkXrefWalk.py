@@ -0,0 +1,94 @@
+# BenchmarkXrefWalk.py
+# Micro-benchmark for the api_calls/libraries call edge walk in FeatureExtractor.extract_dex_features
+# Compares the old per edge string building loop with FeatureExtractor.collect_method_calls
+# Call graphs are rebuilt from the API/Library lines of the example feature files (no APKs needed),
+# every distinct call is repeated EDGES_PER_CALL times to get edge counts closer to a real app
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import FeatureExtractor
+
+EXAMPLE_FEATURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exampleFeatures", "malicious_features")
+EDGES_PER_CALL = 50 # Real apps call the same method from many places
+METHODS_PER_APK = 2000 # Calling methods the edges are spread across
+REPEATS = 3
+
+class FakeMethodAnalysis:
+    # Mimics androguard's MethodAnalysis, class_name and name are properties like the real ones
+    def __init__(self, class_name, name):
+        self._class_name = class_name
+        self._name = name
+        self.xrefto = []
+
+    @property
+    def class_name(self):
+        return self._class_name
+
+    @property
+    def name(self):
+        return self._name
+
+    def get_xref_to(self):
+        return self.xrefto
+
+def build_call_graph(feature_file_path, rng):
+    # One FakeMethodAnalysis per distinct API/Library line, shared by every edge that calls it (like androguard)
+    callees = []
+    with open(feature_file_path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            tag, _, body = line.strip().partition(": ")
+            if tag not in (FeatureExtractor.FEATURE_TAGS[3], FeatureExtractor.FEATURE_TAGS[4]) or "." not in body:
+                continue
+            class_path, _, method_name = body.rpartition(".")
+            callees.append(FakeMethodAnalysis(f"L{class_path.replace('.', '/')};", method_name))
+
+    callers = [FakeMethodAnalysis("Lcom/example/Caller;", f"m{i}") for i in range(METHODS_PER_APK)]
+    edges = [(None, callee, 0) for callee in callees for _ in range(EDGES_PER_CALL)]
+    rng.shuffle(edges)
+    for i, edge in enumerate(edges):
+        callers[i % METHODS_PER_APK].xrefto.append(edge)
+    return callers, len(edges)
+
+def legacy_walk(methods):
+    # The loop extract_features used before collect_method_calls
+    apis = []
+    libraries = []
+    for method in methods:
+        for _, call, _ in method.get_xref_to():
+            classname = call.class_name[1:-1].replace("/", ".")
+            methodname = call.name
+            fullname = f"{classname}.{methodname}"
+            if fullname.startswith("android") or fullname.startswith("java"):
+                apis.append(fullname)
+            else:
+                libraries.append(fullname)
+    return list(dict.fromkeys(apis)), list(dict.fromkeys(libraries)) # extract_features dict deduplicated afterwards
+
+def time_walk(walk, graphs):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for methods, _ in graphs:
+            walk(methods)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    graphs = []
+    for filename in sorted(os.listdir(EXAMPLE_FEATURES_DIR)):
+        graphs.append(build_call_graph(os.path.join(EXAMPLE_FEATURES_DIR, filename), rng))
+    total_edges = sum(edge_count for _, edge_count in graphs)
+
+    for methods, _ in graphs: # Both walks must find the same calls in the same order
+        assert legacy_walk(methods) == FeatureExtractor.collect_method_calls(methods), "collect_method_calls output differs from the legacy walk"
+
+    legacy_seconds = time_walk(legacy_walk, graphs)
+    dedup_seconds = time_walk(FeatureExtractor.collect_method_calls, graphs)
+    print(f"APKs: {len(graphs)} | Call edges: {total_edges}")
+    print(f"Legacy walk:  {total_edges / legacy_seconds:,.0f} edges/s ({legacy_seconds:.3f}s)")
+    print(f"Deduped walk: {total_edges / dedup_seconds:,.0f} edges/s ({dedup_seconds:.3f}s)")
+    print(f"Speedup: {legacy_seconds / dedup_seconds:.1f}x")
@@ -0,0 +1,58 @@
+# CheckFeatureShard.py
+# Round trip check and read benchmark for FeatureShard.py
+# Packs the example feature files into a shard, checks every record against the text parse,
+# unpacks the shard again and checks the text files parse to the same features, then times text vs shard reads
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import FeatureShard
+
+EXAMPLE_FEATURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "exampleFeatures", "malicious_features")
+REPEATS = 20
+
+def as_plain(features):
+    return {feature_type: dict(type_features) for feature_type, type_features in features.items()}
+
+if __name__ == "__main__":
+    filenames = sorted(filename for filename in os.listdir(EXAMPLE_FEATURES_DIR) if filename.endswith(".txt"))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        shard_path = os.path.join(temp_dir, "malicious" + FeatureShard.SHARD_EXTENSION)
+        FeatureShard.text_to_shard(EXAMPLE_FEATURES_DIR, shard_path)
+
+        with FeatureShard.FeatureShard(shard_path) as shard:
+            assert shard.names == filenames, "shard names differ from the feature file names"
+            for i, filename in enumerate(filenames):
+                expected = as_plain(FeatureShard.read_text_feature_file(os.path.join(EXAMPLE_FEATURES_DIR, filename)))
+                assert as_plain(shard.features(i)) == expected, f"{filename} differs after packing"
+            print(f"Packed {len(shard)} files, {len(shard.vocabulary)} distinct features, {len(shard.entries)} entries")
+
+        unpacked_dir = os.path.join(temp_dir, "unpacked")
+        FeatureShard.shard_to_text(shard_path, unpacked_dir)
+        for filename in filenames:
+            original = as_plain(FeatureShard.read_text_feature_file(os.path.join(EXAMPLE_FEATURES_DIR, filename)))
+            unpacked = as_plain(FeatureShard.read_text_feature_file(os.path.join(unpacked_dir, filename)))
+            assert original == unpacked, f"{filename} differs after unpacking"
+        print("Round trip OK")
+
+        text_bytes = sum(os.path.getsize(os.path.join(EXAMPLE_FEATURES_DIR, filename)) for filename in filenames)
+        print(f"Text: {text_bytes:,} bytes | Shard: {os.path.getsize(shard_path):,} bytes")
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            for filename in filenames:
+                FeatureShard.read_text_feature_file(os.path.join(EXAMPLE_FEATURES_DIR, filename))
+        text_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            with FeatureShard.FeatureShard(shard_path) as shard:
+                for i in range(len(shard)):
+                    ids, counts = shard[i]
+                    ids.sum() # touch the record
+        shard_seconds = time.perf_counter() - start
+
+        print(f"Text parse:  {text_seconds / REPEATS * 1000:.2f}ms per pass")
+        print(f"Shard read:  {shard_seconds / REPEATS * 1000:.2f}ms per pass")
@@ -0,0 +1,70 @@
+# CheckTFLiteParity.py
+# Checks that the TFLite export (tflite_model.py) scores like the keras model it came from, and times both
+# Inputs are the feature files in benign_features/ and malicious_features/ (when present) plus random sparse count vectors,
+# scored one at a time and in batches like app.py's micro batches and evaluate.py's batches
+# Usage: python CheckTFLiteParity.py [apk_malware_cnn_model.keras] [apk_malware_cnn_model.tflite] [tolerance]
+import os
+import sys
+import glob
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from predict import load_feature_list, vectorize_apks
+from tflite_model import TFLiteModel, tflite_path
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FEATURE_DIRS = ["benign_features", "malicious_features"]
+MAX_FILES = 500
+RANDOM_VECTORS = 200
+BATCH_SIZES = [1, 32, 256]
+DEFAULT_TOLERANCE = 1e-4 # Absolute score difference, use ~1e-2 for --float16 / --dynamic exports
+
+def score_all(model, X, batch_size):
+    start = time.perf_counter()
+    scores = np.concatenate([np.asarray(model.predict_on_batch(X[i:i + batch_size])).reshape(-1) for i in range(0, len(X), batch_size)])
+    return scores, time.perf_counter() - start
+
+if __name__ == "__main__":
+    keras_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(REPO_DIR, "apk_malware_cnn_model.keras")
+    lite_path = sys.argv[2] if len(sys.argv) > 2 else tflite_path(keras_path)
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_TOLERANCE
+    for path in (keras_path, lite_path):
+        if not os.path.exists(path):
+            print(f"Error: {path} not found (export it with: python tflite_model.py {keras_path})")
+            sys.exit(1)
+
+    from tensorflow import keras
+    keras_model = keras.models.load_model(keras_path)
+    lite_model = TFLiteModel(lite_path)
+    assert keras_model.input_shape == lite_model.input_shape, f"input shapes differ: {keras_model.input_shape} {lite_model.input_shape}"
+    n_features = keras_model.input_shape[1]
+
+    files = []
+    for directory in FEATURE_DIRS:
+        files += sorted(glob.glob(os.path.join(REPO_DIR, directory, "*.txt")))[:MAX_FILES // len(FEATURE_DIRS)]
+    vectors = []
+    if files:
+        feature_list, feature_to_index = load_feature_list()
+        vectors.append(vectorize_apks(files, feature_list, feature_to_index).astype(np.float32))
+    rng = np.random.default_rng(0)
+    random_vectors = np.zeros((RANDOM_VECTORS, n_features), dtype=np.float32)
+    for row in random_vectors:
+        columns = rng.choice(n_features, size=min(n_features, rng.integers(1, 300)), replace=False)
+        row[columns] = rng.integers(1, 20, size=len(columns))
+    vectors.append(random_vectors)
+    X = np.expand_dims(np.concatenate(vectors), axis=-1)
+    print(f"{len(files)} feature files + {RANDOM_VECTORS} random vectors, {n_features} features")
+
+    failed = False
+    for batch_size in BATCH_SIZES:
+        keras_scores, keras_seconds = score_all(keras_model, X, batch_size)
+        lite_scores, lite_seconds = score_all(lite_model, X, batch_size)
+        difference = float(np.max(np.abs(keras_scores - lite_scores)))
+        label_mismatches = int(np.sum((keras_scores >= 0.5) != (lite_scores >= 0.5)))
+        print(f"batch {batch_size:>4}: max |score difference| {difference:.2e}, label mismatches {label_mismatches}, "
+              f"keras {keras_seconds * 1000 / len(X):.2f}ms/vector, tflite {lite_seconds * 1000 / len(X):.2f}ms/vector")
+        failed |= difference > tolerance
+
+    print("FAILED: scores differ by more than the tolerance" if failed else f"OK: within {tolerance}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,131 @@
+"""
+TFLite export and serving of the CNN
+
+keras.models.load_model pulls in the whole TensorFlow runtime (GBs of RAM per worker) to run the small 1D CNN from
+CNN.ipynb. export_tflite() converts the saved .keras model once, TFLiteModel runs the .tflite file with only the
+TFLite interpreter, from the first package found:
+    ai_edge_litert      (pip install ai-edge-litert)
+    tflite_runtime      (pip install tflite-runtime, older name)
+    tensorflow          (tf.lite.Interpreter, no memory saved but the same results)
+
+Backend switch: predict.load_model (and so app.py, predict.py, evaluate.py and predict_daemon.py) loads any
+*.tflite model path with TFLiteModel, e.g. MODEL_PATH=apk_malware_cnn_model.tflite for app.py.
+The export copies the model's feature index stamp, so check_model still checks the .tflite against the index.
+
+Usage:
+    python tflite_model.py [apk_malware_cnn_model.keras] [out.tflite] [--float16 | --dynamic]
+    python testFunctions/CheckTFLiteParity.py     # compares the exported model with the keras model
+"""
+
+import os
+import sys
+import shutil
+import threading
+import numpy as np
+
+from feature_index import stamp_path
+
+TFLITE_SUFFIX = ".tflite"
+QUANTIZATIONS = ("none", "float16", "dynamic") # float16 halves the file, dynamic stores int8 weights, both change scores slightly
+
+def tflite_path(model_path: str) -> str:
+    """
+    apk_malware_cnn_model.keras -> apk_malware_cnn_model.tflite
+    """
+    return os.path.splitext(model_path)[0] + TFLITE_SUFFIX
+
+def export_tflite(model_path: str, out_path: str | None = None, quantization: str = "none") -> str:
+    """
+    Converts a saved Keras model to TFLite, needs TensorFlow
+
+    Args:
+        model_path (str): .keras model
+        out_path (str): .tflite file, defaults to model_path with the .tflite extension
+        quantization (str): one of QUANTIZATIONS
+    Returns:
+        str: path of the written .tflite model
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization must be one of {QUANTIZATIONS}, got {quantization}")
+    import tensorflow as tf
+
+    out_path = out_path or tflite_path(model_path)
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(converter.convert())
+    os.replace(tmp_path, out_path)
+
+    # Same columns as the keras model, let check_model() verify the .tflite too
+    if os.path.exists(stamp_path(model_path)):
+        shutil.copyfile(stamp_path(model_path), stamp_path(out_path))
+    else:
+        print(f"[WARN] {model_path} has no feature index stamp, {out_path} can't be checked against the index either")
+    return out_path
+
+def _interpreter_class():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+class TFLiteModel:
+    """
+    A .tflite model with the parts of the Keras model API the serving code uses: input_shape and predict_on_batch
+
+    Args:
+        model_path (str): .tflite file from export_tflite()
+        num_threads (int): interpreter threads, None lets TFLite choose
+    """
+
+    def __init__(self, model_path: str, num_threads: int | None = None):
+        self.model_path = model_path
+        self.interpreter = _interpreter_class()(model_path=model_path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None, *(int(size) for size in self._input["shape"][1:])) # Like keras: (None, n_features, 1)
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock() # One interpreter, calls from request threads take turns
+        self.interpreter.allocate_tensors()
+
+    def predict_on_batch(self, x) -> np.ndarray:
+        """
+        Scores a [batch, n_features, 1] array, returns [batch, 1] like the Keras model
+        """
+        x = np.asarray(x, dtype=self._input["dtype"])
+        with self._lock:
+            if x.shape[0] != self._batch_size: # Exported with a dynamic batch dimension, resizing reallocates the tensors
+                self.interpreter.resize_tensor_input(self._input["index"], list(x.shape))
+                self.interpreter.allocate_tensors()
+                self._batch_size = x.shape[0]
+            self.interpreter.set_tensor(self._input["index"], x)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output["index"]).copy()
+
+    def predict(self, x, verbose=0) -> np.ndarray:
+        return self.predict_on_batch(x)
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    flags = [arg[2:] for arg in sys.argv[1:] if arg.startswith("--")]
+    if len(flags) > 1 or any(flag not in QUANTIZATIONS for flag in flags):
+        print("Usage: python tflite_model.py [apk_malware_cnn_model.keras] [out.tflite] [--float16 | --dynamic]")
+        sys.exit(1)
+
+    model_path = args[0] if args else "apk_malware_cnn_model.keras"
+    if not os.path.exists(model_path):
+        print(f"Error: Model file not found: {model_path}")
+        sys.exit(1)
+    out_path = export_tflite(model_path, args[1] if len(args) > 1 else None, flags[0] if flags else "none")
+    print(f"[INFO] Wrote {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB, keras model {os.path.getsize(model_path) / 1e6:.1f} MB)")
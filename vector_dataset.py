@@ -0,0 +1,200 @@
+"""
+Memory mapped training dataset: shuffled mini-batches without loading or converting the whole matrix
+
+np.load(X_vectors.npy) + X.astype("float32") + train_test_split holds the matrix in RAM three or more times.
+VectorDataset keeps the vectors in the file (np.load mmap_mode="r"), splits and shuffles row indices only,
+and converts one batch at a time to float32, so corpora larger than RAM can be trained on.
+
+Accepted vector files:
+    .npy          dense matrix from vectorizeFeatures.py (vectors.npy) or generate_vectors.py (X_vectors.npy)
+    .npz          CSR matrix from the SPARSE builders, saved uncompressed so it can be memory mapped
+    directory     bit-packed vectors from packed_vectors.py
+
+Only numpy/scipy are needed, tensorflow is imported by to_tf_dataset() alone
+
+Usage:
+    dataset = VectorDataset("X_vectors.npy", "y_labels.npy", expand_dims=True)
+    train_idx, test_idx = stratified_split(dataset.labels, test_size=0.2, random_state=42)
+    model.fit(dataset.to_tf_dataset(train_idx, batch_size=32, shuffle=True), epochs=10)
+"""
+
+import os
+import struct
+import zipfile
+import numpy as np
+from scipy import sparse
+
+DEFAULT_BATCH_SIZE = 32
+CSR_CHUNK_ROWS = 1024 # Rows of dense or packed vectors converted to CSR at a time by load_csr_matrix
+
+def _memmap_npz_member(npz_path: str, info: zipfile.ZipInfo) -> np.ndarray:
+    """
+    Memory maps one uncompressed .npy member of an .npz file in place
+    """
+    with open(npz_path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject or int(np.prod(shape)) == 0: # Nothing to map
+        return np.load(npz_path, allow_pickle=False)[info.filename.removesuffix(".npy")]
+    return np.memmap(npz_path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+def load_sparse_matrix(npz_path: str, mmap: bool = True) -> sparse.csr_matrix:
+    """
+    Loads a CSR matrix saved with scipy.sparse.save_npz
+    With mmap the CSR arrays stay in the file and are paged in as rows are used, compressed files fall back to load_npz
+    """
+    if mmap:
+        with zipfile.ZipFile(npz_path) as npz:
+            members = {info.filename.removesuffix(".npy"): info for info in npz.infolist()}
+            stored = all(info.compress_type == zipfile.ZIP_STORED for info in members.values())
+        if stored and {"data", "indices", "indptr", "shape"} <= members.keys():
+            arrays = {key: _memmap_npz_member(npz_path, members[key]) for key in ("data", "indices", "indptr")}
+            shape = tuple(int(n) for n in _memmap_npz_member(npz_path, members["shape"]))
+            return sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False)
+    return sparse.load_npz(npz_path).tocsr()
+
+def stratified_split(labels: np.ndarray, test_size: float = 0.2, random_state: int | None = None,
+                     indices: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stratified train/test split of row indices, the vectors themselves are never copied
+
+    Args:
+        labels (np.ndarray): label of every row in the dataset
+        test_size (float): fraction of each class that goes to the test side
+        random_state (int): seed
+        indices (np.ndarray): split only these rows (e.g. train indices again for a validation split), defaults to every row
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (train indices, test indices), each shuffled
+    """
+    rng = np.random.default_rng(random_state)
+    indices = np.arange(len(labels)) if indices is None else np.asarray(indices)
+    subset_labels = np.asarray(labels)[indices]
+
+    train, test = [], []
+    for label in np.unique(subset_labels):
+        class_indices = rng.permutation(indices[subset_labels == label])
+        n_test = int(round(len(class_indices) * test_size))
+        test.append(class_indices[:n_test])
+        train.append(class_indices[n_test:])
+    train = rng.permutation(np.concatenate(train)) if train else indices[:0]
+    test = rng.permutation(np.concatenate(test)) if test else indices[:0]
+    return train, test
+
+class VectorDataset:
+    """
+    Read only dataset over memory mapped vectors
+
+    Args:
+        vectors_path (str): .npy, .npz or packed vectors directory (see module docstring)
+        labels_path (str): .npy labels, loaded into memory (one value per row)
+        dtype: dtype of the batches handed to the model
+        expand_dims (bool): add a trailing channel axis, (n, F) -> (n, F, 1), for the 1D CNN
+    """
+
+    def __init__(self, vectors_path: str, labels_path: str | None = None, dtype=np.float32, expand_dims: bool = False):
+        self.vectors_path = vectors_path
+        self.dtype = np.dtype(dtype)
+        self.expand_dims = expand_dims
+        self._packed = None
+
+        if os.path.isdir(vectors_path):
+            import packed_vectors # NOTE: imported here, it pulls in vectorizeFeatures and FeatureExtractor
+            self._packed = packed_vectors.PackedVectors(vectors_path)
+            self.vectors = self._packed.packed
+            self.n_features = self._packed.n_features
+        elif vectors_path.endswith(".npz"):
+            self.vectors = load_sparse_matrix(vectors_path)
+            self.n_features = self.vectors.shape[1]
+        else:
+            self.vectors = np.load(vectors_path, mmap_mode="r")
+            self.n_features = self.vectors.shape[1]
+
+        self.labels = np.load(labels_path) if labels_path else None
+        if self.labels is not None and len(self.labels) != len(self):
+            raise ValueError(f"[ERROR] {labels_path} has {len(self.labels)} labels for {len(self)} vectors")
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return (len(self), self.n_features, 1) if self.expand_dims else (len(self), self.n_features)
+
+    def batch(self, indices: np.ndarray | slice) -> np.ndarray:
+        """
+        Reads and converts the selected rows, only this batch is ever in memory as self.dtype
+        """
+        if isinstance(indices, slice):
+            rows = self._read_rows(indices)
+        else:
+            indices = np.asarray(indices)
+            order = np.argsort(indices, kind="stable") # Sorted reads are sequential in the mapped file
+            rows = np.empty((len(indices), self.n_features), dtype=self.dtype)
+            rows[order] = self._read_rows(indices[order])
+        return rows[..., np.newaxis] if self.expand_dims else rows
+
+    def _read_rows(self, index) -> np.ndarray:
+        if self._packed is not None:
+            return self._packed.rows(index, self.dtype)
+        if sparse.issparse(self.vectors):
+            return self.vectors[index].toarray().astype(self.dtype, copy=False)
+        return np.asarray(self.vectors[index], dtype=self.dtype)
+
+    def iter_batches(self, batch_size: int = DEFAULT_BATCH_SIZE, indices: np.ndarray | None = None,
+                     shuffle: bool = False, seed: int | np.random.Generator | None = None):
+        """
+        Yields (X, y) mini-batches, y is None without labels
+
+        Args:
+            batch_size (int): rows per batch
+            indices (np.ndarray): rows to read (e.g. the train side of stratified_split), defaults to every row
+            shuffle (bool): shuffle the row order on every pass
+            seed (int | np.random.Generator): seed for the shuffle
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        if shuffle:
+            indices = np.random.default_rng(seed).permutation(indices)
+        for start in range(0, len(indices), batch_size):
+            batch_indices = indices[start:start + batch_size]
+            yield self.batch(batch_indices), None if self.labels is None else self.labels[batch_indices]
+
+    def to_tf_dataset(self, indices: np.ndarray | None = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                      shuffle: bool = False, seed: int | None = None):
+        """
+        Wraps iter_batches in a tf.data.Dataset of (X, y) batches, reshuffled every epoch when shuffle is set
+        Batches are produced from the mapped file as the model consumes them (prefetched), never all at once
+        """
+        import tensorflow as tf
+
+        rng = np.random.default_rng(seed) # One generator for every epoch, so each epoch gets a new order
+        def generator():
+            for X, y in self.iter_batches(batch_size, indices, shuffle, rng):
+                # Labels go to keras as float32 whatever they were saved as (np.bool in vectorizeFeatures, int8 in generate_vectors)
+                yield X, np.zeros(len(X), dtype=np.float32) if y is None else y.astype(np.float32)
+
+        output_signature = (tf.TensorSpec(shape=(None,) + self.shape[1:], dtype=tf.as_dtype(self.dtype)),
+                            tf.TensorSpec(shape=(None,), dtype=tf.float32))
+        dataset = tf.data.Dataset.from_generator(generator, output_signature=output_signature)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+def load_csr_matrix(vectors_path: str, chunk_rows: int = CSR_CHUNK_ROWS) -> sparse.csr_matrix:
+    """
+    Any accepted vector file as one CSR matrix, for models that train on sparse input (sparse_model.py, lightgbm_model.py)
+    A .npz is memory mapped as is, dense and packed vectors are converted chunk_rows rows at a time, never densified whole
+    """
+    if vectors_path.endswith(".npz") and not os.path.isdir(vectors_path):
+        return load_sparse_matrix(vectors_path)
+    dataset = VectorDataset(vectors_path)
+    if len(dataset) == 0:
+        return sparse.csr_matrix((0, dataset.n_features), dtype=dataset.dtype)
+    return sparse.vstack([sparse.csr_matrix(dataset.batch(slice(start, start + chunk_rows)))
+                          for start in range(0, len(dataset), chunk_rows)], format="csr")
@@ -1,23 +1,17 @@
 import os
 import csv
+import time
+import multiprocessing
 import numpy as np
+from scipy import sparse
 
 # TODO: need a function that makes new vectors according to the unique features from a previous set
 
 # TODO: Remove, not using these libraries because we are not training here
 #from sklearn.model_selection import train_test_split 
 #from tensorflow.keras import models, layers  # type: ignore
-import FeatureExtractor # Can use reload_unique_features, unique_features dictionary, and constants like FEATURE_TYPES
-
-# NOTE: FEATURE_TYPES does not need to be created because it exists in FeatureExtractor.FEATURE_TYPES
-'''FEATURE_TYPES: list[str] = [
-    "permissions", 
-    "used_hsware", 
-    "intents", 
-    "api_calls", 
-    "libraries", 
-    "urls"
-]'''
+import vector_dataset
+from feature_index import FeatureIndex, FEATURE_INDEX_FILENAME, read_unique_feature_files, write_feature_index, parse_tagged_line # Shared compiled feature index
 
 ROOT_DIRECTORY = r"..\reduced_extracted_features"
 #ROOT_DIRECTORY = (r".\exampleFeatures") # TODO: Maybe make test mode?
@@ -28,8 +22,10 @@ IN_DIRECTORY_UNIQUE = os.path.join(ROOT_DIRECTORY, r'unique_features')
 
 OUT_DIRECTORY = r"..\vectors"
 VECTORS_FILENAME = r"vectors.npy"
+SPARSE_VECTORS_FILENAME = r"vectors.npz" # CSR matrix from build_sparse_vector_dataset, saved with scipy.sparse.save_npz
 LABELS_FILENAME = r"labels.npy"
 NAMES_FILENAME = r"names.npy"
+FEATURE_INDEX_PATH = os.path.join(OUT_DIRECTORY, FEATURE_INDEX_FILENAME) # Compiled index the vectors were built with
 
 # Directory to print vectors to, to test if they are printing consistently
 READABLE_DIRECTORY = r"..\readable_vectors"
@@ -37,73 +33,108 @@ READABLE_DIRECTORY = r"..\readable_vectors"
 # Control Switchs:
 LOAD = False # Loads Vectors from file instead of building and saving
 PRINT = True # Prints Vectors to file so they can be compared
+SPARSE = False # Builds a scipy.sparse CSR matrix instead of a dense one, under 1% of the features are set in a real vector
+PACKED = False # Builds bit-packed vectors (packed_vectors.py), 8 features per byte
+WORKERS = os.cpu_count() or 1 # Processes for the SPARSE and PACKED builders, 1 runs in this process
 
-# NOTE: Shouldn't use reload_unique_features() from FeatureExtractor because it is easier if the dictionary combines every feature type into one
-def load_unique_feature_index(unique_dir: str) -> dict[str, np.float32]:    
-    unique_feature_index: dict[str : np.float32] = {}
-    index = 0 # NOTE: switched list to a counter instead to avoid traversing the dictionary twice
+OUTPUT_SPARSE = "sparse"
+OUTPUT_PACKED = "packed"
+SHARD_SIZE = 500 # Feature files per worker task
+PROGRESS_INTERVAL = 5.0 # Seconds between progress prints
 
-    for feature_type, feature_tag in zip(FeatureExtractor.FEATURE_TYPES, FeatureExtractor.FEATURE_TAGS):
-        filename = f"unique_{feature_type}.txt"
-        file_path = os.path.join(unique_dir, filename)
+# NOTE: Shouldn't use reload_unique_features() from FeatureExtractor because it is easier if the dictionary combines every feature type into one
+def load_unique_feature_index(unique_dir: str, index_path: str = FEATURE_INDEX_PATH) -> FeatureIndex:
+    '''
+    Compiles the unique_*.txt files into the shared feature index (feature_index.py) and opens it
+    NOTE: keys are "Tag: feature" in the unique file order predict/generate_vectors use, they used to be bare features in
+    FEATURE_TYPES order, so vectors from here and from generate_vectors now have the same columns
+    '''
+    feature_list = read_unique_feature_files(unique_dir)
+    if not feature_list:
+        print(f"[WARN] No unique features found in: {unique_dir}")
+        return {}
+    write_feature_index(index_path, feature_list)
 
-        if not os.path.isfile(file_path):
-            print(f"[WARN] Unique feature file not found, skipping: {file_path}")
-            continue
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as file:
-            for line in file:
-                tag, _, body = line.partition(": ")
-                if tag != feature_tag:
-                    continue
-                parts = body.split()
-                if not parts:
-                    continue
-                feat_name = parts[0].strip()
-                if feat_name and feat_name not in unique_feature_index:
-                    unique_feature_index[feat_name] = index
-                    index += 1
-
-    print(f"[INFO] Loaded {len(unique_feature_index)} unique features from: {unique_dir}")
-    return unique_feature_index 
-    #return feat_list, feat_index # TODO: feat_list isn't needed, remove
+    print(f"[INFO] Loaded {len(feature_list)} unique features from: {unique_dir}")
+    return FeatureIndex(index_path)
 
-# Build dataset from malicious/benign feature dirs
-def build_vector_dataset(malicious_dir: str, benign_dir: str, feature_index: dict[str, int]) -> tuple[np.ndarray, np.ndarray, list[str]]:
+def _lookup_table(feature_index: dict[str, int] | FeatureIndex) -> dict[str, int]:
     '''
-    NOTE: NAME CHANGE: was load_vector_dataset, load_vector_dataset now loads from existing file
+    Plain dict for per line lookups, a FeatureIndex lookup is a hash and a binary search
     '''
+    return feature_index.to_dict() if isinstance(feature_index, FeatureIndex) else feature_index
 
-    assert feature_index is not None, "feature_index must be provided"
+# Build dataset from malicious/benign feature dirs
+def list_feature_files(malicious_dir: str, benign_dir: str) -> tuple[list[str], np.ndarray, list[str]]:
+    '''
+    The feature files of a dataset in row order: malicious then benign, file names sorted within each directory
+    Every builder uses this order, so rows, labels and names.npy always line up however the files are vectorized
 
-    #process = psutil.Process(os.getpid())
-    
-    input_size = len(feature_index)
-    vectors: list[np.ndarray] = []
+    Returns:
+        tuple[list[str], np.ndarray, list[str]]: file paths, labels (np.bool), file names
+    '''
+    paths: list[str] = []
     labels: list[int] = []
     names: list[str] = []
 
-    count = 0
-
     for label, feature_dir in [(1, malicious_dir), (0, benign_dir)]:
         if not os.path.isdir(feature_dir):
             print(f"[WARN] Feature directory not found, skipping: {feature_dir}")
             continue
 
-        for filename in os.listdir(feature_dir):
+        for filename in sorted(os.listdir(feature_dir)):
             if not filename.endswith(".txt"):
                 continue
-
-            file_path = os.path.join(feature_dir, filename)
-            #print(f"Memory Used: {process.memory_info().rss / 1024 ** 2:.2f} MB")
-            print(count)
-            count += 1
-            vector = feature_file_to_vector(file_path, feature_index, input_size)
-            vectors.append(vector)
+            paths.append(os.path.join(feature_dir, filename))
             labels.append(label)
             names.append(filename)
 
-    vector_arr = np.array(vectors, dtype=np.bool)
-    label_arr = np.array(labels, dtype=np.bool)
+    return paths, np.array(labels, dtype=np.bool), names
+
+class ProgressPrinter:
+    '''
+    Prints "[INFO] Vectorized n/total files" at most once every interval seconds, instead of a line per file
+    '''
+
+    def __init__(self, total: int, interval: float = PROGRESS_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.monotonic()
+        self.last_print = self.start
+
+    def update(self, count: int = 1):
+        self.done += count
+        now = time.monotonic()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            self.print(now)
+
+    def print(self, now: float | None = None):
+        elapsed = (now or time.monotonic()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        print(f"[INFO] Vectorized {self.done}/{self.total} files ({rate:.0f} files/s)")
+
+def build_vector_dataset(malicious_dir: str, benign_dir: str, feature_index: dict[str, int]) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    '''
+    NOTE: NAME CHANGE: was load_vector_dataset, load_vector_dataset now loads from existing file
+    '''
+
+    assert feature_index is not None, "feature_index must be provided"
+
+    #process = psutil.Process(os.getpid())
+    
+    input_size = len(feature_index)
+    paths, label_arr, names = list_feature_files(malicious_dir, benign_dir)
+    vector_arr = np.zeros((len(paths), input_size), dtype=np.bool) # NOTE: filled in place, was a list of int8 rows copied into this at the end
+    lookup = _lookup_table(feature_index)
+    progress = ProgressPrinter(len(paths))
+
+    for row, file_path in enumerate(paths):
+        #print(f"Memory Used: {process.memory_info().rss / 1024 ** 2:.2f} MB")
+        vector_arr[row, feature_file_to_indices(file_path, lookup)] = True
+        progress.update()
+    progress.print()
 
     print(f"[INFO] Loaded Vector dataset: {vector_arr.shape[0]} samples, {vector_arr.shape[1]} features")
     return vector_arr, label_arr, names
@@ -111,18 +142,115 @@ def build_vector_dataset(malicious_dir: str, benign_dir: str, feature_index: dic
 def feature_file_to_vector(feature_file_path: str, feature_index: dict[str, int], dimension: int) -> np.ndarray:
     
     vector = np.zeros(dimension, dtype=np.int8)
+    vector[feature_file_to_indices(feature_file_path, feature_index)] = 1#.0
+    return vector
 
+def feature_file_to_indices(feature_file_path: str, feature_index: dict[str, int]) -> np.ndarray:
+    '''
+    Returns the sorted feature_index positions of the features in a feature file, the set entries of its vector
+    NOTE: lines are "Tag: feature" or "Tag: feature count", the count is dropped and "Tag: feature" is looked up
+    '''
+    columns = set()
     try:
-        with open(feature_file_path, "r") as file:
+        with open(feature_file_path, "r", encoding="utf-8", errors="ignore") as file:
             for line in file:
-                feature = line.strip()
-                if feature in feature_index:
-                    vector[feature_index[feature]] = 1#.0
-        file.close()
+                parsed = parse_tagged_line(line)
+                if parsed is not None and parsed[0] in feature_index:
+                    columns.add(feature_index[parsed[0]])
     except Exception as e:
         print(f"[ERROR] Failed to read features from {feature_file_path}: {e}")
 
-    return vector
+    return np.array(sorted(columns), dtype=np.int32)
+
+def build_sparse_vector_dataset(malicious_dir: str, benign_dir: str, feature_index: dict[str, int]) -> tuple[sparse.csr_matrix, np.ndarray, list[str]]:
+    '''
+    Same rows, labels and names as build_vector_dataset, but as a CSR matrix
+    Only the set positions are kept, no dense row is ever allocated
+    '''
+    return build_vector_dataset_parallel(malicious_dir, benign_dir, feature_index, workers=1, output=OUTPUT_SPARSE)
+
+# Parallel vectorization
+_worker_feature_index: dict[str, int] = {} # Set once per worker process by _init_vectorize_worker
+
+def _init_vectorize_worker(feature_index: dict[str, int]):
+    global _worker_feature_index
+    _worker_feature_index = _lookup_table(feature_index) # A FeatureIndex is pickled as its path and reopened here
+
+def _vectorize_shard(shard: tuple[list[str], str, int]) -> tuple[np.ndarray, np.ndarray] | np.ndarray:
+    '''
+    Vectorizes one shard of feature files, runs in a worker process
+
+    Returns:
+        (columns, row lengths) for OUTPUT_SPARSE, packed rows (uint8) for OUTPUT_PACKED
+    '''
+    paths, output, dimension = shard
+    rows = [feature_file_to_indices(file_path, _worker_feature_index) for file_path in paths]
+    lengths = np.array([len(columns) for columns in rows], dtype=np.int64)
+    columns = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+    if output == OUTPUT_SPARSE:
+        return columns, lengths
+
+    import packed_vectors # NOTE: imported here, packed_vectors imports this module
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    partial = sparse.csr_matrix((np.ones(len(columns), dtype=np.int8), columns, indptr), shape=(len(paths), dimension))
+    return packed_vectors.pack_vectors(partial)
+
+def build_vector_dataset_parallel(malicious_dir: str, benign_dir: str, feature_index: dict[str, int], workers: int = WORKERS,
+                                  output: str = OUTPUT_SPARSE, shard_size: int = SHARD_SIZE) -> tuple[sparse.csr_matrix | np.ndarray, np.ndarray, list[str]]:
+    '''
+    Vectorizes the dataset with a pool of worker processes
+
+    The file list (list_feature_files) is cut into shards of shard_size files, each worker builds a partial sparse
+    or packed matrix for its shard, and the partials are merged in shard order, so row i is always names[i]
+    no matter which worker finished first
+
+    Args:
+        workers (int): worker processes, 1 vectorizes in this process
+        output (str): OUTPUT_SPARSE for a CSR matrix, OUTPUT_PACKED for packed_vectors rows (uint8, 8 features per byte)
+        shard_size (int): files per task
+    Returns:
+        tuple[sparse.csr_matrix | np.ndarray, np.ndarray, list[str]]: vectors, labels, names
+    '''
+    assert feature_index is not None, "feature_index must be provided"
+    if output not in (OUTPUT_SPARSE, OUTPUT_PACKED):
+        raise ValueError(f"output must be {OUTPUT_SPARSE} or {OUTPUT_PACKED}, got {output}")
+
+    dimension = len(feature_index)
+    paths, label_arr, names = list_feature_files(malicious_dir, benign_dir)
+    shards = [(paths[start:start + shard_size], output, dimension) for start in range(0, len(paths), shard_size)]
+    progress = ProgressPrinter(len(paths))
+    partials = []
+
+    if workers <= 1:
+        _init_vectorize_worker(feature_index)
+        for shard in shards:
+            partials.append(_vectorize_shard(shard))
+            progress.update(len(shard[0]))
+    else:
+        # NOTE: spawn like ParallelExtractor, the index is sent once per worker through the initializer, not with every shard
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=_init_vectorize_worker, initargs=(feature_index,)) as pool:
+            for shard, partial in zip(shards, pool.imap(_vectorize_shard, shards)): # imap returns results in shard order
+                partials.append(partial)
+                progress.update(len(shard[0]))
+    progress.print()
+
+    if output == OUTPUT_PACKED:
+        vectors = np.concatenate(partials) if partials else np.zeros((0, (dimension + 7) // 8), dtype=np.uint8)
+        print(f"[INFO] Loaded packed Vector dataset: {vectors.shape[0]} samples, {dimension} features")
+        return vectors, label_arr, names
+
+    columns = np.concatenate([partial[0] for partial in partials]) if partials else np.zeros(0, dtype=np.int32)
+    lengths = np.concatenate([partial[1] for partial in partials]) if partials else np.zeros(0, dtype=np.int64)
+    index_dtype = np.int32 if len(columns) < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(len(lengths) + 1, dtype=index_dtype)
+    np.cumsum(lengths, out=indptr[1:])
+    vector_matrix = sparse.csr_matrix((np.ones(len(columns), dtype=np.int8), columns.astype(index_dtype, copy=False), indptr),
+                                      shape=(len(names), dimension))
+
+    density = vector_matrix.nnz / max(1, vector_matrix.shape[0] * vector_matrix.shape[1])
+    print(f"[INFO] Loaded sparse Vector dataset: {vector_matrix.shape[0]} samples, {vector_matrix.shape[1]} features, {density:.4%} dense")
+    return vector_matrix, label_arr, names
 
 # save computed vectors for future use
 def save_vector_dataset(out_dir: str, vectors: np.ndarray, labels: np.ndarray, names: list[str]):
@@ -133,16 +261,42 @@ def save_vector_dataset(out_dir: str, vectors: np.ndarray, labels: np.ndarray, n
     np.save(os.path.join(out_dir, LABELS_FILENAME), labels)
     np.save(os.path.join(out_dir, NAMES_FILENAME), np.array(names))
 
-def load_vector_dataset(in_dir: str) -> tuple[np.ndarray, np.ndarray, list[str]]:
+def save_sparse_vector_dataset(out_dir: str, vectors: sparse.csr_matrix, labels: np.ndarray, names: list[str]):
+    '''
+    Saves the CSR matrix uncompressed so load_sparse_vector_dataset can memory map it, labels and names are saved like save_vector_dataset
+    '''
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    sparse.save_npz(os.path.join(out_dir, SPARSE_VECTORS_FILENAME), vectors, compressed=False)
+    np.save(os.path.join(out_dir, LABELS_FILENAME), labels)
+    np.save(os.path.join(out_dir, NAMES_FILENAME), np.array(names))
+
+def load_sparse_vector_dataset(in_dir: str, mmap: bool = True) -> tuple[sparse.csr_matrix, np.ndarray, list[str]]:
+    '''
+    Loads a dataset saved by save_sparse_vector_dataset
+    With mmap the CSR arrays stay in the file and are paged in as rows are used, instead of being read up front
+    '''
+    vectors_path = os.path.join(in_dir, SPARSE_VECTORS_FILENAME)
+    if not os.path.exists(vectors_path):
+        raise FileNotFoundError(f"[ERROR] {vectors_path} does not exist")
+
+    vector_matrix = vector_dataset.load_sparse_matrix(vectors_path, mmap)
+    labels = np.load(os.path.join(in_dir, LABELS_FILENAME))
+    names = np.load(os.path.join(in_dir, NAMES_FILENAME)).tolist()
+    return vector_matrix, labels, names
+
+def load_vector_dataset(in_dir: str, mmap: bool = True) -> tuple[np.ndarray, np.ndarray, list[str]]:
     '''
     NOTE: NAME CHANGE: THIS READS FROM AN EXISTING .npy FILE, DOES NOT BUILD DATASET
+    With mmap the vectors are memory mapped read only (rows are read as they are used), see vector_dataset.VectorDataset for batches
     '''
     vectors = any #np.ndarray() # TODO: maybe throw an exception, don't like returning empty objects
     labels = any #np.ndarray()
     names = list[str]
 
     if os.path.exists(in_dir):
-        vectors = np.load(os.path.join(in_dir, VECTORS_FILENAME))
+        vectors = np.load(os.path.join(in_dir, VECTORS_FILENAME), mmap_mode="r" if mmap else None)
         labels = np.load(os.path.join(in_dir, LABELS_FILENAME))
         names = np.load(os.path.join(in_dir, NAMES_FILENAME)).tolist()
     else:
@@ -218,19 +372,38 @@ if __name__ == "__main__":
         #print_dict(feature_index)
         
         # Build feature vectors for example APKs
-        vectors, labels, names = build_vector_dataset(IN_DIRECTORY_MALICIOUS, IN_DIRECTORY_BENIGN, feature_index)
+        if PACKED:
+            vectors, labels, names = build_vector_dataset_parallel(IN_DIRECTORY_MALICIOUS, IN_DIRECTORY_BENIGN, feature_index, WORKERS, OUTPUT_PACKED)
+        elif SPARSE:
+            vectors, labels, names = build_vector_dataset_parallel(IN_DIRECTORY_MALICIOUS, IN_DIRECTORY_BENIGN, feature_index, WORKERS, OUTPUT_SPARSE)
+        else:
+            vectors, labels, names = build_vector_dataset(IN_DIRECTORY_MALICIOUS, IN_DIRECTORY_BENIGN, feature_index)
 
         # Check that features were actually loaded
-        if vectors.size == 0:
+        if vectors.shape[0] == 0:
             raise SystemExit(
                 "[FATAL] No samples were loaded. Check that exampleFeatures/"
                 "malicious_features and exampleFeatures/benign_features contain .txt files."
             )
         
-        save_vector_dataset(OUT_DIRECTORY, vectors, labels, names)
+        if PACKED:
+            import packed_vectors
+            packed_vectors.save_packed_vectors(OUT_DIRECTORY, vectors, len(feature_index))
+            np.save(os.path.join(OUT_DIRECTORY, LABELS_FILENAME), labels)
+            np.save(os.path.join(OUT_DIRECTORY, NAMES_FILENAME), np.array(names))
+        elif SPARSE:
+            save_sparse_vector_dataset(OUT_DIRECTORY, vectors, labels, names)
+        else:
+            save_vector_dataset(OUT_DIRECTORY, vectors, labels, names)
+    elif PACKED:
+        import packed_vectors
+        vectors = packed_vectors.PackedVectors(OUT_DIRECTORY) # Unpacked a batch at a time by its reader, not loaded here
+        labels, names = vectors.labels, vectors.names
+    elif SPARSE:
+        vectors, labels, names = load_sparse_vector_dataset(OUT_DIRECTORY)
     else:
         vectors, labels, names = load_vector_dataset(OUT_DIRECTORY)
 
     # Vector tests
-    if PRINT:
+    if PRINT and not (SPARSE or PACKED): # NOTE: the readable dump is a dense text file, not useful at sparse scale
         print_vectors_to_file(READABLE_DIRECTORY, vectors, labels, names)
\ No newline at end of file
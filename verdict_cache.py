@@ -0,0 +1,200 @@
+"""
+Verdict cache for app.py
+
+Repackaged samples of a malware family and updates of the same app often reduce to exactly the same features,
+and every /predict call still ran the CNN on them. VerdictCache keeps the model's score per feature set:
+    key      hash of the sorted (column, count) entries of a feature file plus the model version,
+             so the same features in any line order hit, and any count difference misses like the model input would
+    value    the model's score, the request's feature_count is still computed per request
+    eviction least recently used past max_entries, entries older than ttl seconds are dropped on lookup
+
+The model version is the sha256 of the model file plus the feature index's sha256. Loading a different model or
+feature index (set_version) empties the cache, and a persisted cache written for another version is not loaded.
+
+Usage:
+    cache = VerdictCache(model_version(model_path, feature_to_index), path="verdict_cache.json")
+    keys = feature_keys(rows, columns, counts, len(texts), cache.version)   # FeatureVectorizer.entries()
+    scores = cache.get_many(keys)                                           # None where the model has to run
+    cache.put_many(missing_keys, missing_scores)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 100_000 # ~150 bytes each
+DEFAULT_TTL = 7 * 24 * 3600 # Seconds, verdicts are only stale once the model changes, the TTL bounds surprises
+CACHE_FORMAT = 1
+
+def file_digest(path: str) -> str:
+    """
+    sha256 of a file, read in 1MB blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def model_version(model_path: str, feature_to_index=None) -> str:
+    """
+    Identifies the model + feature index pair a score came from
+
+    Args:
+        model_path (str): saved model file
+        feature_to_index: feature_index.FeatureIndex (its sha256 is used), a plain dict only contributes its size
+    """
+    index_version = getattr(feature_to_index, "sha256", None) or f"dict{len(feature_to_index or ())}"
+    return f"{file_digest(model_path)[:16]}:{index_version[:16]}"
+
+def feature_keys(rows: np.ndarray, columns: np.ndarray, counts: np.ndarray, n_rows: int, version: str) -> list[str]:
+    """
+    Cache key of every row of FeatureVectorizer.entries() output
+
+    Args:
+        rows, columns, counts (np.ndarray): set entries, at most one per (row, column)
+        n_rows (int): number of feature files, rows without entries get the key of the empty feature set
+        version (str): model version, part of every key
+    Returns:
+        list[str]: hex key per row
+    """
+    order = np.lexsort((columns, rows))
+    pairs = np.stack([columns[order], counts[order]], axis=1).astype("<i8")
+    bounds = np.searchsorted(rows[order], np.arange(n_rows + 1))
+    prefix = version.encode()
+    keys = []
+    for i in range(n_rows):
+        digest = hashlib.blake2b(prefix, digest_size=16)
+        digest.update(pairs[bounds[i]:bounds[i + 1]].tobytes())
+        keys.append(digest.hexdigest())
+    return keys
+
+class VerdictCache:
+    """
+    Thread safe LRU + TTL map of feature set key -> model score
+
+    Args:
+        version (str): model version the scores belong to (model_version())
+        max_entries (int): entries kept before the least recently used are evicted
+        ttl (float): seconds an entry is valid
+        path (str): JSON file the cache is loaded from and saved to (save()), None keeps it in memory only
+    """
+
+    def __init__(self, version: str, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL, path: str | None = None):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict() # key -> (score, expiry as time.time())
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_version(self, version: str):
+        """
+        Switches to a newly loaded model or feature index, the old scores are dropped
+        """
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_many(self, keys: list[str]) -> list[float | None]:
+        """
+        Score of every key, None for keys that are missing or expired
+        """
+        now = time.time()
+        scores = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] <= now:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    scores.append(None)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    scores.append(entry[0])
+        return scores
+
+    def put_many(self, keys: list[str], scores: list[float]):
+        expiry = time.time() + self.ttl
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._entries[key] = (float(score), expiry)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'version': self.version,
+            'persistent': self.path is not None
+        }
+
+    def load(self, path: str):
+        """
+        Loads entries saved for the current version, a file for another version (or an unreadable one) is ignored
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Could not read verdict cache {path}: {e}")
+            return
+        if saved.get("format") != CACHE_FORMAT or saved.get("version") != self.version:
+            print(f"[INFO] {path} was saved for another model or feature index, starting with an empty verdict cache")
+            return
+        now = time.time()
+        with self._lock:
+            for key, score, expiry in saved.get("entries", []): # Oldest first, so the LRU order survives
+                if expiry > now:
+                    self._entries[key] = (score, expiry)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self, path: str | None = None):
+        """
+        Writes the cache to path (default: the path it was created with), atomically
+        """
+        path = path or self.path
+        if path is None:
+            return
+        with self._lock:
+            saved = {
+                "format": CACHE_FORMAT,
+                "version": self.version,
+                "entries": [[key, score, expiry] for key, (score, expiry) in self._entries.items()]
+            }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,20 @@
+"""
+WSGI entry point for app.py
+
+Loads the model once and exposes the Flask app as `application` for a production server:
+
+    waitress-serve --host=0.0.0.0 --port=5000 --threads=16 wsgi:application      (Windows and Linux)
+    gunicorn --workers=1 --threads=16 --bind=0.0.0.0:5000 wsgi:application       (Linux)
+
+Use one process with many threads. Every request thread hands its upload to the same MicroBatcher, so there is one
+model in memory and concurrent uploads are coalesced into one forward pass. Each extra process loads its own copy of
+the model and only batches its own requests, add processes only once one process's batches are full (BATCH_MAX_SIZE).
+
+Batching is configured with the BATCH_MAX_SIZE and BATCH_MAX_WAIT (seconds) environment variables,
+the verdict cache with VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL (seconds) and VERDICT_CACHE_PATH (saved on shutdown)
+"""
+
+from app import app, init_model
+
+init_model()
+application = app